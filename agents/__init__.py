@@ -1,3 +1,14 @@
 from agents.teacher import TeacherAgent
 from agents.student import StudentAgent
-from agents.intent import pick_intent, build_student_prompt
+from agents.intent import (
+    pick_intent,
+    pick_intent_llm,
+    apick_intent_llm,
+    classify_situation,
+    aclassify_situation,
+    classify_situation_proba,
+    aclassify_situation_proba,
+    pick_intent_for_situation,
+    pick_intent_for_distribution,
+    build_student_prompt,
+)
@@ -0,0 +1,166 @@
+"""Token-budgeted context windows for the agents.
+
+Every turn used to send the whole dialog, so input tokens grew
+quadratically over a lesson. A ContextPolicy keeps the most recent
+messages verbatim within a token budget; a ContextManager additionally
+replaces the older part with a rolling summary that is extended
+incrementally and cached for the dialog.
+"""
+
+import asyncio
+import logging
+import threading
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+
+from config.settings import CONTEXT_KEEP_RECENT, CONTEXT_SUMMARY_STEP
+from models.base import BaseProvider, LLMResponse, Message
+from models.tokens import estimate_tokens
+
+log = logging.getLogger(__name__)
+
+_SUMMARY_PROMPT = (
+    (Path(__file__).resolve().parent.parent / "prompts" / "context_summary.md")
+    .read_text(encoding="utf-8")
+    .strip()
+)
+_SUMMARY_HEADER = "[Краткое содержание начала диалога]"
+SUMMARY_MAX_TOKENS = 1024
+_MESSAGE_OVERHEAD = 4  # tokens per message, as in estimate_request_tokens
+
+
+@dataclass(frozen=True)
+class ContextPolicy:
+    """Which part of the history is sent verbatim.
+
+    max_tokens: token budget for the verbatim history (None = unlimited).
+    max_messages: hard cap on verbatim messages (None = unlimited).
+    keep_recent: messages always kept verbatim, even over budget.
+    summary_step: when the summary has to grow, it absorbs this many extra
+                  messages so it is not rewritten on every turn.
+    """
+    max_tokens: int | None = None
+    max_messages: int | None = None
+    keep_recent: int = CONTEXT_KEEP_RECENT
+    summary_step: int = CONTEXT_SUMMARY_STEP
+
+    def split(self, history: Sequence[Message]) -> int:
+        """Index of the first message to keep verbatim."""
+        kept, used = 0, 0
+        for msg in reversed(history):
+            if self.max_messages is not None and kept >= self.max_messages:
+                break
+            tokens = estimate_tokens(msg.content) + _MESSAGE_OVERHEAD
+            if (
+                self.max_tokens is not None
+                and kept >= self.keep_recent
+                and used + tokens > self.max_tokens
+            ):
+                break
+            kept += 1
+            used += tokens
+        return len(history) - kept
+
+    def trim(self, history: Sequence[Message]) -> list[Message]:
+        """Recent messages within the policy; older ones are dropped."""
+        return list(history[self.split(history):])
+
+
+# The situation classifier only needs the last few turns
+CLASSIFIER_CONTEXT = ContextPolicy(max_messages=10)
+
+
+class ContextManager:
+    """Fits one agent's history to its policy, summarizing older messages.
+
+    Owned per dialog and agent: the summary of messages [0, covered) is
+    cached and only extended when the verbatim part no longer fits.
+    """
+
+    def __init__(
+        self,
+        policy: ContextPolicy,
+        summarizer: BaseProvider | None = None,
+        labels: dict[str, str] | None = None,
+    ):
+        """
+        summarizer: provider for summary calls; None drops old messages instead.
+        labels: speaker name per role for the summary input
+                (e.g. {"assistant": "Репетитор", "user": "Ученик"}).
+        """
+        self.policy = policy
+        self.summarizer = summarizer
+        self.labels = labels or {"assistant": "Ассистент", "user": "Собеседник"}
+        self._lock = threading.Lock()
+        self._summary = ""
+        self._covered = 0
+        self._last_covered: Message | None = None  # detects a different dialog
+        # Summary call made by the last fit() (None if the cache was used)
+        self.summary_response: LLMResponse | None = None
+
+    def fit(self, history: Sequence[Message]) -> Sequence[Message]:
+        """History to send: [summary] + recent messages within the budget.
+
+        A history that already fits is returned as is (keeping the
+        transcript's encoding cache).
+        """
+        self.summary_response = None
+        cut = self.policy.split(history)
+        if cut == 0:
+            return history
+        if self.summarizer is None:
+            return list(history[cut:])
+
+        with self._lock:
+            if not self._cache_valid(history):
+                self._summary, self._covered, self._last_covered = "", 0, None
+            if cut > self._covered:
+                # Absorb a few extra messages so the next turns reuse the summary
+                limit = len(history) - self.policy.keep_recent
+                target = max(cut, min(cut + self.policy.summary_step, limit))
+                self._extend_summary(history, target)
+            summary, covered = self._summary, self._covered
+
+        if not summary:
+            # No summary yet (the call failed): send everything rather than lose the start
+            return history
+        # Messages the summary does not cover yet stay verbatim, even over budget
+        recent = list(history[covered:])
+        return [Message("user", f"{_SUMMARY_HEADER}\n{summary}")] + recent
+
+    async def afit(self, history: Sequence[Message]) -> Sequence[Message]:
+        """Async counterpart of fit (the summary call runs in a thread)."""
+        return await asyncio.to_thread(self.fit, history)
+
+    def _cache_valid(self, history: Sequence[Message]) -> bool:
+        if not self._covered:
+            return True
+        return len(history) >= self._covered and history[self._covered - 1] == self._last_covered
+
+    def _extend_summary(self, history: Sequence[Message], target: int):
+        transcript = "\n\n".join(
+            f"{self.labels.get(msg.role, msg.role)}: {msg.content}"
+            for msg in history[self._covered:target]
+        )
+        previous = self._summary or "(нет)"
+        request = f"Предыдущий конспект:\n{previous}\n\nСледующая часть диалога:\n{transcript}"
+        try:
+            response = self.summarizer.generate_response(
+                system_prompt=_SUMMARY_PROMPT,
+                history=[Message("user", request)],
+                temperature=0.3,
+                max_tokens=SUMMARY_MAX_TOKENS,
+            )
+        except Exception:
+            # Keep the old summary; fit() sends the uncovered messages verbatim
+            log.exception("Context summary failed")
+            return
+        if not response.text.strip():
+            log.warning("Context summary came back empty")
+            return
+        self.summary_response = response
+        self._summary = response.text.strip()
+        self._covered = target
+        self._last_covered = history[target - 1]
+        log.info("Summarized %d messages (%d chars)", target, len(self._summary))
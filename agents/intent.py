@@ -1,11 +1,13 @@
 """Intent selection and prompt composition for the student agent."""
 
+import json
 import logging
 import random
 from pathlib import Path
 
+from agents.context import CLASSIFIER_CONTEXT
 from config.defaults import MISTAKE_TYPES
-from models.base import BaseProvider, Message
+from models.base import BaseProvider, LLMResponse, Message
 
 log = logging.getLogger(__name__)
 
@@ -20,27 +22,241 @@ _ANSWER_CORRECT_PROMPT = (
 _ANSWER_WRONG_TEMPLATE = (
     (_PROMPTS_DIR / "intent_answer_wrong.md").read_text(encoding="utf-8").strip()
 )
+# Appended to any classifier template: asks for a distribution instead of one word
+_CLASSIFIER_JSON_SUFFIX = (
+    (_PROMPTS_DIR / "intent_classifier_json.md").read_text(encoding="utf-8").strip()
+)
+
+_FUSED_TEMPLATE = (_PROMPTS_DIR / "student_fused.md").read_text(encoding="utf-8").strip()
 
+CLASSIFIER_MAX_TOKENS = 256  # room for a JSON distribution over all situations
 
 
-def pick_mistake(mistake_weights: dict[str, int]) -> dict:
-    """Pick a mistake type by weights. Returns one MISTAKE_TYPES entry."""
+def pick_mistake(mistake_weights: dict[str, int], rng: random.Random | None = None) -> dict:
+    """Pick a mistake type by weights. Returns one MISTAKE_TYPES entry.
+
+    rng: source of randomness (the module-level one by default); every
+    random draw in this module takes one so that seeded runs repeat.
+    """
     ids = [m["id"] for m in MISTAKE_TYPES]
     weights = [mistake_weights.get(mid, 0) for mid in ids]
     if sum(weights) == 0:
         weights = [1] * len(ids)
-    chosen_id = random.choices(ids, weights=weights, k=1)[0]
+    chosen_id = (rng or random).choices(ids, weights=weights, k=1)[0]
     return next(m for m in MISTAKE_TYPES if m["id"] == chosen_id)
 
 
-def pick_intent(intent_weights: dict[str, int], intent_prompts: dict[str, str]) -> tuple[str, str]:
+def pick_intent(
+    intent_weights: dict[str, int],
+    intent_prompts: dict[str, str],
+    rng: random.Random | None = None,
+) -> tuple[str, str]:
     """Select a random intent based on weights.
 
     Returns (intent_id, intent_prompt).
     """
     ids = list(intent_weights.keys())
     weights = [intent_weights[i] for i in ids]
-    chosen_id = random.choices(ids, weights=weights, k=1)[0]
+    chosen_id = (rng or random).choices(ids, weights=weights, k=1)[0]
+    return chosen_id, intent_prompts[chosen_id]
+
+
+def situation_schema(situation_ids) -> dict:
+    """JSON schema of the structured classifier reply for *situation_ids*."""
+    ids = list(situation_ids)
+    return {
+        "type": "object",
+        "properties": {
+            "situation": {"type": "string", "enum": ids},
+            "probabilities": {
+                "type": "object",
+                "properties": {sid: {"type": "number"} for sid in ids},
+                "required": ids,
+            },
+        },
+        "required": ["situation", "probabilities"],
+    }
+
+
+def _classifier_request(history: list[Message], situation_ids, classifier_template: str) -> dict:
+    template = classifier_template or DEFAULT_CLASSIFIER_TEMPLATE
+    return {
+        "system_prompt": f"{template}\n\n{_CLASSIFIER_JSON_SUFFIX}",
+        # Classifier only needs recent context, not the full dialog
+        "history": CLASSIFIER_CONTEXT.trim(history),
+        "temperature": 0.3,
+        "max_tokens": CLASSIFIER_MAX_TOKENS,
+        "json_schema": situation_schema(situation_ids),
+    }
+
+
+def classify_situation_proba(
+    provider: BaseProvider,
+    history: list[Message],
+    situation_ids,
+    classifier_template: str = "",
+) -> tuple[dict[str, float] | None, LLMResponse | None]:
+    """Ask the LLM for a probability distribution over situations.
+
+    The reply is constrained to JSON where the provider supports it; a bare
+    situation id is still accepted and counts as certainty.
+    Returns (distribution or None if unparseable, raw classifier response or
+    None if the call failed).
+    """
+    situation_ids = list(situation_ids)
+    try:
+        result = provider.generate_response(
+            **_classifier_request(history, situation_ids, classifier_template)
+        )
+    except Exception:
+        log.exception("LLM situation classification failed")
+        return None, None
+    return _parse_distribution(result.text, situation_ids), result
+
+
+async def aclassify_situation_proba(
+    provider: BaseProvider,
+    history: list[Message],
+    situation_ids,
+    classifier_template: str = "",
+) -> tuple[dict[str, float] | None, LLMResponse | None]:
+    """Async counterpart of classify_situation_proba."""
+    situation_ids = list(situation_ids)
+    try:
+        result = await provider.agenerate_response(
+            **_classifier_request(history, situation_ids, classifier_template)
+        )
+    except Exception:
+        log.exception("LLM situation classification failed")
+        return None, None
+    return _parse_distribution(result.text, situation_ids), result
+
+
+def classify_situation(
+    provider: BaseProvider,
+    history: list[Message],
+    situation_ids,
+    classifier_template: str = "",
+) -> tuple[str | None, LLMResponse | None]:
+    """Ask the LLM which situation the teacher's last message is.
+
+    Returns (most likely situation_id or None if unparseable, raw classifier
+    response or None if the call failed).
+    """
+    distribution, result = classify_situation_proba(
+        provider, history, situation_ids, classifier_template
+    )
+    return top_situation(distribution), result
+
+
+async def aclassify_situation(
+    provider: BaseProvider,
+    history: list[Message],
+    situation_ids,
+    classifier_template: str = "",
+) -> tuple[str | None, LLMResponse | None]:
+    """Async counterpart of classify_situation."""
+    distribution, result = await aclassify_situation_proba(
+        provider, history, situation_ids, classifier_template
+    )
+    return top_situation(distribution), result
+
+
+def top_situation(distribution: dict[str, float] | None) -> str | None:
+    """Most likely situation of a distribution (None for no distribution)."""
+    if not distribution:
+        return None
+    return max(distribution, key=distribution.get)
+
+
+def _parse_distribution(classifier_text: str, situation_ids: list[str]) -> dict[str, float] | None:
+    """Parse a JSON classifier reply into a normalized distribution over *situation_ids*."""
+    text = _strip_code_fence(classifier_text)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+
+    if not isinstance(data, dict):
+        # Provider without JSON mode answered with a bare id
+        situation_id = _parse_situation(data if isinstance(data, str) else text, situation_ids)
+        return {situation_id: 1.0} if situation_id else None
+
+    dist = {}
+    probabilities = data.get("probabilities")
+    if isinstance(probabilities, dict):
+        for sid, p in probabilities.items():
+            if sid in situation_ids and isinstance(p, (int, float)) and p > 0:
+                dist[sid] = float(p)
+    if not dist:
+        situation_id = _parse_situation(str(data.get("situation", "")), situation_ids)
+        return {situation_id: 1.0} if situation_id else None
+
+    total = sum(dist.values())
+    return {sid: p / total for sid, p in dist.items()}
+
+
+def _parse_situation(classifier_text: str, situation_ids) -> str | None:
+    situation_id = classifier_text.strip().lower().strip(".,!\"'` \n")
+    if situation_id in situation_ids:
+        return situation_id
+    log.warning("LLM returned unknown situation '%s'", situation_id)
+    return None
+
+
+def pick_intent_for_situation(
+    situation_id: str | None,
+    situation_weights: dict[str, dict[str, int]],
+    intent_prompts: dict[str, str],
+    rng: random.Random | None = None,
+) -> tuple[str, str]:
+    """Pick an intent by the situation's weights (aggregate weights if unknown).
+
+    Returns (intent_id, intent_prompt).
+    """
+    if situation_id in situation_weights:
+        weights = situation_weights[situation_id]
+        valid = {iid: w for iid, w in weights.items() if w > 0 and iid in intent_prompts}
+        if valid:
+            ids = list(valid.keys())
+            wts = [valid[iid] for iid in ids]
+            chosen_id = (rng or random).choices(ids, weights=wts, k=1)[0]
+            log.info("Situation: %s → intent: %s", situation_id, chosen_id)
+            return chosen_id, intent_prompts[chosen_id]
+
+    log.warning("No usable weights for situation %s, falling back to aggregate", situation_id)
+    agg: dict[str, int] = {}
+    for sit_weights in situation_weights.values():
+        for iid, w in sit_weights.items():
+            if iid in intent_prompts:
+                agg[iid] = agg.get(iid, 0) + w
+    return pick_intent(agg, intent_prompts, rng)
+
+
+def pick_intent_for_distribution(
+    distribution: dict[str, float] | None,
+    situation_weights: dict[str, dict[str, int]],
+    intent_prompts: dict[str, str],
+    rng: random.Random | None = None,
+) -> tuple[str, str]:
+    """Pick an intent by situation weights mixed by situation probability.
+
+    Each intent's weight is sum over situations of P(situation) * weight, so
+    an uncertain classification blends the likely situations instead of
+    committing to the argmax. Falls back like pick_intent_for_situation.
+    Returns (intent_id, intent_prompt).
+    """
+    mixed: dict[str, float] = {}
+    for sid, p in (distribution or {}).items():
+        for iid, w in situation_weights.get(sid, {}).items():
+            if w > 0 and iid in intent_prompts:
+                mixed[iid] = mixed.get(iid, 0.0) + p * w
+    if not mixed:
+        return pick_intent_for_situation(None, situation_weights, intent_prompts, rng)
+
+    ids = list(mixed.keys())
+    chosen_id = (rng or random).choices(ids, weights=[mixed[iid] for iid in ids], k=1)[0]
+    log.info("Situation: %s → intent: %s", top_situation(distribution), chosen_id)
     return chosen_id, intent_prompts[chosen_id]
 
 
@@ -50,49 +266,150 @@ def pick_intent_llm(
     situation_weights: dict[str, dict[str, int]],
     intent_prompts: dict[str, str],
     classifier_template: str = "",
+    rng: random.Random | None = None,
 ) -> tuple[str, str]:
     """Use LLM to classify the teacher's situation, then pick intent by situation weights.
 
-    LLM returns a single situation_id → lookup situation_weights[situation_id]
-    → weighted random.choices() among intents with weight > 0.
+    LLM returns a distribution over situations → situation_weights mixed by
+    probability → weighted random.choices() among intents with weight > 0.
     Falls back to aggregate weights across all situations if LLM response can't be parsed.
     Returns (intent_id, intent_prompt).
     """
-    template = classifier_template or DEFAULT_CLASSIFIER_TEMPLATE
+    distribution, _ = classify_situation_proba(
+        provider, history, situation_weights.keys(), classifier_template
+    )
+    return pick_intent_for_distribution(distribution, situation_weights, intent_prompts, rng)
 
-    # Classifier only needs recent context, not the full dialog
-    recent_history = history[-10:]
 
+async def apick_intent_llm(
+    provider: BaseProvider,
+    history: list[Message],
+    situation_weights: dict[str, dict[str, int]],
+    intent_prompts: dict[str, str],
+    classifier_template: str = "",
+    rng: random.Random | None = None,
+) -> tuple[str, str]:
+    """Async counterpart of pick_intent_llm (same fallback behaviour)."""
+    distribution, _ = await aclassify_situation_proba(
+        provider, history, situation_weights.keys(), classifier_template
+    )
+    return pick_intent_for_distribution(distribution, situation_weights, intent_prompts, rng)
+
+
+def draw_situation_intents(
+    situation_weights: dict[str, dict[str, int]],
+    intent_prompts: dict[str, str],
+    rng: random.Random | None = None,
+) -> dict[str, str]:
+    """Draw one intent per situation by its weights (for the fused student turn).
+
+    The model then only has to recognise the situation: the intent it must
+    follow is fixed in advance, so sampling stays faithful to the weights.
+    Situations without usable weights are left out.
+    """
+    mapping = {}
+    for sid, weights in situation_weights.items():
+        valid = {iid: w for iid, w in weights.items() if w > 0 and iid in intent_prompts}
+        if valid:
+            mapping[sid] = (rng or random).choices(list(valid), weights=list(valid.values()), k=1)[0]
+    return mapping
+
+
+def fused_schema(mapping: dict[str, str]) -> dict:
+    """JSON schema of the fused student reply for a situation → intent mapping."""
+    return {
+        "type": "object",
+        "properties": {
+            "situation": {"type": "string", "enum": list(mapping)},
+            "intent": {"type": "string", "enum": sorted(set(mapping.values()))},
+            "text": {"type": "string"},
+        },
+        "required": ["situation", "intent", "text"],
+        # Gemini orders properties alphabetically unless told otherwise
+        "propertyOrdering": ["situation", "intent", "text"],
+    }
+
+
+def build_fused_prompt(
+    base_prompt: str,
+    mapping: dict[str, str],
+    intent_prompts: dict[str, str],
+    classifier_template: str = "",
+    correct_answer_prob: int = 50,
+    mistake_weights: dict[str, int] | None = None,
+    rng: random.Random | None = None,
+) -> tuple[str, str | None]:
+    """Student prompt that classifies the situation and replies in one call.
+
+    Only the intents present in *mapping* are included. The answer roll is
+    made up front, as in build_student_prompt. Returns (system_prompt,
+    mistake_id); the mistake applies only if the reply's intent is "answer".
+    """
+    intent_blocks = []
+    mistake_id = None
+    for iid in dict.fromkeys(mapping.values()):
+        block = f"#### {iid}\n{intent_prompts[iid]}"
+        if iid == "answer":
+            accuracy, mistake_id = _answer_accuracy_block(correct_answer_prob, mistake_weights, rng)
+            block += f"\n\n{accuracy}"
+        intent_blocks.append(block)
+
+    task = _FUSED_TEMPLATE.format(
+        mapping="\n".join(f"- {sid} → {iid}" for sid, iid in mapping.items()),
+        classifier=classifier_template or DEFAULT_CLASSIFIER_TEMPLATE,
+        intents="\n\n".join(intent_blocks),
+    )
+    return f"{task}\n\n---\n\n{base_prompt}", mistake_id
+
+
+def parse_fused(text: str, mapping: dict[str, str]) -> tuple[str, str, str] | None:
+    """Validate a fused reply; returns (situation_id, intent_id, reply) or None.
+
+    A reply is valid only if its intent is the one drawn for its situation.
+    An unknown situation yields None; a valid situation with the wrong intent
+    yields (situation_id, "", reply) so the caller can still use the situation.
+    """
     try:
-        result = provider.generate_response(
-            system_prompt=template,
-            history=recent_history,
-            temperature=0.3,
-            max_tokens=30,
+        data = json.loads(_strip_code_fence(text))
+    except ValueError:
+        log.warning("Fused student reply is not JSON")
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    situation_id = str(data.get("situation", "")).strip()
+    intent_id = str(data.get("intent", "")).strip()
+    reply = str(data.get("text", "")).strip()
+    if situation_id not in mapping or not reply:
+        log.warning("Fused student reply has unknown situation '%s'", situation_id)
+        return None
+    if intent_id != mapping[situation_id]:
+        log.warning(
+            "Fused student reply broke the draw: %s → %s (expected %s)",
+            situation_id, intent_id, mapping[situation_id],
         )
-        situation_id = result.text.strip().lower().strip(".,!\"'` \n")
-
-        if situation_id in situation_weights:
-            weights = situation_weights[situation_id]
-            valid = {iid: w for iid, w in weights.items() if w > 0 and iid in intent_prompts}
-            if valid:
-                ids = list(valid.keys())
-                wts = [valid[iid] for iid in ids]
-                chosen_id = random.choices(ids, weights=wts, k=1)[0]
-                log.info("Situation: %s → intent: %s", situation_id, chosen_id)
-                return chosen_id, intent_prompts[chosen_id]
-
-        log.warning("LLM returned unknown situation '%s', falling back to aggregate", situation_id)
-    except Exception:
-        log.exception("LLM intent selection failed, falling back to aggregate")
+        return situation_id, "", reply
+    return situation_id, intent_id, reply
+
+
+def _strip_code_fence(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    return text
 
-    # Fallback: aggregate weights across all situations → weighted random
-    agg: dict[str, int] = {}
-    for sit_weights in situation_weights.values():
-        for iid, w in sit_weights.items():
-            if iid in intent_prompts:
-                agg[iid] = agg.get(iid, 0) + w
-    return pick_intent(agg, intent_prompts)
+
+def _answer_accuracy_block(
+    correct_answer_prob: int,
+    mistake_weights: dict[str, int] | None,
+    rng: random.Random | None = None,
+) -> tuple[str, str | None]:
+    """Roll whether an answer is correct. Returns (prompt block, mistake_id or None)."""
+    if (rng or random).randint(1, 100) <= correct_answer_prob:
+        return _ANSWER_CORRECT_PROMPT, None
+    mistake = pick_mistake(mistake_weights or {}, rng)
+    log.info("Mistake type: %s", mistake["id"])
+    return _ANSWER_WRONG_TEMPLATE.format(mistake_description=mistake["description"]), mistake["id"]
 
 
 def build_student_prompt(
@@ -101,26 +418,24 @@ def build_student_prompt(
     intent_prompt: str,
     correct_answer_prob: int = 50,
     mistake_weights: dict[str, int] | None = None,
-) -> str:
+    rng: random.Random | None = None,
+) -> tuple[str, str | None]:
     """Combine student base prompt with the current intent prompt.
 
     For the 'answer' intent, a random roll determines whether the student
     should answer correctly or make a mistake, based on *correct_answer_prob*.
     When wrong, a mistake type is picked by *mistake_weights* and injected
     into the prompt template.
+
+    Returns (system_prompt, mistake_id); mistake_id is None unless the
+    student is asked to make a mistake.
     """
     # Intent goes FIRST so the model sees the directive before the character description.
     intent_block = f"⚠️ ЗАДАЧА НА ЭТОТ ХОД:\n{intent_prompt}"
 
+    mistake_id = None
     if intent_id == "answer":
-        if random.randint(1, 100) <= correct_answer_prob:
-            intent_block += f"\n\n{_ANSWER_CORRECT_PROMPT}"
-        else:
-            mistake = pick_mistake(mistake_weights or {})
-            log.info("Mistake type: %s", mistake["id"])
-            wrong_prompt = _ANSWER_WRONG_TEMPLATE.format(
-                mistake_description=mistake["description"]
-            )
-            intent_block += f"\n\n{wrong_prompt}"
-
-    return f"{intent_block}\n\n---\n\n{base_prompt}"
+        accuracy, mistake_id = _answer_accuracy_block(correct_answer_prob, mistake_weights, rng)
+        intent_block += f"\n\n{accuracy}"
+
+    return f"{intent_block}\n\n---\n\n{base_prompt}", mistake_id
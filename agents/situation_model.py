@@ -0,0 +1,292 @@
+"""Local situation classifier: regex rules plus a small TF-IDF + softmax model.
+
+Gives a situation distribution for the teacher's last message in
+milliseconds, so the LLM classifier only runs when local confidence is low.
+The linear model is trained from logged LLM classifier outputs:
+
+    python -m agents.situation_model train data/situation_log.jsonl data/situation_model.json
+    python -m agents.situation_model eval data/situation_log.jsonl   # before lowering the threshold
+
+Everything is pure Python (no scikit-learn) to keep the app's dependencies small.
+"""
+
+import json
+import logging
+import math
+import random
+import re
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+
+from config.defaults import SITUATIONS
+from config.settings import (
+    LOCAL_CLASSIFIER_THRESHOLD,
+    SITUATION_LOG_PATH,
+    SITUATION_MODEL_PATH,
+)
+from models.base import Message
+
+log = logging.getLogger(__name__)
+
+SITUATION_IDS = [s["id"] for s in SITUATIONS]
+
+# (situation_id, pattern, weight). Patterns run on the lower-cased last
+# teacher message; weights are evidence, not probabilities.
+RULES: list[tuple[str, re.Pattern, float]] = [
+    ("task_solved", re.compile(r"\[solved\]|задач[аи] решен|мы (её |ее )?решили|подвед[её]м итог"), 3.0),
+    ("plan_approval", re.compile(r"(согласен|согласна|начн[её]м|подходит|готов|хочешь что-то изменить)\s*\?"), 2.0),
+    ("plan_with_question", re.compile(r"план[^?]*\n[^?]*\?"), 1.0),
+    ("correction", re.compile(r"не совсем|неверно|ошибк|проверь|попробуй (ещё|еще) раз|подсказк|обрати внимание"), 1.5),
+    ("comprehension_check", re.compile(r"своими словами|почему так|как ты понял|объясни,? почему|что означает"), 2.0),
+    ("counterexample", re.compile(r"а что,? если|всегда ли|а если [a-zа-я]\s*=|а при [a-z]\s*="), 2.0),
+    ("alternative_method", re.compile(r"другим способом|друго[йм] способ|альтернатив|ещё один способ|еще один способ"), 2.0),
+    ("step_by_step", re.compile(r"твоя очередь|следующий шаг|что делаем дальше|что дальше|теперь (ты|сделай|попробуй)"), 1.5),
+    ("math_question", re.compile(r"(вычисли|упрости|найди|чему равн|сколько будет|реши|раскрой|подставь|посчитай)[^?]*\?"), 1.5),
+    ("praise", re.compile(r"^\W*(верно|правильно|отлично|молодец|точно|супер|великолепно|так и есть)"), 1.5),
+    ("offtopic", re.compile(r"вернёмся к (задаче|математике)|вернемся к (задаче|математике)|не по теме"), 2.0),
+]
+
+# Evidence mass spread over all situations. Cues like "обрати внимание" or
+# "что дальше" also occur in plain explanations, so one cue must never skip
+# the LLM: one cue gives 0.48-0.63, and rules alone reach
+# LOCAL_CLASSIFIER_THRESHOLD only with three or four distinct cues (evidence
+# of about 5.5). With fewer, a trained model has to agree (see predict).
+_PRIOR_MASS = 2.0
+
+_TOKEN_RE = re.compile(r"[a-zа-яё]+|\d+|[=+\-*/^<>?]", re.IGNORECASE)
+
+
+def last_teacher_message(history: list[Message]) -> str:
+    """Teacher's last message in a student-perspective history (teacher = user)."""
+    for msg in reversed(history):
+        if msg.role == "user":
+            return msg.content
+    return ""
+
+
+def rule_scores(text: str) -> dict[str, float]:
+    """Evidence per situation from RULES: weight per distinct matched cue
+    (empty if nothing matched)."""
+    text = text.lower().strip()
+    scores: dict[str, float] = {}
+    for sid, pattern, weight in RULES:
+        cues = {m.group(0) for m in pattern.finditer(text)}
+        if cues:
+            scores[sid] = scores.get(sid, 0.0) + weight * len(cues)
+    # Praise followed by a question is a new question, not praise
+    if "praise" in scores and text.rstrip().endswith("?"):
+        del scores["praise"]
+    if not scores and "?" not in text and len(text) > 200:
+        scores["explanation"] = 1.0
+    return scores
+
+
+def _features(text: str) -> Counter:
+    tokens = [t.lower() for t in _TOKEN_RE.findall(text)]
+    feats = Counter(tokens)
+    feats.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return feats
+
+
+class SituationModel:
+    """TF-IDF features + multinomial logistic regression, JSON-serializable."""
+
+    def __init__(self, classes: list[str], idf: dict[str, float], weights: dict[str, dict[str, float]], bias: dict[str, float]):
+        self.classes = classes
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+
+    def _vector(self, text: str) -> dict[str, float]:
+        feats = _features(text)
+        vec = {t: (1 + math.log(c)) * self.idf[t] for t, c in feats.items() if t in self.idf}
+        norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+        return {t: v / norm for t, v in vec.items()}
+
+    def predict_proba(self, text: str) -> dict[str, float]:
+        return self._proba_vec(self._vector(text))
+
+    @classmethod
+    def train(
+        cls,
+        samples: list[tuple[str, str]],
+        epochs: int = 15,
+        lr: float = 0.5,
+        l2: float = 1e-4,
+        min_df: int = 2,
+        seed: int = 0,
+    ) -> "SituationModel":
+        """Fit on (teacher_text, situation_id) pairs with plain SGD."""
+        classes = sorted({sid for _, sid in samples})
+        df = Counter()
+        for text, _ in samples:
+            df.update(set(_features(text)))
+        n = len(samples)
+        idf = {t: math.log((1 + n) / (1 + d)) + 1 for t, d in df.items() if d >= min_df}
+        model = cls(classes, idf, {c: {} for c in classes}, {c: 0.0 for c in classes})
+
+        data = [(model._vector(text), sid) for text, sid in samples]
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for vec, target in data:
+                probs = model._proba_vec(vec)
+                for c in classes:
+                    grad = probs[c] - (1.0 if c == target else 0.0)
+                    model.bias[c] -= lr * grad
+                    w = model.weights[c]
+                    for t, v in vec.items():
+                        w[t] = w.get(t, 0.0) * (1 - lr * l2) - lr * grad * v
+        return model
+
+    def _proba_vec(self, vec: dict[str, float]) -> dict[str, float]:
+        logits = {
+            c: self.bias[c] + sum(self.weights[c].get(t, 0.0) * v for t, v in vec.items())
+            for c in self.classes
+        }
+        top = max(logits.values())
+        exps = {c: math.exp(l - top) for c, l in logits.items()}
+        total = sum(exps.values())
+        return {c: e / total for c, e in exps.items()}
+
+    def save(self, path: str | Path):
+        weights = {c: {t: round(w, 5) for t, w in ws.items() if abs(w) > 1e-4} for c, ws in self.weights.items()}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps({
+            "classes": self.classes,
+            "idf": self.idf,
+            "weights": weights,
+            "bias": self.bias,
+        }, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: str | Path) -> "SituationModel":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(data["classes"], data["idf"], data["weights"], data["bias"])
+
+
+class LocalSituationClassifier:
+    """Rules + optional trained model; logs LLM labels for future training."""
+
+    def __init__(
+        self,
+        model: SituationModel | None = None,
+        threshold: float = LOCAL_CLASSIFIER_THRESHOLD,
+        log_path: str = SITUATION_LOG_PATH,
+    ):
+        self.model = model
+        self.threshold = threshold
+        self.log_path = log_path
+        self._log_lock = threading.Lock()
+
+    def predict(self, text: str) -> dict[str, float]:
+        """Situation distribution for the teacher's message (sums to 1)."""
+        scores = rule_scores(text)
+        prior = _PRIOR_MASS / len(SITUATION_IDS)
+        total = sum(scores.values()) + _PRIOR_MASS
+        rules = {sid: (scores.get(sid, 0.0) + prior) / total for sid in SITUATION_IDS}
+        if self.model is None:
+            return rules
+        learned = self.model.predict_proba(text)
+        model_dist = {sid: learned.get(sid, 0.0) for sid in SITUATION_IDS}
+        if not scores:
+            return model_dist
+        return {sid: (rules[sid] + model_dist[sid]) / 2 for sid in SITUATION_IDS}
+
+    def classify(self, text: str) -> tuple[str, float, dict[str, float]]:
+        """Return (most likely situation, its probability, full distribution)."""
+        dist = self.predict(text)
+        best = max(dist, key=dist.get)
+        return best, dist[best], dist
+
+    def record(self, text: str, situation_id: str):
+        """Append an LLM-labelled example to the training log (if enabled)."""
+        if not self.log_path or not text:
+            return
+        line = json.dumps({"text": text, "situation": situation_id}, ensure_ascii=False)
+        try:
+            with self._log_lock:
+                Path(self.log_path).parent.mkdir(parents=True, exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError:
+            log.exception("Failed to log classifier sample")
+
+
+_default: LocalSituationClassifier | None = None
+_default_lock = threading.Lock()
+
+
+def get_local_classifier() -> LocalSituationClassifier:
+    """Process-wide classifier with the trained model from SITUATION_MODEL_PATH, if any."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            model = None
+            if SITUATION_MODEL_PATH and Path(SITUATION_MODEL_PATH).exists():
+                model = SituationModel.load(SITUATION_MODEL_PATH)
+                log.info("Loaded situation model from %s", SITUATION_MODEL_PATH)
+            _default = LocalSituationClassifier(model=model)
+        return _default
+
+
+def _load_samples(path: str) -> list[tuple[str, str]]:
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                if row.get("situation") in SITUATION_IDS:
+                    samples.append((row["text"], row["situation"]))
+    return samples
+
+
+def evaluate(classifier: LocalSituationClassifier, samples: list[tuple[str, str]]) -> tuple[float, float]:
+    """(share of samples that skip the LLM, accuracy on those) against logged labels."""
+    hits = confident = 0
+    for text, sid in samples:
+        best, confidence, _ = classifier.classify(text)
+        if confidence >= classifier.threshold:
+            confident += 1
+            hits += best == sid
+    return confident / len(samples), hits / confident if confident else 0.0
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) < 2 or argv[0] not in ("train", "eval"):
+        print("usage: python -m agents.situation_model train LOG.jsonl [MODEL.json]")
+        print("       python -m agents.situation_model eval LOG.jsonl [MODEL.json]")
+        return 2
+    samples = _load_samples(argv[1])
+    if argv[0] == "eval":
+        path = argv[2] if len(argv) > 2 else SITUATION_MODEL_PATH
+        model = SituationModel.load(path) if path and Path(path).exists() else None
+        if not samples:
+            print("No labelled samples")
+            return 1
+        skipped, accuracy = evaluate(LocalSituationClassifier(model=model, log_path=""), samples)
+        print(
+            f"LLM skipped on {skipped:.1%} of {len(samples)} samples "
+            f"(threshold {LOCAL_CLASSIFIER_THRESHOLD}), agreeing with it on {accuracy:.1%}"
+        )
+        return 0
+    out = argv[2] if len(argv) > 2 else SITUATION_MODEL_PATH
+    if len(samples) < 20:
+        print(f"Need at least 20 labelled samples, got {len(samples)}")
+        return 1
+    rng = random.Random(0)
+    rng.shuffle(samples)
+    split = max(1, len(samples) // 5)
+    holdout, train = samples[:split], samples[split:]
+    model = SituationModel.train(train)
+    hits = sum(1 for text, sid in holdout if max(model.predict_proba(text).items(), key=lambda x: x[1])[0] == sid)
+    print(f"Hold-out accuracy: {hits / len(holdout):.2%} on {len(holdout)} samples")
+    SituationModel.train(samples).save(out)
+    print(f"Saved model trained on {len(samples)} samples to {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,138 @@
+"""Speculative student generation for the most likely intents.
+
+While the situation classifier runs, the student's system prompt is not
+known yet. Speculation starts replies for the k intents most likely under
+situation_weights at the same time; once the intent is sampled, the
+matching reply is kept and the rest are cancelled. Tokens spent on the
+losers buy a shorter turn.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+from collections.abc import Callable, Iterator
+
+from models.base import BaseProvider, LLMResponse, StreamChunk
+
+log = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def likely_intents(
+    prior: dict[str, float] | None,
+    situation_weights: dict[str, dict[str, int]],
+    intent_prompts: dict[str, str],
+    k: int,
+) -> list[str]:
+    """The k intents with the highest probability before classification.
+
+    *prior* is a distribution over situations (e.g. from the local
+    classifier, even when it is unsure); uniform when omitted.
+    """
+    prior = prior or {sid: 1.0 for sid in situation_weights}
+    scores: dict[str, float] = {}
+    for sid, p in prior.items():
+        weights = situation_weights.get(sid, {})
+        total = sum(w for iid, w in weights.items() if w > 0 and iid in intent_prompts)
+        for iid, w in weights.items():
+            if w > 0 and iid in intent_prompts:
+                scores[iid] = scores.get(iid, 0.0) + p * w / total
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+class BufferedStream(threading.Thread):
+    """Consumes a chunk iterator in the background until done or cancelled.
+
+    *open_stream* is called in the worker thread, so any blocking work before
+    the first chunk (e.g. intent selection) also runs in the background.
+    """
+
+    def __init__(self, open_stream: Callable[[], Iterator[StreamChunk]]):
+        super().__init__(daemon=True)
+        self.open_stream = open_stream
+        self.queue: queue.Queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.start()
+
+    def run(self):
+        chunks = None
+        try:
+            chunks = self.open_stream()
+            for chunk in chunks:
+                # Checked between chunks: a worker still waiting for its first
+                # token stops as soon as that token arrives
+                if self.cancelled.is_set():
+                    break
+                self.queue.put(chunk)
+        except Exception as e:
+            self.queue.put(e)
+        finally:
+            if chunks is not None and hasattr(chunks, "close"):
+                chunks.close()  # closes the HTTP stream
+            self.queue.put(_DONE)
+
+    def chunks(self) -> Iterator[StreamChunk]:
+        """Chunks produced so far, then the rest as they arrive."""
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class SpeculativeStreams:
+    """Streams started in worker threads, one per candidate intent."""
+
+    def __init__(self, provider: BaseProvider, requests: dict[str, dict]):
+        """requests: intent_id → stream_response keyword arguments."""
+        self._workers = {
+            iid: BufferedStream(lambda request=request: provider.stream_response(**request))
+            for iid, request in requests.items()
+        }
+
+    def take(self, intent_id: str) -> Iterator[StreamChunk] | None:
+        """Keep the stream for *intent_id* (None on a miss) and cancel all others."""
+        worker = self._workers.pop(intent_id, None)
+        self.cancel()
+        return worker.chunks() if worker else None
+
+    def cancel(self):
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+
+
+class SpeculativeTasks:
+    """Async counterpart of SpeculativeStreams: one agenerate_response task per intent."""
+
+    def __init__(self, provider: BaseProvider, requests: dict[str, dict]):
+        self._tasks = {
+            iid: asyncio.create_task(provider.agenerate_response(**request))
+            for iid, request in requests.items()
+        }
+        for task in self._tasks.values():
+            task.add_done_callback(_consume_result)
+
+    async def take(self, intent_id: str) -> LLMResponse | None:
+        """Await the reply for *intent_id* (None on a miss); cancel all others."""
+        task = self._tasks.pop(intent_id, None)
+        self.cancel()
+        return await task if task else None
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+
+def _consume_result(task: asyncio.Task):
+    """Retrieve a dropped task's error so asyncio does not warn about it."""
+    if not task.cancelled() and task.exception() is not None:
+        log.debug("Speculative generation failed: %r", task.exception())
@@ -1,13 +1,472 @@
 """Student agent logic with intent system."""
 
-from agents.intent import pick_intent, pick_intent_llm, build_student_prompt
-from models.base import BaseProvider, LLMResponse, Message
+import random
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+from agents.context import ContextManager
+from agents.intent import (
+    aclassify_situation_proba,
+    build_fused_prompt,
+    build_student_prompt,
+    classify_situation_proba,
+    draw_situation_intents,
+    fused_schema,
+    parse_fused,
+    pick_intent,
+    pick_intent_for_distribution,
+    pick_intent_for_situation,
+    top_situation,
+)
+from agents.situation_model import LocalSituationClassifier, last_teacher_message
+from agents.speculative import SpeculativeStreams, SpeculativeTasks, likely_intents
+from models.base import BaseProvider, LLMResponse, Message, StreamChunk, collect_stream
+
+FUSED_ATTEMPTS = 2  # fused calls (each with a fresh draw) before a regular turn
+
+
+@dataclass
+class _Turn:
+    """A student turn with its intent chosen (see StudentAgent._prepare)."""
+
+    intent_id: str
+    history: list[Message]  # as fitted to the context budget
+    system_prompt: str | None = None  # the reply still has to be requested
+    response: LLMResponse | None = None  # already generated (fused turn, async speculation hit)
+    chunks: Iterator[StreamChunk] | None = None  # kept speculative stream
 
 
 class StudentAgent:
-    def __init__(self, provider: BaseProvider, base_prompt: str):
+    def __init__(
+        self,
+        provider: BaseProvider,
+        base_prompt: str,
+        local_classifier: LocalSituationClassifier | None = None,
+        classifier_provider: BaseProvider | None = None,
+        speculative_k: int = 0,
+        context: ContextManager | None = None,
+        rng: random.Random | None = None,
+    ):
+        """
+        local_classifier: if given, "llm" and "fused" modes ask the LLM only
+                          when it is unsure.
+        classifier_provider: provider for the LLM situation classifier;
+                             defaults to the student's own provider.
+        speculative_k: in "llm" mode, start replies for the k most likely
+                       intents while the LLM classifier runs (0 = off).
+        context: fits the history to a token budget (None = whole dialog);
+                 the situation classifier applies its own window on top.
+        rng: source of randomness for intent and answer draws (seeded runs).
+        """
         self.provider = provider
         self.base_prompt = base_prompt
+        self.local_classifier = local_classifier
+        self.classifier_provider = classifier_provider or provider
+        self.speculative_k = speculative_k
+        self.context = context
+        self.rng = rng
+        # Outcome of the last situation classification ("llm"/"fused" modes only)
+        self.situation_id: str | None = None
+        self.situation_probs: dict[str, float] | None = None
+        self.situation_source: str | None = None  # "local", "llm" or "fused"
+        # Classifier call, or rejected fused calls (their cost is not the reply's)
+        self.classifier_response: LLMResponse | None = None
+        self.local_probs: dict[str, float] | None = None  # even when not confident
+        # Speculation outcome: {"candidates": [...], "hit": bool}, None if not used
+        self.speculation: dict | None = None
+        # Summary call made to fit the last request's history, if any
+        self.summary_response: LLMResponse | None = None
+        # Mistake type the kept reply was asked to make (None = answer correctly / not an answer)
+        self.mistake_id: str | None = None
+
+    def _student_prompt(
+        self,
+        intent_id: str,
+        intent_prompt: str,
+        correct_answer_prob: int,
+        mistake_weights: dict[str, int] | None,
+    ) -> str:
+        """System prompt for a regular turn; notes the mistake it asks for."""
+        system_prompt, self.mistake_id = build_student_prompt(
+            self.base_prompt, intent_id, intent_prompt, correct_answer_prob, mistake_weights, self.rng
+        )
+        return system_prompt
+
+    def _fit(self, history: list[Message]) -> list[Message]:
+        if self.context is None:
+            return history
+        history = self.context.fit(history)
+        self.summary_response = self.context.summary_response
+        return history
+
+    async def _afit(self, history: list[Message]) -> list[Message]:
+        if self.context is None:
+            return history
+        history = await self.context.afit(history)
+        self.summary_response = self.context.summary_response
+        return history
+
+    def _classify_local(self, history: list[Message]) -> bool:
+        """Try the local classifier; True if it was confident enough."""
+        self.classifier_response = None
+        if self.local_classifier is None:
+            return False
+        situation_id, confidence, dist = self.local_classifier.classify(
+            last_teacher_message(history)
+        )
+        self.local_probs = dist
+        if confidence < self.local_classifier.threshold:
+            return False
+        self.situation_id, self.situation_probs = situation_id, dist
+        self.situation_source = "local"
+        return True
+
+    def _classify(
+        self, history: list[Message], situation_ids, classifier_template: str
+    ):
+        """Set the situation: local classifier first, LLM on low confidence."""
+        if not self._classify_local(history):
+            self._classify_llm(history, situation_ids, classifier_template)
+
+    def _classify_llm(self, history: list[Message], situation_ids, classifier_template: str):
+        self.situation_probs, self.classifier_response = classify_situation_proba(
+            self.classifier_provider, history, situation_ids, classifier_template
+        )
+        self.situation_id = top_situation(self.situation_probs)
+        self.situation_source = "llm"
+        self._record(history)
+
+    async def _aclassify(
+        self, history: list[Message], situation_ids, classifier_template: str
+    ):
+        if not self._classify_local(history):
+            await self._aclassify_llm(history, situation_ids, classifier_template)
+
+    async def _aclassify_llm(self, history: list[Message], situation_ids, classifier_template: str):
+        self.situation_probs, self.classifier_response = await aclassify_situation_proba(
+            self.classifier_provider, history, situation_ids, classifier_template
+        )
+        self.situation_id = top_situation(self.situation_probs)
+        self.situation_source = "llm"
+        self._record(history)
+
+    def _record(self, history: list[Message]):
+        """Log the LLM label as training data for the local model."""
+        if self.local_classifier is not None and self.situation_id:
+            self.local_classifier.record(last_teacher_message(history), self.situation_id)
+
+    def _select_intent(
+        self,
+        history: list[Message],
+        intent_mode: str,
+        intent_weights: dict[str, int],
+        intent_prompts: dict[str, str],
+        situation_weights: dict[str, dict[str, int]] | None,
+        classifier_template: str,
+    ) -> tuple[str, str]:
+        if intent_mode == "llm" and situation_weights:
+            self._classify(history, situation_weights.keys(), classifier_template)
+        if intent_mode in ("llm", "fused") and situation_weights:
+            return pick_intent_for_distribution(
+                self.situation_probs, situation_weights, intent_prompts, self.rng
+            )
+        return pick_intent(intent_weights, intent_prompts, self.rng)
+
+    async def _aselect_intent(
+        self,
+        history: list[Message],
+        intent_mode: str,
+        intent_weights: dict[str, int],
+        intent_prompts: dict[str, str],
+        situation_weights: dict[str, dict[str, int]] | None,
+        classifier_template: str,
+    ) -> tuple[str, str]:
+        if intent_mode == "llm" and situation_weights:
+            await self._aclassify(history, situation_weights.keys(), classifier_template)
+        if intent_mode in ("llm", "fused") and situation_weights:
+            return pick_intent_for_distribution(
+                self.situation_probs, situation_weights, intent_prompts, self.rng
+            )
+        return pick_intent(intent_weights, intent_prompts, self.rng)
+
+    def _use_speculation(self, history: list[Message], intent_mode: str, situation_weights) -> bool:
+        """Speculate only when the LLM classifier will actually be waited for."""
+        return (
+            intent_mode == "llm"
+            and bool(situation_weights)
+            and self.speculative_k > 0
+            and not self._classify_local(history)
+        )
+
+    def _speculation_requests(
+        self,
+        history: list[Message],
+        intent_prompts: dict[str, str],
+        situation_weights: dict[str, dict[str, int]],
+        temperature: float,
+        max_tokens: int,
+        correct_answer_prob: int,
+        mistake_weights: dict[str, int] | None,
+    ) -> tuple[dict[str, dict], dict[str, str | None]]:
+        """Generation requests for the most likely intents, keyed by intent_id,
+        and the mistake each of them asks for."""
+        candidates = likely_intents(
+            self.local_probs, situation_weights, intent_prompts, self.speculative_k
+        )
+        requests, mistakes = {}, {}
+        for iid in candidates:
+            system_prompt, mistakes[iid] = build_student_prompt(
+                self.base_prompt, iid, intent_prompts[iid], correct_answer_prob,
+                mistake_weights, self.rng,
+            )
+            requests[iid] = {
+                "system_prompt": system_prompt,
+                "history": history,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            }
+        return requests, mistakes
+
+    def _use_fused(self, history: list[Message], intent_mode: str, situation_weights) -> bool:
+        """Fused mode still prefers a confident local classification (plain turn)."""
+        return intent_mode == "fused" and bool(situation_weights) and not self._classify_local(history)
+
+    def _fused_request(
+        self,
+        history: list[Message],
+        mapping: dict[str, str],
+        intent_prompts: dict[str, str],
+        temperature: float,
+        max_tokens: int,
+        correct_answer_prob: int,
+        classifier_template: str,
+        mistake_weights: dict[str, int] | None,
+    ) -> tuple[dict, str | None]:
+        """The fused call's request and the mistake drawn for its "answer" block."""
+        system_prompt, mistake_id = build_fused_prompt(
+            self.base_prompt,
+            mapping,
+            intent_prompts,
+            classifier_template,
+            correct_answer_prob,
+            mistake_weights,
+            self.rng,
+        )
+        request = {
+            "system_prompt": system_prompt,
+            "history": history,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "json_schema": fused_schema(mapping),
+        }
+        return request, mistake_id
+
+    def _accept_fused(self, response: LLMResponse, mapping: dict[str, str], rejected: list):
+        """Validate a fused reply. Returns (response with the bare reply, intent_id) or None.
+
+        Invalid replies are kept in *rejected*; a recognised situation is
+        remembered for the fallback turn.
+        """
+        parsed = parse_fused(response.text, mapping)
+        if parsed:
+            self.situation_id = parsed[0]
+            self.situation_probs = {parsed[0]: 1.0}
+        if parsed and parsed[1]:
+            self.situation_source = "fused"
+            self.classifier_response = _combined(rejected)
+            response.text = parsed[2]
+            return response, parsed[1]
+        rejected.append(response)
+        return None
+
+    def _fused_fallback(self, situation_weights, intent_prompts, rejected: list) -> tuple[str, str]:
+        """Pick the intent for a regular turn after the fused calls failed validation."""
+        self.situation_source = "fused"
+        self.classifier_response = _combined(rejected)
+        if not self.situation_id:
+            self.situation_probs = None
+        return pick_intent_for_situation(
+            self.situation_id, situation_weights, intent_prompts, self.rng
+        )
+
+    def _generate_fused(
+        self,
+        history: list[Message],
+        intent_prompts: dict[str, str],
+        temperature: float,
+        max_tokens: int,
+        correct_answer_prob: int,
+        situation_weights: dict[str, dict[str, int]],
+        classifier_template: str,
+        mistake_weights: dict[str, int] | None,
+    ) -> tuple[LLMResponse, str]:
+        """Classify the situation and write the reply in one structured call.
+
+        Intents are drawn per situation before the call, so the model only
+        picks the situation. A reply whose intent does not match the draw is
+        retried with a fresh draw, then replaced by a regular turn for the
+        situation the model recognised.
+        """
+        self.situation_id = self.situation_probs = None
+        rejected = []
+        for _ in range(FUSED_ATTEMPTS):
+            mapping = draw_situation_intents(situation_weights, intent_prompts, self.rng)
+            request, mistake_id = self._fused_request(
+                history, mapping, intent_prompts, temperature, max_tokens,
+                correct_answer_prob, classifier_template, mistake_weights,
+            )
+            response = self.provider.generate_response(**request)
+            accepted = self._accept_fused(response, mapping, rejected)
+            if accepted:
+                self.mistake_id = mistake_id if accepted[1] == "answer" else None
+                return accepted
+
+        intent_id, intent_prompt = self._fused_fallback(situation_weights, intent_prompts, rejected)
+        system_prompt = self._student_prompt(intent_id, intent_prompt, correct_answer_prob, mistake_weights)
+        response = self.provider.generate_response(
+            system_prompt=system_prompt,
+            history=history,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response, intent_id
+
+    async def _agenerate_fused(
+        self,
+        history: list[Message],
+        intent_prompts: dict[str, str],
+        temperature: float,
+        max_tokens: int,
+        correct_answer_prob: int,
+        situation_weights: dict[str, dict[str, int]],
+        classifier_template: str,
+        mistake_weights: dict[str, int] | None,
+    ) -> tuple[LLMResponse, str]:
+        """Async counterpart of _generate_fused."""
+        self.situation_id = self.situation_probs = None
+        rejected = []
+        for _ in range(FUSED_ATTEMPTS):
+            mapping = draw_situation_intents(situation_weights, intent_prompts, self.rng)
+            request, mistake_id = self._fused_request(
+                history, mapping, intent_prompts, temperature, max_tokens,
+                correct_answer_prob, classifier_template, mistake_weights,
+            )
+            response = await self.provider.agenerate_response(**request)
+            accepted = self._accept_fused(response, mapping, rejected)
+            if accepted:
+                self.mistake_id = mistake_id if accepted[1] == "answer" else None
+                return accepted
+
+        intent_id, intent_prompt = self._fused_fallback(situation_weights, intent_prompts, rejected)
+        system_prompt = self._student_prompt(intent_id, intent_prompt, correct_answer_prob, mistake_weights)
+        response = await self.provider.agenerate_response(
+            system_prompt=system_prompt,
+            history=history,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response, intent_id
+
+    def _prepare(
+        self,
+        history: list[Message],
+        intent_weights: dict[str, int],
+        intent_prompts: dict[str, str],
+        temperature: float,
+        max_tokens: int,
+        correct_answer_prob: int,
+        intent_mode: str,
+        situation_weights: dict[str, dict[str, int]] | None,
+        classifier_template: str,
+        mistake_weights: dict[str, int] | None,
+    ) -> _Turn:
+        """Fit the history and choose the intent: everything before the reply request.
+
+        A fused turn comes back with its reply; a speculation hit with the
+        kept stream. Shared by generate and stream (see _aprepare).
+        """
+        history = self._fit(history)
+        if self._use_fused(history, intent_mode, situation_weights):
+            response, intent_id = self._generate_fused(
+                history, intent_prompts, temperature, max_tokens, correct_answer_prob,
+                situation_weights, classifier_template, mistake_weights,
+            )
+            return _Turn(intent_id, history, response=response)
+        if self._use_speculation(history, intent_mode, situation_weights):
+            requests, mistakes = self._speculation_requests(
+                history, intent_prompts, situation_weights, temperature, max_tokens,
+                correct_answer_prob, mistake_weights,
+            )
+            streams = SpeculativeStreams(self.provider, requests)
+            try:
+                self._classify_llm(history, situation_weights.keys(), classifier_template)
+            except BaseException:
+                streams.cancel()
+                raise
+            intent_id, intent_prompt = pick_intent_for_distribution(
+                self.situation_probs, situation_weights, intent_prompts, self.rng
+            )
+            chunks = streams.take(intent_id)
+            self.speculation = {"candidates": list(requests), "hit": chunks is not None}
+            if chunks is not None:
+                self.mistake_id = mistakes[intent_id]
+                return _Turn(intent_id, history, chunks=chunks)
+        else:
+            intent_id, intent_prompt = self._select_intent(
+                history, intent_mode, intent_weights, intent_prompts,
+                situation_weights, classifier_template,
+            )
+        system_prompt = self._student_prompt(intent_id, intent_prompt, correct_answer_prob, mistake_weights)
+        return _Turn(intent_id, history, system_prompt=system_prompt)
+
+    async def _aprepare(
+        self,
+        history: list[Message],
+        intent_weights: dict[str, int],
+        intent_prompts: dict[str, str],
+        temperature: float,
+        max_tokens: int,
+        correct_answer_prob: int,
+        intent_mode: str,
+        situation_weights: dict[str, dict[str, int]] | None,
+        classifier_template: str,
+        mistake_weights: dict[str, int] | None,
+    ) -> _Turn:
+        """Async counterpart of _prepare (a speculation hit comes back as a response)."""
+        history = await self._afit(history)
+        if self._use_fused(history, intent_mode, situation_weights):
+            response, intent_id = await self._agenerate_fused(
+                history, intent_prompts, temperature, max_tokens, correct_answer_prob,
+                situation_weights, classifier_template, mistake_weights,
+            )
+            return _Turn(intent_id, history, response=response)
+        if self._use_speculation(history, intent_mode, situation_weights):
+            requests, mistakes = self._speculation_requests(
+                history, intent_prompts, situation_weights, temperature, max_tokens,
+                correct_answer_prob, mistake_weights,
+            )
+            tasks = SpeculativeTasks(self.provider, requests)
+            try:
+                await self._aclassify_llm(history, situation_weights.keys(), classifier_template)
+            except BaseException:
+                tasks.cancel()
+                raise
+            intent_id, intent_prompt = pick_intent_for_distribution(
+                self.situation_probs, situation_weights, intent_prompts, self.rng
+            )
+            response = await tasks.take(intent_id)
+            self.speculation = {"candidates": list(requests), "hit": response is not None}
+            if response is not None:
+                self.mistake_id = mistakes[intent_id]
+                return _Turn(intent_id, history, response=response)
+        else:
+            intent_id, intent_prompt = await self._aselect_intent(
+                history, intent_mode, intent_weights, intent_prompts,
+                situation_weights, classifier_template,
+            )
+        system_prompt = self._student_prompt(intent_id, intent_prompt, correct_answer_prob, mistake_weights)
+        return _Turn(intent_id, history, system_prompt=system_prompt)
 
     def generate(
         self,
@@ -24,30 +483,111 @@ class StudentAgent:
     ) -> tuple[LLMResponse, str]:
         """Generate student response with intent selection.
 
-        intent_mode: "random" (weighted random from intent_weights)
-                  or "llm" (LLM classifies teacher situation → situation_weights lookup).
+        intent_mode: "random" (weighted random from intent_weights),
+                  "llm" (teacher situation is classified → situation_weights
+                  mixed by situation probability)
+                  or "fused" (one call classifies the situation and replies).
 
         Returns (LLMResponse, intent_id).
         """
-        if intent_mode == "llm" and situation_weights:
-            intent_id, intent_prompt = pick_intent_llm(
-                provider=self.provider,
-                history=history,
-                situation_weights=situation_weights,
-                intent_prompts=intent_prompts,
-                classifier_template=classifier_template,
+        started = time.monotonic()
+        turn = self._prepare(
+            history, intent_weights, intent_prompts, temperature, max_tokens,
+            correct_answer_prob, intent_mode, situation_weights,
+            classifier_template, mistake_weights,
+        )
+        if turn.chunks is not None:
+            # Speculation runs on streams; collect the kept one
+            return collect_stream(turn.chunks, started), turn.intent_id
+        if turn.response is None:
+            turn.response = self.provider.generate_response(
+                system_prompt=turn.system_prompt,
+                history=turn.history,
+                temperature=temperature,
+                max_tokens=max_tokens,
             )
-        else:
-            intent_id, intent_prompt = pick_intent(intent_weights, intent_prompts)
+        return turn.response, turn.intent_id
 
-        system_prompt = build_student_prompt(
-            self.base_prompt, intent_id, intent_prompt, correct_answer_prob, mistake_weights
+    async def agenerate(
+        self,
+        history: list[Message],
+        intent_weights: dict[str, int],
+        intent_prompts: dict[str, str],
+        temperature: float,
+        max_tokens: int,
+        correct_answer_prob: int = 50,
+        intent_mode: str = "random",
+        situation_weights: dict[str, dict[str, int]] | None = None,
+        classifier_template: str = "",
+        mistake_weights: dict[str, int] | None = None,
+    ) -> tuple[LLMResponse, str]:
+        """Async counterpart of generate (same arguments and result)."""
+        turn = await self._aprepare(
+            history, intent_weights, intent_prompts, temperature, max_tokens,
+            correct_answer_prob, intent_mode, situation_weights,
+            classifier_template, mistake_weights,
         )
+        if turn.response is None:
+            turn.response = await self.provider.agenerate_response(
+                system_prompt=turn.system_prompt,
+                history=turn.history,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        return turn.response, turn.intent_id
 
-        llm_response = self.provider.generate_response(
-            system_prompt=system_prompt,
-            history=history,
-            temperature=temperature,
-            max_tokens=max_tokens,
+    def stream(
+        self,
+        history: list[Message],
+        intent_weights: dict[str, int],
+        intent_prompts: dict[str, str],
+        temperature: float,
+        max_tokens: int,
+        correct_answer_prob: int = 50,
+        intent_mode: str = "random",
+        situation_weights: dict[str, dict[str, int]] | None = None,
+        classifier_template: str = "",
+        mistake_weights: dict[str, int] | None = None,
+    ) -> tuple[Iterator[StreamChunk], str]:
+        """Pick the intent (blocking), then stream the reply.
+
+        In "fused" mode the structured reply is not streamable: it is
+        generated up front and returned as a single chunk.
+        Returns (chunk iterator, intent_id).
+        """
+        turn = self._prepare(
+            history, intent_weights, intent_prompts, temperature, max_tokens,
+            correct_answer_prob, intent_mode, situation_weights,
+            classifier_template, mistake_weights,
         )
-        return llm_response, intent_id
+        if turn.response is not None:
+            return _as_chunks(turn.response), turn.intent_id
+        if turn.chunks is None:
+            turn.chunks = self.provider.stream_response(
+                system_prompt=turn.system_prompt,
+                history=turn.history,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        return turn.chunks, turn.intent_id
+
+
+def _as_chunks(response: LLMResponse) -> Iterator[StreamChunk]:
+    if response.reasoning:
+        yield StreamChunk(reasoning=response.reasoning)
+    yield StreamChunk(text=response.text, usage=response.usage())
+
+
+def _combined(responses: list[LLMResponse]) -> LLMResponse | None:
+    """Usage of several calls as one response (None if there were none)."""
+    if not responses:
+        return None
+    return LLMResponse(
+        text="",
+        input_tokens=sum(r.input_tokens for r in responses),
+        output_tokens=sum(r.output_tokens for r in responses),
+        thinking_tokens=sum(r.thinking_tokens for r in responses),
+        cached_tokens=sum(r.cached_tokens for r in responses),
+        latency=sum(r.latency for r in responses),
+        retries=sum(r.retries for r in responses),
+    )
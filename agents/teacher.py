@@ -1,12 +1,45 @@
 """Teacher agent logic."""
 
-from models.base import BaseProvider, LLMResponse, Message
+from collections.abc import Iterator
+
+from agents.context import ContextManager
+from models.base import BaseProvider, LLMResponse, Message, StreamChunk
+from models.prompt_cache import PromptCache
 
 
 class TeacherAgent:
-    def __init__(self, provider: BaseProvider, system_prompt: str):
+    def __init__(
+        self,
+        provider: BaseProvider,
+        system_prompt: str,
+        context: ContextManager | None = None,
+        cache: PromptCache | None = None,
+    ):
+        """
+        context: fits the history to a token budget (None = whole dialog).
+        cache: the dialog's provider-side prompt cache (the system prompt is
+               the same on every turn).
+        """
         self.provider = provider
         self.system_prompt = system_prompt
+        self.context = context
+        self.cache = cache
+        # Summary call made to fit the last request's history, if any
+        self.summary_response: LLMResponse | None = None
+
+    def _fit(self, history: list[Message]) -> list[Message]:
+        if self.context is None:
+            return history
+        history = self.context.fit(history)
+        self.summary_response = self.context.summary_response
+        return history
+
+    async def _afit(self, history: list[Message]) -> list[Message]:
+        if self.context is None:
+            return history
+        history = await self.context.afit(history)
+        self.summary_response = self.context.summary_response
+        return history
 
     def generate(
         self,
@@ -21,7 +54,38 @@ class TeacherAgent:
         """
         return self.provider.generate_response(
             system_prompt=self.system_prompt,
-            history=history,
+            history=self._fit(history),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            cache=self.cache,
+        )
+
+    async def agenerate(
+        self,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+    ) -> LLMResponse:
+        """Async counterpart of generate."""
+        return await self.provider.agenerate_response(
+            system_prompt=self.system_prompt,
+            history=await self._afit(history),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            cache=self.cache,
+        )
+
+    def stream(
+        self,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+    ) -> Iterator[StreamChunk]:
+        """Stream teacher response deltas (same history convention as generate)."""
+        return self.provider.stream_response(
+            system_prompt=self.system_prompt,
+            history=self._fit(history),
             temperature=temperature,
             max_tokens=max_tokens,
+            cache=self.cache,
         )
@@ -8,13 +8,14 @@ logging.basicConfig(level=logging.DEBUG, format="%(name)s %(levelname)s: %(messa
 
 from config.settings import APP_TITLE
 from ui.chat_area import render_chat
-from ui.controls import execute_turn
+from ui.controls import execute_turn, restore_dialog
 from ui.sidebar import render_sidebar
 from utils.session import init_session_state
 
 st.set_page_config(page_title=APP_TITLE, layout="wide")
 
 init_session_state()
+restore_dialog()
 
 st.title(APP_TITLE)
 
@@ -11,24 +11,48 @@ def _load_prompt(filename: str) -> str:
 
 # ─── Available models ───────────────────────────────────────────────
 
+# "rpm" / "tpm": per-key quota (requests / input tokens per minute) that the
+# shared rate limiter keeps requests under; set to your quota tier, None = off.
 AVAILABLE_MODELS = {
     "Gemini 2.5 Flash": {
         "provider": "gemini",
         "model_id": "gemini-2.5-flash",
         "supports_thinking": False,
         "supports_reasoning": False,
+        "rpm": 1000,
+        "tpm": 1_000_000,
     },
     "Gemini 3 Flash": {
         "provider": "gemini",
         "model_id": "gemini-3-flash-preview",
         "supports_thinking": True,
         "supports_reasoning": False,
+        "rpm": 1000,
+        "tpm": 1_000_000,
     },
     "GPT OSS 120B (Yandex)": {
         "provider": "yandex",
         "model_id": "gpt-oss-120b/latest",
         "supports_thinking": False,
         "supports_reasoning": True,
+        "rpm": 600,
+        "tpm": None,
+    },
+    # Offline models for load tests and benchmarks (no API keys, no network).
+    # "mock" holds MockProvider options: latency and injected failure model.
+    "Mock (offline)": {
+        "provider": "mock",
+        "model_id": "mock",
+        "supports_thinking": False,
+        "supports_reasoning": True,
+        "mock": {"ttft": 0.4, "ttft_jitter": 0.15, "tokens_per_sec": 60.0, "failure_rate": 0.0},
+    },
+    "Mock (instant)": {
+        "provider": "mock",
+        "model_id": "mock-instant",
+        "supports_thinking": False,
+        "supports_reasoning": True,
+        "mock": {"ttft": 0.0, "ttft_jitter": 0.0, "tokens_per_sec": 0.0, "failure_rate": 0.0},
     },
 }
 
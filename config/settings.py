@@ -1,4 +1,17 @@
-"""Application constants and settings."""
+"""Application constants and settings.
+
+LEARNLM_* environment variables below may also come from .env: it is loaded
+here, before they are read, whichever entry point imports this first.
+"""
+
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+_ROOT = Path(__file__).resolve().parent.parent
+
+load_dotenv()
 
 # Generation parameters
 DEFAULT_TEMPERATURE = 1.0
@@ -9,6 +22,13 @@ DEFAULT_MAX_TOKENS = 4096
 MIN_MAX_TOKENS = 256
 MAX_MAX_TOKENS = 16384
 
+# Context window per agent, in estimated tokens of verbatim history
+# (0 = whole dialog). Older messages are replaced by a rolling summary.
+DEFAULT_CONTEXT_TOKENS = 0
+MAX_CONTEXT_TOKENS = 32768
+CONTEXT_KEEP_RECENT = 4  # messages always sent verbatim
+CONTEXT_SUMMARY_STEP = 6  # extra messages folded in per summary update
+
 # Dialog limits
 MAX_DIALOG_STEPS = 50
 
@@ -19,3 +39,65 @@ YANDEX_BASE_URL = "https://ai.api.cloud.yandex.net/v1"
 APP_TITLE = "LearnLM — Симулятор урока"
 TEACHER_AVATAR = "\U0001f468\u200d\U0001f3eb"  # 👨‍🏫
 STUDENT_AVATAR = "\U0001f392"  # 🎒
+
+# Provider resilience (see models/resilience.py)
+REQUEST_TIMEOUT = 120  # seconds per HTTP attempt
+CALL_DEADLINE = 300  # seconds per call, including all retries
+BREAKER_FAILURE_THRESHOLD = 5  # consecutive endpoint failures before failing fast
+BREAKER_RESET_TIMEOUT = 30  # seconds before a probe call is let through
+
+# Situation classifier calls emit one word: fail fast and fall back to
+# aggregate weights rather than stall the student turn
+CLASSIFIER_TIMEOUT = 10  # seconds per HTTP attempt
+CLASSIFIER_DEADLINE = 20  # seconds per call, including all retries
+
+# Provider-side prompt caching for the teacher (see models/prompt_cache.py)
+PROMPT_CACHE_TTL = 600  # seconds a Gemini cached content lives without use
+PROMPT_CACHE_MIN_TOKENS = 1024  # estimated; Gemini rejects smaller caches
+PROMPT_CACHE_REFRESH = 6  # uncached messages before the cached prefix is rebuilt
+
+# Turn journal (see engine/journal.py): the UI keeps one file per dialog
+# here to restore it after a browser reload ("" disables)
+JOURNAL_DIR = os.getenv("LEARNLM_JOURNAL_DIR", str(_ROOT / "data" / "journal"))
+JOURNAL_FSYNC = True  # sync every record to disk (survives a machine crash, not only the process)
+
+# Batch simulation (see engine/batch.py)
+BATCH_WORKERS = 16  # dialogs in flight
+# Concurrent requests per provider across the batch (None = no limit)
+BATCH_PROVIDER_CONCURRENCY = {"gemini": 16, "yandex": 8, "mock": None}
+# Sharded runs (see engine/shard.py): a job's lease is renewed by heartbeats
+# and the job is handed to another worker once it expires
+QUEUE_LEASE_SECONDS = 120
+QUEUE_HEARTBEAT_SECONDS = 30
+QUEUE_POLL_SECONDS = 2.0  # idle workers re-check the queue this often
+QUEUE_MAX_ATTEMPTS = 3  # deliveries before a job is marked failed
+
+# Local dialog store with full-text search (see utils/store.py)
+STORE_PATH = os.getenv("LEARNLM_STORE", str(_ROOT / "data" / "dialogs.db"))
+STORE_AUTOSAVE = True  # the UI saves each dialog to the store when it ends
+
+# Corpus export (see utils/export.py)
+EXPORT_SHARD_MB = 256  # JSONL shards rotate at this compressed size
+EXPORT_PARQUET_ROWS = 1_000_000  # turns per Parquet file
+EXPORT_ROW_GROUP = 100_000  # turns per Parquet row group
+
+# Headless simulation service (see engine/service.py)
+SERVICE_HOST = os.getenv("LEARNLM_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("LEARNLM_SERVICE_PORT", "8765"))
+SERVICE_TOKEN_ENV = "LEARNLM_SERVICE_TOKEN"  # bearer token; read at startup, after .env
+SERVICE_MAX_DIALOGS = 1000  # dialogs kept in memory per process
+SERVICE_IDLE_SECONDS = 30 * 60  # unfinished dialogs without requests are dropped after this
+SERVICE_STREAM_THREADS = 64  # turns streaming tokens at once (they run on threads)
+SERVICE_PROVIDER_CONCURRENCY = {"gemini": 64, "yandex": 32, "mock": None}
+
+# Record/replay cassettes for provider traffic (see models/cassette.py).
+# Empty dir disables them; mode is "record", "replay" or "auto".
+CASSETTE_DIR = os.getenv("LEARNLM_CASSETTE_DIR", "")
+CASSETTE_MODE = os.getenv("LEARNLM_CASSETTE_MODE", "auto")
+
+# Local situation classifier (see agents/situation_model.py).
+# The LLM classifier is called only when local confidence is below the threshold.
+LOCAL_CLASSIFIER_THRESHOLD = 0.75
+SITUATION_MODEL_PATH = os.getenv("LEARNLM_SITUATION_MODEL", str(_ROOT / "data" / "situation_model.json"))
+# LLM classifier labels are appended here as training data ("" disables logging)
+SITUATION_LOG_PATH = os.getenv("LEARNLM_SITUATION_LOG", str(_ROOT / "data" / "situation_log.jsonl"))
@@ -0,0 +1,4 @@
+from engine.config import ConfigError, EngineConfig
+from engine.events import DialogEvents
+from engine.dialog import DialogEngine
+from engine.journal import Journal, JournaledDialog
@@ -0,0 +1,165 @@
+"""Run a full lesson from the command line, without Streamlit.
+
+    python -m engine --input "Реши 2x + 5 = 13" --output dialog.json
+    python -m engine --config lesson.json --teacher-model "Mock (offline)" --async
+    python -m engine --journal lessons.jsonl --resume 3f2a9c...
+
+--config takes a JSON object with EngineConfig fields; API keys come from
+the environment (.env) unless the file sets them.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+from dotenv import load_dotenv
+
+from config.defaults import AVAILABLE_MODELS
+from engine.config import ConfigError, EngineConfig
+from engine.dialog import SOLVED_MARKER, DialogEngine, streamed_text
+from engine.events import DialogEvents
+from engine.journal import Journal
+from models.base import StreamChunk
+from utils.usage import dialog_usage
+
+_NAMES = {"teacher": "Репетитор", "student": "Ученик"}
+
+
+class ConsoleEvents(DialogEvents):
+    """Prints the dialog to stdout as it is generated."""
+
+    def __init__(self, stream: bool = True):
+        self.stream = stream
+        self._streamed = ""  # text of the turn streamed so far
+        self._printed = 0  # length of its streamed_text() already printed
+
+    def on_turn_start(self, agent: str):
+        print(f"\n{_NAMES[agent]}: ", end="", flush=True)
+        self._streamed = ""
+        self._printed = 0
+
+    def on_intent(self, intent_id: str):
+        print(f"[{intent_id}] ", end="", flush=True)
+
+    def on_chunk(self, agent: str, chunk: StreamChunk):
+        if self.stream and chunk.text:
+            # Hide the marker as the UI does
+            self._streamed += chunk.text
+            shown = streamed_text(self._streamed)
+            print(shown[self._printed:], end="", flush=True)
+            self._printed = len(shown)
+
+    def on_message(self, message: dict):
+        if message.get("usage") is None:
+            # Injected input: no turn was started for it
+            print(f"\n{_NAMES[message['agent']]}: {message['content']}")
+        elif not self._streamed:
+            print(message["content"])
+        else:
+            print(self._streamed.replace(SOLVED_MARKER, "")[self._printed:])
+
+    def on_finish(self, reason: str):
+        print(f"\n— {'задача решена' if reason == 'solved' else 'достигнут лимит шагов'}")
+
+
+def _parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m engine", description="Run a LearnLM lesson headless.")
+    parser.add_argument("--config", help="JSON file with EngineConfig fields")
+    parser.add_argument("--input", help="student's first message (default: generated)")
+    parser.add_argument("--teacher-model", choices=list(AVAILABLE_MODELS))
+    parser.add_argument("--student-model", choices=list(AVAILABLE_MODELS))
+    parser.add_argument(
+        "--classifier-model",
+        choices=["student", *AVAILABLE_MODELS],
+        help='situation classifier model ("student": same as the student)',
+    )
+    parser.add_argument("--max-steps", type=int)
+    parser.add_argument("--output", help="write the dialog as JSON here")
+    parser.add_argument("--journal", help="append completed turns to this journal file")
+    parser.add_argument("--resume", metavar="DIALOG_ID", help="continue this dialog from --journal")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use the async API (no streaming)")
+    parser.add_argument("--quiet", action="store_true", help="do not print the dialog")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log at INFO level")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str]) -> int:
+    args = _parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(name)s %(levelname)s: %(message)s",
+    )
+    load_dotenv()
+
+    overrides = {}
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            overrides.update(json.load(f))
+    for key in ("input", "teacher_model", "student_model", "classifier_model", "max_steps"):
+        value = getattr(args, key)
+        if value is not None:
+            overrides["first_input" if key == "input" else key] = value
+    if overrides.get("classifier_model") == "student":
+        overrides["classifier_model"] = None
+    if args.resume and not args.journal:
+        print("--resume needs --journal", file=sys.stderr)
+        return 2
+    journal = Journal(args.journal) if args.journal else None
+    journaled = None
+    if args.resume:
+        journaled = journal.get(args.resume)
+        if journaled is None:
+            print(f"Dialog {args.resume} is not in {args.journal}", file=sys.stderr)
+            return 2
+        overrides = {**journaled.config, **overrides}
+    config = EngineConfig.from_env()
+    config = EngineConfig.from_mapping({**config.to_dict(secrets=True), **overrides})
+
+    errors = config.validate()
+    if errors:
+        for error in errors:
+            print(error, file=sys.stderr)
+        return 2
+
+    events = DialogEvents() if args.quiet else ConsoleEvents()
+    if journaled is not None:
+        engine = DialogEngine.resume(journaled, config, events, journal)
+    else:
+        engine = DialogEngine(config, events=events, journal=journal)
+        if journal is not None:
+            print(f"Dialog id: {engine.id}", file=sys.stderr)
+    try:
+        if args.use_async:
+            asyncio.run(engine.arun())
+        else:
+            engine.run()
+    except ConfigError as e:
+        print(e, file=sys.stderr)
+        return 2
+    finally:
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "config": config.to_dict(),
+                        "usage": dialog_usage(engine.messages),
+                        "messages": engine.messages,
+                    },
+                    f,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+
+    total = dialog_usage(engine.messages)["total"]
+    print(
+        f"\n{engine.step_count} шагов, {total['calls']} вызовов, "
+        f"{total['input_tokens']} вход / {total['output_tokens']} выход токенов",
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,335 @@
+"""Concurrent batch simulation over a matrix of lesson settings.
+
+    python -m engine.batch matrix.json --out runs/weak-vs-strong --workers 32
+
+The matrix is a JSON object; every list is a dimension of the product:
+
+    {
+      "scenarios": "tasks",          // "tasks", "topics", "all" or a list of texts
+      "student_types": ["Слабый", "Сильный"],
+      "teacher_models": ["Gemini 3 Flash"],
+      "student_models": ["GPT OSS 120B (Yandex)"],
+      "teacher_thinking_levels": ["low", "high"],
+      "seeds": [1, 2],
+      "repetitions": 1,
+      "config": {"max_steps": 20}    // EngineConfig fields shared by all dialogs
+    }
+
+Dialogs run on a bounded pool of asyncio workers; each turn also holds a
+slot of its provider's concurrency limit. Every finished dialog is appended
+to DIR/dialogs.jsonl as it completes (failures to DIR/failures.jsonl), and
+dialogs already there are skipped on a rerun. Turns are journaled to
+DIR/journal.jsonl as they complete: a rerun after a crash or failed dialogs
+continues each interrupted dialog from its last completed turn.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import hashlib
+import itertools
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from config.defaults import AVAILABLE_MODELS, STUDENT_TYPES
+from config.scenarios import TASK_SCENARIOS, TOPIC_SCENARIOS
+from config.settings import BATCH_PROVIDER_CONCURRENCY, BATCH_WORKERS
+from engine.config import EngineConfig
+from engine.dialog import DialogEngine
+from engine.journal import Journal, JournaledDialog
+from utils.usage import dialog_usage
+
+log = logging.getLogger(__name__)
+
+_SCENARIO_SETS = {
+    "tasks": TASK_SCENARIOS,
+    "topics": TOPIC_SCENARIOS,
+    "all": TASK_SCENARIOS + TOPIC_SCENARIOS,
+}
+
+
+@dataclass(frozen=True)
+class BatchJob:
+    """One dialog of the batch."""
+
+    scenario: str
+    student_type: str
+    teacher_model: str
+    student_model: str
+    teacher_thinking_level: str | None
+    seed: int
+    repetition: int
+    settings: str = ""  # digest of the job's full config and prompts (see BatchMatrix.jobs)
+
+    @property
+    def id(self) -> str:
+        """Stable id, used to skip finished dialogs on a rerun.
+
+        Covers the settings digest, so a rerun with another max_steps,
+        prompt or intent mode runs the dialogs again instead of skipping them.
+        """
+        payload = json.dumps(dataclasses.astuple(self), ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def config(self, base: EngineConfig) -> EngineConfig:
+        config = base.with_student_type(self.student_type)
+        config = config.with_model("teacher", self.teacher_model, self.teacher_thinking_level)
+        config = config.with_model("student", self.student_model)
+        return dataclasses.replace(
+            config,
+            first_input=self.scenario,
+            seed=self.seed * 1000 + self.repetition,
+        )
+
+
+@dataclass
+class BatchMatrix:
+    scenarios: list[str]
+    teacher_models: list[str]
+    student_models: list[str]
+    student_types: list[str] = field(default_factory=lambda: list(STUDENT_TYPES))
+    # None keeps the config's level; ignored for models without thinking
+    teacher_thinking_levels: list[str | None] = field(default_factory=lambda: [None])
+    seeds: list[int] = field(default_factory=lambda: [0])
+    repetitions: int = 1
+    config: dict = field(default_factory=dict)  # EngineConfig overrides
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BatchMatrix":
+        data = dict(data)
+        scenarios = data.pop("scenarios", "all")
+        if isinstance(scenarios, str):
+            scenarios = list(_SCENARIO_SETS[scenarios])
+        matrix = cls(scenarios=scenarios, **data)
+        unknown = [m for m in matrix.teacher_models + matrix.student_models if m not in AVAILABLE_MODELS]
+        if unknown:
+            raise ValueError(f"Unknown models: {', '.join(unknown)}")
+        bad_types = [t for t in matrix.student_types if t not in STUDENT_TYPES]
+        if bad_types:
+            raise ValueError(f"Unknown student types: {', '.join(bad_types)}")
+        return matrix
+
+    def base_config(self, base: EngineConfig | None = None) -> EngineConfig:
+        """*base* (default: from the environment) with the matrix's config overrides."""
+        base = base or EngineConfig.from_env()
+        return EngineConfig.from_mapping({**base.to_dict(secrets=True), **self.config})
+
+    def jobs(self, base: EngineConfig | None = None) -> list[BatchJob]:
+        base = self.base_config(base)
+        jobs = {}
+        for scenario, stype, teacher, student, level, seed, rep in itertools.product(
+            self.scenarios,
+            self.student_types,
+            self.teacher_models,
+            self.student_models,
+            self.teacher_thinking_levels,
+            self.seeds,
+            range(self.repetitions),
+        ):
+            if not AVAILABLE_MODELS[teacher].get("supports_thinking"):
+                level = None  # the level would be dropped anyway; avoid duplicates
+            job = BatchJob(scenario, stype, teacher, student, level, seed, rep)
+            job = dataclasses.replace(job, settings=settings_digest(job.config(base)))
+            jobs.setdefault(job.id, job)
+        return list(jobs.values())
+
+
+def settings_digest(config: EngineConfig) -> str:
+    """Short hash of everything in *config* but the API keys."""
+    payload = json.dumps(config.to_dict(), ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass
+class BatchResult:
+    total: int
+    skipped: int = 0
+    done: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+
+class ProviderLimits:
+    """One semaphore per provider kind ("gemini", "yandex", "mock")."""
+
+    def __init__(self, limits: dict[str, int | None]):
+        self._semaphores = {
+            name: asyncio.Semaphore(limit) for name, limit in limits.items() if limit
+        }
+
+    def for_model(self, model_name: str) -> asyncio.Semaphore | None:
+        return self._semaphores.get(AVAILABLE_MODELS[model_name]["provider"])
+
+    def slot(self, engine: DialogEngine):
+        """Async context manager holding a slot for the engine's next turn."""
+        config = engine.config
+        model = config.teacher_model if engine.next_agent() == "teacher" else config.student_model
+        return self.for_model(model) or contextlib.nullcontext()
+
+
+def _finished_ids(path: Path) -> set[str]:
+    if not path.exists():
+        return set()
+    ids = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                ids.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                continue  # a line cut short by an interrupted run
+    return ids
+
+
+async def run_dialog(
+    job: BatchJob,
+    config: EngineConfig,
+    limits: ProviderLimits,
+    journal: Journal,
+    journaled: JournaledDialog | None,
+) -> dict:
+    """Run *job* to the end (continuing *journaled* if given); returns its corpus record."""
+    # Off the event loop: the journal's start record is fsynced
+    if journaled is None:
+        engine = await asyncio.to_thread(DialogEngine, config, journal=journal, dialog_id=job.id)
+    else:
+        engine = await asyncio.to_thread(DialogEngine.resume, journaled, config, journal=journal)
+        log.info("Resuming %s after %d messages", job.id, len(journaled.messages))
+    started = time.monotonic()
+    try:
+        while not engine.finished:
+            async with limits.slot(engine):
+                await engine.astep()
+    finally:
+        # Delete the dialog's provider-side caches now rather than at their TTL
+        await asyncio.to_thread(engine.prompt_cache.release)
+    return {
+        "id": job.id,
+        "job": dataclasses.asdict(job),
+        "config": engine.config.to_dict(),
+        "solved": engine.solved,
+        "steps": engine.step_count,
+        "elapsed": round(time.monotonic() - started, 3),
+        "resumed": journaled is not None,
+        "usage": dialog_usage(engine.messages),
+        "messages": engine.messages,
+    }
+
+
+async def run_batch(
+    matrix: BatchMatrix,
+    out_dir: str | Path,
+    base: EngineConfig | None = None,
+    workers: int = BATCH_WORKERS,
+    provider_limits: dict[str, int | None] | None = None,
+) -> BatchResult:
+    """Run every job of *matrix* not yet in out_dir/dialogs.jsonl."""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    dialogs_path, failures_path = out / "dialogs.jsonl", out / "failures.jsonl"
+    journal = Journal(out / "journal.jsonl")
+
+    base = matrix.base_config(base)
+    jobs = matrix.jobs(base)
+    finished = _finished_ids(dialogs_path)
+    pending = [job for job in jobs if job.id not in finished]
+    journaled = journal.load() if pending else {}
+    result = BatchResult(total=len(jobs), skipped=len(jobs) - len(pending))
+    log.info(
+        "Batch: %d dialogs, %d already done, %d to resume",
+        len(jobs), result.skipped, sum(job.id in journaled for job in pending),
+    )
+
+    limits = ProviderLimits({**BATCH_PROVIDER_CONCURRENCY, **(provider_limits or {})})
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in pending:
+        queue.put_nowait(job)
+    started = time.monotonic()
+
+    with open(dialogs_path, "a", encoding="utf-8") as dialogs, open(failures_path, "a", encoding="utf-8") as failures:
+
+        def write(f, record: dict):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+
+        async def worker():
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                config = job.config(base)
+                try:
+                    errors = config.validate()
+                    if errors:
+                        raise ValueError("; ".join(errors))
+                    record = await run_dialog(job, config, limits, journal, journaled.pop(job.id, None))
+                except Exception as e:
+                    result.failed += 1
+                    log.warning("Dialog %s failed: %r", job.id, e)
+                    write(failures, {"id": job.id, "job": dataclasses.asdict(job), "error": repr(e)})
+                    continue
+                result.done += 1
+                write(dialogs, record)
+                log.info(
+                    "[%d/%d] %s: %d steps%s, %.1f s",
+                    result.done + result.failed, len(pending), job.id, record["steps"],
+                    ", solved" if record["solved"] else "", record["elapsed"],
+                )
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(workers, len(pending))))))
+
+    result.elapsed = time.monotonic() - started
+    return result
+
+
+def parse_limits(items: list[str]) -> dict[str, int | None]:
+    """--limit PROVIDER=N options as provider_limits (0 = no limit)."""
+    limits = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        limits[name] = int(value) or None
+    return limits
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m engine.batch", description="Run a matrix of LearnLM lessons.")
+    parser.add_argument("matrix", help="JSON file with the batch matrix")
+    parser.add_argument("--out", required=True, help="output directory (dialogs.jsonl, failures.jsonl)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="dialogs in flight")
+    parser.add_argument(
+        "--limit", action="append", default=[], metavar="PROVIDER=N",
+        help="concurrent requests per provider, e.g. gemini=8 (0 = no limit)",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only print the number of dialogs")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(name)s %(levelname)s: %(message)s")
+    for name in ("httpx", "google_genai", "openai"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    load_dotenv()
+
+    with open(args.matrix, encoding="utf-8") as f:
+        matrix = BatchMatrix.from_dict(json.load(f))
+    if args.dry_run:
+        print(f"{len(matrix.jobs())} dialogs")
+        return 0
+
+    limits = parse_limits(args.limit)
+    result = asyncio.run(run_batch(matrix, args.out, workers=args.workers, provider_limits=limits))
+    rate = result.done / result.elapsed * 3600 if result.elapsed else 0.0
+    print(
+        f"{result.done} done, {result.failed} failed, {result.skipped} skipped "
+        f"in {result.elapsed:.1f} s ({rate:.0f} dialogs/hour)"
+    )
+    return 1 if result.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,174 @@
+"""Explicit dialog configuration, independent of Streamlit session state."""
+
+import copy
+import dataclasses
+import os
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+
+from agents.intent import DEFAULT_CLASSIFIER_TEMPLATE
+from config.defaults import (
+    AVAILABLE_MODELS,
+    DEFAULT_CORRECT_ANSWER_PROB,
+    DEFAULT_INTENT_WEIGHTS,
+    DEFAULT_MISTAKE_WEIGHTS,
+    DEFAULT_SITUATION_WEIGHTS,
+    DEFAULT_STUDENT_PROMPTS,
+    DEFAULT_TEACHER_PROMPT,
+    INTENTS,
+    TEACHER_GREETING,
+)
+from config.settings import (
+    DEFAULT_CONTEXT_TOKENS,
+    DEFAULT_MAX_TOKENS,
+    DEFAULT_TEMPERATURE,
+    MAX_DIALOG_STEPS,
+)
+
+
+class ConfigError(ValueError):
+    """The config cannot run a dialog (e.g. missing API keys)."""
+
+
+@dataclass
+class EngineConfig:
+    """Everything a dialog depends on. Field names match the session state keys,
+    and the defaults here are the UI's defaults too (utils/session.py)."""
+
+    # API keys
+    gemini_api_key: str = ""
+    yandex_api_key: str = ""
+    yandex_folder_id: str = ""
+    # Teacher
+    teacher_model: str = "Gemini 3 Flash"
+    teacher_thinking_level: str | None = "high"
+    teacher_reasoning_effort: str | None = None
+    teacher_prompt: str = DEFAULT_TEACHER_PROMPT
+    # Student
+    student_type: str = "Слабый"
+    student_model: str = "GPT OSS 120B (Yandex)"
+    student_thinking_level: str | None = None
+    student_reasoning_effort: str | None = "medium"
+    student_prompt: str = DEFAULT_STUDENT_PROMPTS["Слабый"]
+    # Intents
+    intent_mode: str = "llm"  # "random", "llm" or "fused"
+    intent_weights: dict[str, int] = field(
+        default_factory=lambda: copy.deepcopy(DEFAULT_INTENT_WEIGHTS["Слабый"])
+    )
+    intent_prompts: dict[str, str] = field(
+        default_factory=lambda: {i["id"]: i["prompt"] for i in INTENTS}
+    )
+    situation_weights: dict[str, dict[str, int]] = field(
+        default_factory=lambda: copy.deepcopy(DEFAULT_SITUATION_WEIGHTS["Слабый"])
+    )
+    correct_answer_prob: int = DEFAULT_CORRECT_ANSWER_PROB["Слабый"]
+    mistake_weights: dict[str, int] | None = field(
+        default_factory=lambda: copy.deepcopy(DEFAULT_MISTAKE_WEIGHTS["Слабый"])
+    )
+    classifier_prompt: str = DEFAULT_CLASSIFIER_TEMPLATE
+    # None = same model as the student; also used when this model has no credentials
+    classifier_model: str | None = "Gemini 2.5 Flash"
+    local_classifier: bool = True
+    speculative_k: int = 0
+    # Generation
+    temperature: float = DEFAULT_TEMPERATURE
+    max_tokens: int = DEFAULT_MAX_TOKENS
+    teacher_context_tokens: int = DEFAULT_CONTEXT_TOKENS
+    student_context_tokens: int = DEFAULT_CONTEXT_TOKENS
+    # Dialog
+    greeting: str = TEACHER_GREETING
+    first_input: str | None = None  # student's first message; None = generated
+    max_steps: int = MAX_DIALOG_STEPS
+    seed: int | None = None  # seeds the student's intent and answer draws
+
+    @classmethod
+    def from_mapping(cls, state: Mapping) -> "EngineConfig":
+        """Config from a mapping such as st.session_state (missing keys keep defaults)."""
+        names = {f.name for f in dataclasses.fields(cls)}
+        return cls(**{k: state[k] for k in names if k in state})
+
+    @classmethod
+    def from_env(cls, **overrides) -> "EngineConfig":
+        """Config with API keys from environment variables (e.g. .env)."""
+        return cls(
+            gemini_api_key=os.getenv("GEMINI_API_KEY", ""),
+            yandex_api_key=os.getenv("YANDEX_API_KEY", ""),
+            yandex_folder_id=os.getenv("YANDEX_FOLDER_ID", ""),
+            **overrides,
+        )
+
+    def with_student_type(self, student_type: str) -> "EngineConfig":
+        """Copy with the student prompt and weights of *student_type* (as the sidebar sets them)."""
+        return dataclasses.replace(
+            self,
+            student_type=student_type,
+            student_prompt=DEFAULT_STUDENT_PROMPTS[student_type],
+            intent_weights=copy.deepcopy(DEFAULT_INTENT_WEIGHTS[student_type]),
+            situation_weights=copy.deepcopy(DEFAULT_SITUATION_WEIGHTS[student_type]),
+            correct_answer_prob=DEFAULT_CORRECT_ANSWER_PROB[student_type],
+            mistake_weights=copy.deepcopy(DEFAULT_MISTAKE_WEIGHTS[student_type]),
+        )
+
+    def with_model(self, prefix: str, model_name: str, thinking_level: str | None = None) -> "EngineConfig":
+        """Copy with *prefix* ("teacher"/"student") on *model_name*.
+
+        Thinking level and reasoning effort are kept only if the model supports
+        them; *thinking_level* overrides the current level.
+        """
+        model_cfg = AVAILABLE_MODELS[model_name]
+        thinking_level = thinking_level or getattr(self, f"{prefix}_thinking_level")
+        return dataclasses.replace(self, **{
+            f"{prefix}_model": model_name,
+            f"{prefix}_thinking_level": thinking_level if model_cfg.get("supports_thinking") else None,
+            f"{prefix}_reasoning_effort": (
+                getattr(self, f"{prefix}_reasoning_effort") if model_cfg.get("supports_reasoning") else None
+            ),
+        })
+
+    def to_dict(self, secrets: bool = False) -> dict:
+        """JSON-friendly dict; API keys are left out unless *secrets*."""
+        data = dataclasses.asdict(self)
+        if not secrets:
+            for key in ("gemini_api_key", "yandex_api_key", "yandex_folder_id"):
+                data.pop(key)
+        return data
+
+    def missing_keys(self, model_name: str) -> str | None:
+        """Error message if the model's provider has no credentials, else None."""
+        provider = AVAILABLE_MODELS[model_name]["provider"]
+        if provider == "gemini" and not self.gemini_api_key:
+            return "Gemini API Key не задан!"
+        if provider == "yandex" and (not self.yandex_api_key or not self.yandex_folder_id):
+            return "Yandex API Key и Folder ID должны быть заданы!"
+        return None
+
+    def effective_classifier_model(self) -> str | None:
+        """The classifier model a dialog runs (None = the student's model).
+
+        A classifier model whose provider has no credentials falls back to
+        the student's, so the default Gemini classifier does not make a
+        Gemini key mandatory for Mock- or Yandex-only runs.
+        """
+        if self.classifier_model and self.missing_keys(self.classifier_model) is None:
+            return self.classifier_model
+        return None
+
+    def validate(self) -> list[str]:
+        """Problems that prevent a dialog from running (empty if none)."""
+        if self.intent_mode in ("llm", "fused"):
+            bad = [sid for sid, w in self.situation_weights.items() if sum(w.values()) != 100]
+            if bad:
+                return [f"Сумма весов ≠ 100 для ситуаций: {', '.join(bad)}"]
+        else:
+            total = sum(self.intent_weights.values())
+            if total != 100:
+                return [f"Сумма вероятностей интентов = {total}% (должна быть 100%)"]
+
+        # The classifier falls back to the student's model (effective_classifier_model)
+        model_names = [self.teacher_model, self.student_model]
+        errors = []
+        for name in model_names:
+            error = self.missing_keys(name)
+            if error and error not in errors:
+                errors.append(error)
+        return errors
@@ -0,0 +1,385 @@
+"""Headless dialog engine: runs a lesson without Streamlit.
+
+The engine owns the transcript and per-dialog state (context windows,
+prompt cache) and implements the turn rules: the first student input,
+the [SOLVED] marker and the step limit. The Streamlit UI drives it turn by
+turn with prepare()/complete() around its own rendering; scripts and the
+CLI (python -m engine) use run() or arun().
+"""
+
+import asyncio
+import contextlib
+import logging
+import random
+import time
+import uuid
+from collections.abc import Callable, Iterator
+
+from agents.context import ContextManager, ContextPolicy
+from agents.situation_model import get_local_classifier
+from agents.student import StudentAgent
+from agents.teacher import TeacherAgent
+from engine.config import ConfigError, EngineConfig
+from engine.events import DialogEvents
+from engine.journal import Journal, JournaledDialog, restore_rng_state
+from models.base import BaseProvider, LLMResponse, StreamChunk, collect_stream
+from models.pool import get_classifier_provider, get_provider, get_summary_provider
+from models.prompt_cache import PromptCache
+from models.transcript import HistoryView, Transcript
+
+log = logging.getLogger(__name__)
+
+SOLVED_MARKER = "[SOLVED]"
+
+
+def streamed_text(text: str, marker: str = SOLVED_MARKER) -> str:
+    """Text streamed so far as it should be shown: without *marker*, and
+    without a trailing piece that may be its start (the marker can arrive
+    split across chunks)."""
+    text = text.replace(marker, "")
+    for n in range(len(marker) - 1, 0, -1):
+        if text.endswith(marker[:n]):
+            return text[:-n]
+    return text
+
+# Speaker names in the summarizer's input, per agent's perspective
+_CONTEXT_LABELS = {
+    "teacher": {"assistant": "Репетитор", "user": "Ученик"},
+    "student": {"assistant": "Ученик", "user": "Репетитор"},
+}
+
+OpenTurn = Callable[[], tuple[Iterator[StreamChunk], str | None]]
+
+
+class DialogEngine:
+    """One dialog between the teacher and student agents."""
+
+    def __init__(
+        self,
+        config: EngineConfig,
+        messages: list[dict] | None = None,
+        events: DialogEvents | None = None,
+        journal: Journal | None = None,
+        dialog_id: str | None = None,
+    ):
+        """
+        messages: dialog to continue, updated in place (default: a new
+                  dialog starting with config.greeting).
+        journal: every completed turn is appended there (see resume()).
+        """
+        self.config = config
+        if messages is None:
+            messages = [{"agent": "teacher", "content": config.greeting, "intent_id": None}]
+        self.messages = messages
+        self.events = events or DialogEvents()
+        self.transcript = Transcript.following(messages)
+        self.prompt_cache = PromptCache()
+        self.solved = False
+        self.rng = random.Random(config.seed)
+        self.id = dialog_id or uuid.uuid4().hex
+        self.journal = journal
+        self._contexts: dict[str, ContextManager] = {}
+        self._journaled_config = None
+        if journal is not None:
+            self._journaled_config = config.to_dict()
+            journal.start(self.id, self._journaled_config, messages)
+
+    @classmethod
+    def resume(
+        cls,
+        dialog: JournaledDialog,
+        config: EngineConfig,
+        events: DialogEvents | None = None,
+        journal: Journal | None = None,
+    ) -> "DialogEngine":
+        """Continue a journaled dialog after its last completed turn.
+
+        *config* supplies the API keys the journal does not keep; new turns
+        go to *journal*. Context summaries and provider caches are rebuilt
+        on demand; finished turns are not requested again.
+        """
+        engine = cls(config, dialog.messages, events, dialog_id=dialog.id)
+        if dialog.rng_state is not None:
+            restore_rng_state(engine.rng, dialog.rng_state)
+        engine.solved = dialog.solved
+        engine.journal = journal
+        engine._journaled_config = dialog.config
+        return engine
+
+    # ─── State ─────────────────────────────────────────────────
+
+    @property
+    def step_count(self) -> int:
+        """Teacher replies after the greeting."""
+        return max(0, sum(m["agent"] == "teacher" for m in self.messages) - 1)
+
+    @property
+    def finished(self) -> bool:
+        return self.solved or self.step_count >= self.config.max_steps
+
+    def next_agent(self) -> str:
+        return "student" if self.messages[-1]["agent"] == "teacher" else "teacher"
+
+    def pending_input(self) -> str | None:
+        """The configured first student message, if it is the student's first turn."""
+        if len(self.messages) == 1 and self.messages[0]["agent"] == "teacher":
+            return self.config.first_input or None
+        return None
+
+    def history(self, perspective: str) -> HistoryView:
+        """Dialog as *perspective* ("teacher" or "student") sees it."""
+        if not self.transcript.sync(self.messages):
+            self.transcript = Transcript.following(self.messages)
+        return self.transcript.view(perspective)
+
+    # ─── Agents ────────────────────────────────────────────────
+
+    def _provider(self, prefix: str) -> BaseProvider:
+        model_name = getattr(self.config, f"{prefix}_model")
+        error = self.config.missing_keys(model_name)
+        if error:
+            raise ConfigError(error)
+        return get_provider(
+            model_name,
+            gemini_api_key=self.config.gemini_api_key,
+            yandex_api_key=self.config.yandex_api_key,
+            yandex_folder_id=self.config.yandex_folder_id,
+            thinking_level=getattr(self.config, f"{prefix}_thinking_level"),
+            reasoning_effort=getattr(self.config, f"{prefix}_reasoning_effort"),
+        )
+
+    def _classifier_provider(self) -> BaseProvider | None:
+        """Provider for the LLM situation classifier (None = the student's)."""
+        model_name = self.config.effective_classifier_model()
+        if not model_name:
+            return None
+        return get_classifier_provider(
+            model_name,
+            gemini_api_key=self.config.gemini_api_key,
+            yandex_api_key=self.config.yandex_api_key,
+            yandex_folder_id=self.config.yandex_folder_id,
+        )
+
+    def _context(self, prefix: str) -> ContextManager | None:
+        """The agent's context manager (None = whole dialog).
+
+        Kept for the dialog so its summary carries over between turns;
+        replaced when the budget or the summarizing provider changes.
+        Summaries use the agent's model with reasoning turned down.
+        """
+        budget = getattr(self.config, f"{prefix}_context_tokens") or 0
+        if not budget:
+            return None
+        summarizer = get_summary_provider(
+            getattr(self.config, f"{prefix}_model"),
+            gemini_api_key=self.config.gemini_api_key,
+            yandex_api_key=self.config.yandex_api_key,
+            yandex_folder_id=self.config.yandex_folder_id,
+        )
+        manager = self._contexts.get(prefix)
+        if manager is None or manager.policy.max_tokens != budget or manager.summarizer is not summarizer:
+            manager = ContextManager(ContextPolicy(max_tokens=budget), summarizer, _CONTEXT_LABELS[prefix])
+            self._contexts[prefix] = manager
+        return manager
+
+    def _request(self, agent: str) -> tuple[TeacherAgent | StudentAgent, dict]:
+        """The agent for the next turn and its generate/stream keyword arguments."""
+        config = self.config
+        if agent == "teacher":
+            provider = self._provider("teacher")
+            teacher = TeacherAgent(
+                provider,
+                config.teacher_prompt,
+                self._context("teacher"),
+                self.prompt_cache,
+            )
+            kwargs = {
+                "history": self.history("teacher"),
+                "temperature": config.temperature,
+                "max_tokens": config.max_tokens,
+            }
+            return teacher, kwargs
+
+        provider = self._provider("student")
+        local_classifier = classifier_provider = None
+        if config.intent_mode in ("llm", "fused") and config.local_classifier:
+            local_classifier = get_local_classifier()
+        if config.intent_mode == "llm":
+            classifier_provider = self._classifier_provider()
+        student = StudentAgent(
+            provider,
+            config.student_prompt,
+            local_classifier,
+            classifier_provider,
+            speculative_k=config.speculative_k if config.intent_mode == "llm" else 0,
+            context=self._context("student"),
+            rng=self.rng,
+        )
+        kwargs = {
+            "history": self.history("student"),
+            "intent_weights": config.intent_weights,
+            "intent_prompts": config.intent_prompts,
+            "temperature": config.temperature,
+            "max_tokens": config.max_tokens,
+            "correct_answer_prob": config.correct_answer_prob,
+            "mistake_weights": config.mistake_weights,
+        }
+        if config.intent_mode in ("llm", "fused"):
+            kwargs.update({
+                "intent_mode": config.intent_mode,
+                "situation_weights": config.situation_weights,
+                "classifier_template": config.classifier_prompt,
+            })
+        return student, kwargs
+
+    def prepare(self, agent: str | None = None) -> tuple[TeacherAgent | StudentAgent, OpenTurn]:
+        """Build the next turn's request without running it.
+
+        Returns (agent_obj, open_turn); open_turn() -> (chunks, intent_id)
+        only reads what was captured here, so it may run on another thread.
+        Raises ConfigError if the agent's provider has no credentials.
+        """
+        agent = agent or self.next_agent()
+        agent_obj, kwargs = self._request(agent)
+        if agent == "teacher":
+            return agent_obj, lambda: (agent_obj.stream(**kwargs), None)
+        return agent_obj, lambda: agent_obj.stream(**kwargs)
+
+    # ─── Messages ──────────────────────────────────────────────
+
+    def inject(self, text: str) -> dict:
+        """Add a pre-made student message (e.g. the chosen scenario)."""
+        return self._append({"agent": "student", "content": text, "intent_id": None})
+
+    def complete(
+        self,
+        agent: str,
+        agent_obj: TeacherAgent | StudentAgent,
+        response: LLMResponse,
+        intent_id: str | None = None,
+        prefetched: bool = False,
+    ) -> dict:
+        """Record a finished turn; detects [SOLVED] in teacher replies."""
+        summary = agent_obj.summary_response
+        if agent == "teacher":
+            text = response.text
+            solved = SOLVED_MARKER in text
+            if solved:
+                text = text.replace(SOLVED_MARKER, "").strip()
+            message = self._append({
+                "agent": "teacher",
+                "content": text,
+                "reasoning": response.reasoning,
+                "intent_id": None,
+                "usage": response.usage(),
+                "summary_usage": summary.usage() if summary else None,
+                "prefetched": prefetched,
+            })
+            if solved:
+                self.solved = True
+                self._finish("solved")
+            elif self.step_count >= self.config.max_steps:
+                self._finish("max_steps")
+            return message
+
+        student, classifier = agent_obj, agent_obj.classifier_response
+        return self._append({
+            "agent": "student",
+            "content": response.text,
+            "reasoning": response.reasoning,
+            "intent_id": intent_id,
+            "situation": student.situation_id,
+            "situation_probs": (
+                {
+                    sid: round(p, 3)
+                    for sid, p in sorted(student.situation_probs.items(), key=lambda kv: -kv[1])
+                    if p >= 0.01
+                }
+                if student.situation_probs else None
+            ),
+            "situation_source": student.situation_source,
+            "speculation": student.speculation,
+            "mistake": student.mistake_id,
+            "usage": response.usage(),
+            "classifier_usage": classifier.usage() if classifier else None,
+            "summary_usage": summary.usage() if summary else None,
+            "prefetched": prefetched,
+        })
+
+    def _append(self, message: dict) -> dict:
+        self.messages.append(message)
+        if self.journal is not None:
+            config = self.config.to_dict()
+            if config != self._journaled_config:
+                self.journal.config(self.id, config)
+                self._journaled_config = config
+            self.journal.turn(self.id, len(self.messages) - 1, message, self.rng)
+        self.events.on_message(message)
+        return message
+
+    def _finish(self, reason: str):
+        if self.journal is not None:
+            self.journal.finish(self.id, reason)
+        self.events.on_finish(reason)
+
+    # ─── Running ───────────────────────────────────────────────
+
+    def step(self) -> dict | None:
+        """Run the next turn, streaming through the events. None if finished."""
+        if self.finished:
+            return None
+        text = self.pending_input()
+        if text:
+            return self.inject(text)
+        agent = self.next_agent()
+        agent_obj, open_turn = self.prepare(agent)
+        self.events.on_turn_start(agent)
+        started = time.monotonic()
+        chunks, intent_id = open_turn()
+        if intent_id:
+            self.events.on_intent(intent_id)
+        response = collect_stream(chunks, started, lambda chunk: self.events.on_chunk(agent, chunk))
+        return self.complete(agent, agent_obj, response, intent_id)
+
+    async def astep(self) -> dict | None:
+        """Async counterpart of step (no streaming: on_chunk is not called)."""
+        if self.finished:
+            return None
+        text = self.pending_input()
+        if text:
+            return await self._arecord(self.inject, text)
+        agent = self.next_agent()
+        agent_obj, kwargs = self._request(agent)
+        self.events.on_turn_start(agent)
+        if agent == "teacher":
+            response, intent_id = await agent_obj.agenerate(**kwargs), None
+        else:
+            response, intent_id = await agent_obj.agenerate(**kwargs)
+            self.events.on_intent(intent_id)
+        return await self._arecord(self.complete, agent, agent_obj, response, intent_id)
+
+    async def _arecord(self, record: Callable[..., dict], *args) -> dict:
+        """Run inject/complete off the event loop when turns are journaled
+        (fsync would stall every other coroutine). A cancelled caller still
+        waits for the turn to be recorded, so the next turn sees it."""
+        if self.journal is None:
+            return record(*args)
+        task = asyncio.ensure_future(asyncio.to_thread(record, *args))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            with contextlib.suppress(Exception):
+                await task
+            raise
+
+    def run(self) -> list[dict]:
+        """Run the lesson to completion; returns the messages."""
+        while self.step() is not None:
+            pass
+        return self.messages
+
+    async def arun(self) -> list[dict]:
+        """Async counterpart of run."""
+        while await self.astep() is not None:
+            pass
+        return self.messages
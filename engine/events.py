@@ -0,0 +1,25 @@
+"""Callbacks a DialogEngine reports progress through."""
+
+from models.base import StreamChunk
+
+
+class DialogEvents:
+    """Override the callbacks you need; all are no-ops by default.
+
+    Callbacks run on the thread (or event loop) driving the engine.
+    """
+
+    def on_turn_start(self, agent: str):
+        """*agent* ("teacher" or "student") starts generating."""
+
+    def on_intent(self, intent_id: str):
+        """The student's intent for the current turn is known."""
+
+    def on_chunk(self, agent: str, chunk: StreamChunk):
+        """A streamed piece of the current message (sync runs only)."""
+
+    def on_message(self, message: dict):
+        """A message was added to the dialog."""
+
+    def on_finish(self, reason: str):
+        """The dialog ended: "solved" or "max_steps"."""
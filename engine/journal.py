@@ -0,0 +1,135 @@
+"""Append-only journal of completed turns.
+
+Every finished turn is appended as one JSON line together with the state
+of the engine's random generator, so a dialog interrupted by a crash, a
+network error or a browser reload can be rebuilt and continued from its
+last completed turn without repeating any finished LLM call.
+
+Records, all keyed by "dialog":
+
+    {"event": "start",  "config": {...}, "messages": [...]}   dialog created
+    {"event": "config", "config": {...}}                      settings changed
+    {"event": "turn",   "index": n, "message": {...}, "rng": [...]}
+    {"event": "finish", "reason": "solved" | "max_steps"}
+
+API keys are never written. A line cut short by a crash is skipped on load.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from config.settings import JOURNAL_DIR, JOURNAL_FSYNC
+
+log = logging.getLogger(__name__)
+
+_DIALOG_ID = re.compile(r"[0-9a-f]{8,32}")
+
+
+@dataclass
+class JournaledDialog:
+    """A dialog as rebuilt from the journal."""
+
+    id: str
+    config: dict  # EngineConfig fields without API keys
+    messages: list[dict] = field(default_factory=list)
+    rng_state: tuple | None = None
+    finished: str | None = None  # finish reason; None = in progress
+
+    @property
+    def solved(self) -> bool:
+        return self.finished == "solved"
+
+
+def rng_state(rng: random.Random) -> list:
+    """random.Random state as JSON-friendly lists."""
+    version, internal, gauss = rng.getstate()
+    return [version, list(internal), gauss]
+
+
+def restore_rng_state(rng: random.Random, state: list):
+    version, internal, gauss = state
+    rng.setstate((version, tuple(internal), gauss))
+
+
+class Journal:
+    """A JSONL journal file; many dialogs may share one file."""
+
+    def __init__(self, path: str | Path, fsync: bool = JOURNAL_FSYNC):
+        self.path = Path(path)
+        self.fsync = fsync
+        self._lock = threading.Lock()
+
+    def _write(self, dialog_id: str, event: str, **data):
+        line = json.dumps(
+            {"dialog": dialog_id, "event": event, "time": round(time.time(), 3), **data},
+            ensure_ascii=False,
+        )
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+    def start(self, dialog_id: str, config: dict, messages: list[dict]):
+        self._write(dialog_id, "start", config=config, messages=messages)
+
+    def config(self, dialog_id: str, config: dict):
+        self._write(dialog_id, "config", config=config)
+
+    def turn(self, dialog_id: str, index: int, message: dict, rng: random.Random | None):
+        self._write(
+            dialog_id, "turn", index=index, message=message,
+            rng=rng_state(rng) if rng is not None else None,
+        )
+
+    def finish(self, dialog_id: str, reason: str):
+        self._write(dialog_id, "finish", reason=reason)
+
+    def load(self) -> dict[str, JournaledDialog]:
+        """All dialogs in the journal, rebuilt up to their last completed turn."""
+        dialogs: dict[str, JournaledDialog] = {}
+        if not self.path.exists():
+            return dialogs
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    dialog_id, event = record["dialog"], record["event"]
+                except (ValueError, KeyError):
+                    log.warning("Skipping a damaged journal line in %s", self.path)
+                    continue
+                if event == "start":
+                    # A restarted dialog id begins again from its start record
+                    dialogs[dialog_id] = JournaledDialog(dialog_id, record["config"], record["messages"])
+                    continue
+                dialog = dialogs.get(dialog_id)
+                if dialog is None:
+                    continue
+                if event == "config":
+                    dialog.config = record["config"]
+                elif event == "turn" and record["index"] == len(dialog.messages):
+                    dialog.messages.append(record["message"])
+                    if record.get("rng") is not None:
+                        dialog.rng_state = record["rng"]
+                elif event == "finish":
+                    dialog.finished = record["reason"]
+        return dialogs
+
+    def get(self, dialog_id: str) -> JournaledDialog | None:
+        return self.load().get(dialog_id)
+
+
+def dialog_journal(dialog_id: str) -> Journal | None:
+    """The UI's per-dialog journal (None if JOURNAL_DIR is disabled or the id is not one of ours)."""
+    if not JOURNAL_DIR or not _DIALOG_ID.fullmatch(dialog_id):
+        return None
+    return Journal(Path(JOURNAL_DIR) / f"{dialog_id}.jsonl")
@@ -0,0 +1,529 @@
+"""Headless simulation service: lessons over HTTP, WebSocket and SSE.
+
+    python -m engine.service --port 8765
+
+    POST   /dialogs                 create: {"config": {...}, "stream_tokens": false}
+    GET    /dialogs                 list dialogs in memory
+    GET    /dialogs/{id}            transcript, state and token usage
+    POST   /dialogs/{id}/step       run one turn, returns the new message
+    POST   /dialogs/{id}/run        autorun to the end in the background
+    POST   /dialogs/{id}/stop       stop autorun after the current turn
+    DELETE /dialogs/{id}            stop and forget the dialog
+    GET    /dialogs/{id}/events     Server-Sent Events
+    GET    /dialogs/{id}/ws         WebSocket: the same events; accepts
+                                    {"action": "step" | "run" | "stop"}
+
+"config" takes the session state fields (EngineConfig); API keys default
+to the service's environment. "student_type" alone also sets that type's
+prompt and weights, as the sidebar does.
+
+Events are JSON objects with a "type": turn_start, intent, chunk,
+message, finish, state, error. Turns run on the async API and are sent as
+whole messages; dialogs created with "stream_tokens" run their turns on a
+thread pool and also send "chunk" events as tokens arrive.
+
+Many dialogs share one process: providers come from the process-wide pool
+and every turn holds a slot of its provider's concurrency limit. Dialogs
+are journaled like the UI's, so a transcript can also be opened there
+with ?dialog=<id>.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import hmac
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import WSMsgType, web
+from dotenv import load_dotenv
+
+from config.defaults import AVAILABLE_MODELS, STUDENT_TYPES
+from config.settings import (
+    SERVICE_HOST,
+    SERVICE_IDLE_SECONDS,
+    SERVICE_MAX_DIALOGS,
+    SERVICE_PORT,
+    SERVICE_PROVIDER_CONCURRENCY,
+    SERVICE_STREAM_THREADS,
+    SERVICE_TOKEN_ENV,
+)
+from engine.batch import ProviderLimits
+from engine.config import ConfigError, EngineConfig
+from engine.dialog import DialogEngine
+from engine.events import DialogEvents
+from engine.journal import dialog_journal
+from models.base import StreamChunk
+from utils.usage import dialog_usage
+
+log = logging.getLogger(__name__)
+
+_CONFIG_FIELDS = {f.name for f in dataclasses.fields(EngineConfig)}
+_MODEL_FIELDS = ("teacher_model", "student_model", "classifier_model")
+
+
+class _Broadcast(DialogEvents):
+    """Forwards engine events to the dialog's subscribers.
+
+    Engine callbacks may come from a worker thread (streamed turns), so
+    events are handed to the event loop before they reach the queues.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.subscribers: set[asyncio.Queue] = set()
+        self.index = 0  # index of the next message
+
+    def publish(self, event: dict):
+        self.loop.call_soon_threadsafe(self._fanout, event)
+
+    def _fanout(self, event: dict):
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def on_turn_start(self, agent: str):
+        self.publish({"type": "turn_start", "agent": agent})
+
+    def on_intent(self, intent_id: str):
+        self.publish({"type": "intent", "intent_id": intent_id})
+
+    def on_chunk(self, agent: str, chunk: StreamChunk):
+        self.publish({"type": "chunk", "agent": agent, "text": chunk.text, "reasoning": chunk.reasoning})
+
+    def on_message(self, message: dict):
+        self.publish({"type": "message", "index": self.index, "message": message})
+        self.index += 1
+
+    def on_finish(self, reason: str):
+        self.publish({"type": "finish", "reason": reason})
+
+
+class ServiceDialog:
+    """A dialog hosted by the service."""
+
+    def __init__(self, engine: DialogEngine, events: _Broadcast, stream_tokens: bool):
+        self.engine = engine
+        self.events = events
+        self.stream_tokens = stream_tokens
+        self.created = time.time()
+        self.active = time.monotonic()  # last request or turn
+        self.turn_lock = asyncio.Lock()  # one turn at a time
+        self.autorun: asyncio.Task | None = None
+        self.error: str | None = None
+
+    @property
+    def id(self) -> str:
+        return self.engine.id
+
+    @property
+    def running(self) -> bool:
+        return self.autorun is not None and not self.autorun.done()
+
+    def touch(self):
+        self.active = time.monotonic()
+
+    def idle(self, now: float, timeout: float) -> bool:
+        """No requests, turns or subscribers for *timeout* seconds."""
+        return not self.running and not self.events.subscribers and now - self.active > timeout
+
+    def state(self) -> dict:
+        engine = self.engine
+        return {
+            "id": self.id,
+            "steps": engine.step_count,
+            "messages": len(engine.messages),
+            "solved": engine.solved,
+            "finished": engine.finished,
+            "running": self.running,
+            "error": self.error,
+        }
+
+    def transcript(self) -> dict:
+        return {
+            **self.state(),
+            "config": self.engine.config.to_dict(),
+            "usage": dialog_usage(self.engine.messages),
+            "messages": self.engine.messages,
+        }
+
+
+class SimulationService:
+    """Dialogs of one process and the turn machinery they share."""
+
+    def __init__(
+        self,
+        max_dialogs: int = SERVICE_MAX_DIALOGS,
+        idle_seconds: float = SERVICE_IDLE_SECONDS,
+        stream_threads: int = SERVICE_STREAM_THREADS,
+        provider_limits: dict[str, int | None] | None = None,
+    ):
+        self.max_dialogs = max_dialogs
+        self.idle_seconds = idle_seconds
+        self.dialogs: dict[str, ServiceDialog] = {}
+        self.limits = ProviderLimits({**SERVICE_PROVIDER_CONCURRENCY, **(provider_limits or {})})
+        self._executor = ThreadPoolExecutor(max_workers=stream_threads, thread_name_prefix="service-turn")
+        self._env = EngineConfig.from_env().to_dict(secrets=True)
+        self._tasks: set[asyncio.Task] = set()  # fire-and-forget turns, kept alive here
+
+    def config(self, fields: dict) -> EngineConfig:
+        """EngineConfig from request fields; raises ConfigError on bad input."""
+        unknown = sorted(set(fields) - _CONFIG_FIELDS)
+        if unknown:
+            raise ConfigError(f"Unknown config fields: {', '.join(unknown)}")
+        for key in _MODEL_FIELDS:
+            model_name = fields.get(key)
+            if model_name is not None and model_name not in AVAILABLE_MODELS:
+                raise ConfigError(f"Unknown model: {model_name}")
+        base = EngineConfig.from_mapping(self._env)
+        student_type = fields.get("student_type")
+        if student_type is not None:
+            if student_type not in STUDENT_TYPES:
+                raise ConfigError(f"Unknown student type: {student_type}")
+            base = base.with_student_type(student_type)
+        config = EngineConfig.from_mapping({**base.to_dict(secrets=True), **fields})
+        errors = config.validate()
+        if errors:
+            raise ConfigError("; ".join(errors))
+        return config
+
+    async def create(self, config: EngineConfig, stream_tokens: bool = False) -> ServiceDialog:
+        await self._evict()
+        if len(self.dialogs) >= self.max_dialogs:
+            raise OverflowError("Too many dialogs")
+        events = _Broadcast(asyncio.get_running_loop())
+        dialog_id = uuid.uuid4().hex
+        # The constructor writes the journal's start record: keep it off the loop
+        engine = await asyncio.to_thread(
+            DialogEngine, config, events=events, journal=dialog_journal(dialog_id), dialog_id=dialog_id
+        )
+        events.index = len(engine.messages)
+        dialog = ServiceDialog(engine, events, stream_tokens)
+        self.dialogs[dialog.id] = dialog
+        return dialog
+
+    async def _evict(self):
+        """Forget idle dialogs and, when full, the oldest finished ones
+        (all of them stay in their journals)."""
+        now = time.monotonic()
+        for dialog in [d for d in self.dialogs.values() if d.idle(now, self.idle_seconds)]:
+            log.info("Dropping idle dialog %s", dialog.id)
+            await self.remove(dialog.id)
+        if len(self.dialogs) < self.max_dialogs:
+            return
+        finished = sorted(
+            (d for d in self.dialogs.values() if d.engine.finished and not d.running),
+            key=lambda d: d.created,
+        )
+        for dialog in finished[: max(1, len(finished) // 2)]:
+            await self.remove(dialog.id)
+
+    async def remove(self, dialog_id: str):
+        """Forget a dialog; its event streams get a "removed" event and end."""
+        dialog = self.dialogs.pop(dialog_id)
+        if dialog.autorun is not None:
+            dialog.autorun.cancel()
+        dialog.events.publish({"type": "removed", "id": dialog_id})
+        # Deleting provider caches is a blocking HTTP call
+        await asyncio.to_thread(dialog.engine.prompt_cache.release)
+
+    async def step(self, dialog: ServiceDialog) -> dict | None:
+        """Run the dialog's next turn; None if it is finished."""
+        async with dialog.turn_lock:
+            dialog.touch()
+            engine = dialog.engine
+            if engine.finished:
+                return None
+            try:
+                async with self.limits.slot(engine):
+                    if dialog.stream_tokens:
+                        return await self._thread_step(engine)
+                    return await engine.astep()
+            except Exception as e:
+                dialog.error = f"{type(e).__name__}: {e}"
+                dialog.events.publish({"type": "error", "error": dialog.error})
+                raise
+
+    async def _thread_step(self, engine: DialogEngine) -> dict | None:
+        """engine.step() on the thread pool; on cancellation the turn still
+        finishes before the turn lock is released (a thread cannot be stopped)."""
+        future = asyncio.get_running_loop().run_in_executor(self._executor, engine.step)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            with contextlib.suppress(Exception):
+                await future
+            raise
+
+    def run(self, dialog: ServiceDialog):
+        """Start autorun in the background (no-op if already running)."""
+        if dialog.running:
+            return
+
+        async def autorun():
+            try:
+                while await self.step(dialog) is not None:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Autorun of %s failed", dialog.id)
+            finally:
+                dialog.touch()
+                dialog.events.publish({"type": "state", **dialog.state(), "running": False})
+
+        dialog.error = None
+        dialog.autorun = asyncio.create_task(autorun())
+        dialog.events.publish({"type": "state", **dialog.state()})
+
+    def spawn(self, coro) -> asyncio.Task:
+        """Run *coro* in the background, holding a reference until it is done."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def stop(self, dialog: ServiceDialog):
+        """Stop autorun. A turn in flight is cancelled and not recorded; a
+        token-streaming turn is finished and recorded first."""
+        if dialog.running:
+            dialog.autorun.cancel()
+
+    async def close(self):
+        for dialog_id in list(self.dialogs):
+            await self.remove(dialog_id)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ─── HTTP ──────────────────────────────────────────────────────
+
+def _error(status: int, message: str) -> web.Response:
+    return web.json_response({"error": message}, status=status, dumps=_dumps)
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _dialog(request: web.Request) -> ServiceDialog:
+    dialog = request.app["service"].dialogs.get(request.match_info["dialog_id"])
+    if dialog is None:
+        raise web.HTTPNotFound(text=_dumps({"error": "No such dialog"}), content_type="application/json")
+    dialog.touch()
+    return dialog
+
+
+@web.middleware
+async def _auth(request: web.Request, handler):
+    token = request.app["token"]
+    if token:
+        header = request.headers.get("Authorization", "")
+        bearer = header[len("Bearer "):] if header.startswith("Bearer ") else ""
+        # Browsers cannot set headers on EventSource/WebSocket: allow ?token=
+        if not (_same(bearer, token) or _same(request.query.get("token", ""), token)):
+            return _error(401, "Unauthorized")
+    return await handler(request)
+
+
+def _same(supplied: str, token: str) -> bool:
+    return hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8"))
+
+
+async def create_dialog(request: web.Request) -> web.Response:
+    service: SimulationService = request.app["service"]
+    try:
+        body = await request.json() if request.can_read_body else {}
+    except ValueError:
+        return _error(400, "Body is not JSON")
+    try:
+        config = service.config(body.get("config") or {})
+        dialog = await service.create(config, bool(body.get("stream_tokens")))
+    except ConfigError as e:
+        return _error(400, str(e))
+    except OverflowError as e:
+        return _error(429, str(e))
+    if body.get("run"):
+        service.run(dialog)
+    return web.json_response(dialog.transcript(), status=201, dumps=_dumps)
+
+
+async def list_dialogs(request: web.Request) -> web.Response:
+    dialogs = request.app["service"].dialogs.values()
+    return web.json_response([d.state() for d in dialogs], dumps=_dumps)
+
+
+async def get_dialog(request: web.Request) -> web.Response:
+    return web.json_response(_dialog(request).transcript(), dumps=_dumps)
+
+
+async def step_dialog(request: web.Request) -> web.Response:
+    dialog = _dialog(request)
+    if dialog.running:
+        return _error(409, "Autorun is in progress")
+    try:
+        message = await request.app["service"].step(dialog)
+    except ConfigError as e:
+        return _error(400, str(e))
+    except Exception:
+        return _error(502, dialog.error or "Turn failed")
+    if message is None:
+        return _error(409, "Dialog is finished")
+    return web.json_response({"message": message, **dialog.state()}, dumps=_dumps)
+
+
+async def run_dialog(request: web.Request) -> web.Response:
+    dialog = _dialog(request)
+    request.app["service"].run(dialog)
+    return web.json_response(dialog.state(), status=202, dumps=_dumps)
+
+
+async def stop_dialog(request: web.Request) -> web.Response:
+    dialog = _dialog(request)
+    request.app["service"].stop(dialog)
+    return web.json_response(dialog.state(), dumps=_dumps)
+
+
+async def delete_dialog(request: web.Request) -> web.Response:
+    dialog = _dialog(request)
+    await request.app["service"].remove(dialog.id)
+    return web.Response(status=204)
+
+
+def _subscribe(dialog: ServiceDialog) -> asyncio.Queue:
+    queue: asyncio.Queue = asyncio.Queue()
+    dialog.events.subscribers.add(queue)
+    queue.put_nowait({"type": "state", **dialog.state()})
+    return queue
+
+
+async def dialog_events(request: web.Request) -> web.StreamResponse:
+    """Server-Sent Events; ?since=N first replays messages from index N."""
+    dialog = _dialog(request)
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    queue = _subscribe(dialog)
+    try:
+        for event in _replay(dialog, request.query.get("since")):
+            await response.write(f"data: {_dumps(event)}\n\n".encode("utf-8"))
+        while True:
+            event = await queue.get()
+            await response.write(f"event: {event['type']}\ndata: {_dumps(event)}\n\n".encode("utf-8"))
+            if event["type"] == "removed":
+                break
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        dialog.events.subscribers.discard(queue)
+    return response
+
+
+async def dialog_socket(request: web.Request) -> web.WebSocketResponse:
+    """WebSocket with the same events; accepts {"action": "step" | "run" | "stop"}."""
+    dialog = _dialog(request)
+    service: SimulationService = request.app["service"]
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    queue = _subscribe(dialog)
+
+    async def forward():
+        for event in _replay(dialog, request.query.get("since")):
+            await ws.send_str(_dumps(event))
+        while True:
+            event = await queue.get()
+            await ws.send_str(_dumps(event))
+            if event["type"] == "removed":
+                await ws.close()
+                return
+
+    sender = asyncio.create_task(forward())
+    try:
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                action = json.loads(msg.data).get("action")
+            except (ValueError, AttributeError):
+                action = None
+            if action == "run":
+                service.run(dialog)
+            elif action == "stop":
+                service.stop(dialog)
+            elif action == "step" and not dialog.running:
+                # Errors reach the client as "error" events
+                service.spawn(_quiet(service.step(dialog)))
+            else:
+                await ws.send_str(_dumps({"type": "error", "error": f"Unknown action: {action}"}))
+    finally:
+        sender.cancel()
+        dialog.events.subscribers.discard(queue)
+    return ws
+
+
+def _replay(dialog: ServiceDialog, since: str | None) -> list[dict]:
+    if since is None or not since.isdigit():
+        return []
+    messages = dialog.engine.messages
+    return [
+        {"type": "message", "index": i, "message": messages[i]}
+        for i in range(int(since), len(messages))
+    ]
+
+
+async def _quiet(coro):
+    try:
+        await coro
+    except Exception:
+        pass
+
+
+def create_app(service: SimulationService | None = None, token: str | None = None) -> web.Application:
+    """The service app; *token* defaults to $LEARNLM_SERVICE_TOKEN (empty = no auth)."""
+    app = web.Application(middlewares=[_auth])
+    app["service"] = service or SimulationService()
+    app["token"] = os.getenv(SERVICE_TOKEN_ENV, "") if token is None else token
+    app.add_routes([
+        web.post("/dialogs", create_dialog),
+        web.get("/dialogs", list_dialogs),
+        web.get("/dialogs/{dialog_id}", get_dialog),
+        web.delete("/dialogs/{dialog_id}", delete_dialog),
+        web.post("/dialogs/{dialog_id}/step", step_dialog),
+        web.post("/dialogs/{dialog_id}/run", run_dialog),
+        web.post("/dialogs/{dialog_id}/stop", stop_dialog),
+        web.get("/dialogs/{dialog_id}/events", dialog_events),
+        web.get("/dialogs/{dialog_id}/ws", dialog_socket),
+    ])
+
+    async def close(app: web.Application):
+        await app["service"].close()
+
+    app.on_shutdown.append(close)
+    return app
+
+
+def main(argv: list[str]) -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="python -m engine.service", description="LearnLM simulation service.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("-v", "--verbose", action="store_true", help="log at INFO level")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(name)s %(levelname)s: %(message)s",
+    )
+    web.run_app(create_app(), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,333 @@
+"""Sharded batch runs: a durable job queue consumed by many worker processes.
+
+    python -m engine.shard enqueue runs/big matrix.json
+    python -m engine.shard work runs/big --processes 8 --dialogs 16   # on each machine
+    python -m engine.shard status runs/big
+    python -m engine.shard merge runs/big                             # -> runs/big/dialogs.jsonl
+
+Jobs of the batch matrix (see engine/batch.py) go to RUN_DIR/queue.db.
+Each worker process claims jobs with a lease, runs up to --dialogs of them
+at once and renews the leases by heartbeats; jobs of a dead worker are
+delivered again once their lease expires and continue from the dialog's
+journal (RUN_DIR/journal/<id>.jsonl); a worker appends to the journal only
+while it holds the lease. Every process writes its own
+RUN_DIR/dialogs-<worker>.jsonl; merge joins them into one corpus, keeping
+one record per dialog.
+
+Provider limits apply per process: divide the provider's quota by the
+number of processes.
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import sys
+import threading
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from config.settings import (
+    BATCH_PROVIDER_CONCURRENCY,
+    BATCH_WORKERS,
+    QUEUE_HEARTBEAT_SECONDS,
+    QUEUE_LEASE_SECONDS,
+    QUEUE_POLL_SECONDS,
+)
+from engine.batch import BatchJob, BatchMatrix, ProviderLimits, parse_limits, run_dialog
+from engine.config import EngineConfig
+from engine.journal import Journal
+from engine.workqueue import LeaseLost, WorkQueue
+
+log = logging.getLogger(__name__)
+
+
+def queue_path(run_dir: str | Path) -> Path:
+    return Path(run_dir) / "queue.db"
+
+
+def enqueue(run_dir: str | Path, matrix: BatchMatrix) -> tuple[int, int]:
+    """Queue the matrix's jobs; returns (added, already queued).
+
+    Jobs carry the whole base config (without API keys), so workers run
+    exactly the settings their id digests, whatever their own environment.
+    """
+    base = matrix.base_config()
+    jobs = {
+        job.id: {"job": dataclasses.asdict(job), "config": base.to_dict()}
+        for job in matrix.jobs(base)
+    }
+    queue = WorkQueue(queue_path(run_dir))
+    try:
+        added = queue.put(jobs)
+    finally:
+        queue.close()
+    return added, len(jobs) - added
+
+
+class _LeasedJournal(Journal):
+    """A job's journal that is appended to only while the worker holds the job.
+
+    After a takeover the new holder continues from this file; a stale
+    worker writing on until its next heartbeat would interleave two
+    continuations of the dialog. The lease is checked with a read and
+    renewed here only when less than a third of it is left, so turns do
+    not queue up behind the queue's write lock.
+    """
+
+    def __init__(self, path: Path, queue: WorkQueue, job_id: str, worker: str, lease: float):
+        super().__init__(path)
+        self.queue = queue
+        self.job_id = job_id
+        self.worker = worker
+        self.lease = lease
+
+    def _write(self, dialog_id: str, event: str, **data):
+        if not self.queue.holds(self.job_id, self.worker, margin=self.lease / 3):
+            if self.job_id not in self.queue.heartbeat(self.worker, [self.job_id], self.lease):
+                raise LeaseLost(self.job_id)
+        super()._write(dialog_id, event, **data)
+
+
+def _append(f, lock: threading.Lock, line: str):
+    with lock:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def worker_name() -> str:
+    host = re.sub(r"[^A-Za-z0-9_.-]", "_", socket.gethostname())
+    return f"{host}-{os.getpid()}"
+
+
+async def work(
+    run_dir: str | Path,
+    dialogs: int = BATCH_WORKERS,
+    provider_limits: dict[str, int | None] | None = None,
+    worker: str | None = None,
+    lease: float = QUEUE_LEASE_SECONDS,
+) -> int:
+    """Consume the queue until no job is pending or leased; returns dialogs finished here."""
+    out = Path(run_dir)
+    worker = worker or worker_name()
+    queue = WorkQueue(queue_path(out))
+    env = EngineConfig.from_env().to_dict(secrets=True)
+    limits = ProviderLimits({**BATCH_PROVIDER_CONCURRENCY, **(provider_limits or {})})
+    slots = asyncio.Semaphore(max(1, dialogs))
+    shard_lock = threading.Lock()
+    active: dict[str, asyncio.Task] = {}
+    lost: set[str] = set()
+    finished = 0
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(min(QUEUE_HEARTBEAT_SECONDS, lease / 3))
+            try:
+                held = await asyncio.to_thread(queue.heartbeat, worker, list(active), lease)
+            except Exception:
+                # E.g. "database is locked" on a busy queue: the leases still
+                # have time left, so keep beating rather than let them all expire
+                log.exception("Heartbeat of %s failed", worker)
+                continue
+            for job_id in set(active) - held:
+                log.warning("Lease on %s was taken over; dropping the dialog", job_id)
+                lost.add(job_id)
+                active[job_id].cancel()
+
+    async def run(job_id: str, payload: dict, shard):
+        nonlocal finished
+        job = BatchJob(**payload["job"])
+        config = job.config(EngineConfig.from_mapping({**env, **payload["config"]}))
+        journal = _LeasedJournal(out / "journal" / f"{job_id}.jsonl", queue, job_id, worker, lease)
+        try:
+            errors = config.validate()
+            if errors:
+                raise ValueError("; ".join(errors))
+            journaled = await asyncio.to_thread(journal.get, job_id)
+            record = await run_dialog(job, config, limits, journal, journaled)
+        except asyncio.CancelledError:
+            if job_id in lost:
+                return
+            raise
+        except LeaseLost:
+            log.warning("Lease on %s was taken over; dropping the dialog", job_id)
+            return
+        except Exception as e:
+            log.warning("Dialog %s failed: %r", job_id, e)
+            await asyncio.to_thread(queue.fail, job_id, worker, repr(e))
+            return
+        finally:
+            active.pop(job_id, None)
+            slots.release()
+        # Written before the job is marked done: a crash in between means a
+        # second run of the dialog, which merge drops, rather than a lost one
+        await asyncio.to_thread(_append, shard, shard_lock, json.dumps(record, ensure_ascii=False) + "\n")
+        if await asyncio.to_thread(queue.complete, job_id, worker):
+            finished += 1
+            log.info("%s: %s done, %d steps%s", worker, job_id, record["steps"], ", solved" if record["solved"] else "")
+        else:
+            log.warning("%s finished after its lease was taken over; merge keeps one copy", job_id)
+
+    beat = asyncio.create_task(heartbeat())
+    try:
+        with open(out / f"dialogs-{worker}.jsonl", "a", encoding="utf-8") as shard:
+            while True:
+                await slots.acquire()
+                claimed = await asyncio.to_thread(queue.claim, worker, lease)
+                if claimed is None:
+                    slots.release()
+                    counts = await asyncio.to_thread(queue.counts)
+                    if not active and not counts["pending"] and not counts["leased"]:
+                        break
+                    # Wait for new jobs, or for leases of dead workers to expire
+                    await asyncio.sleep(QUEUE_POLL_SECONDS)
+                    continue
+                job_id, payload = claimed
+                active[job_id] = asyncio.create_task(run(job_id, payload, shard))
+    finally:
+        beat.cancel()
+        for task in active.values():
+            task.cancel()
+        queue.close()
+    return finished
+
+
+def _process_main(run_dir: str, dialogs: int, provider_limits: dict, lease: float, verbose: bool):
+    _setup_logging(verbose)
+    load_dotenv()
+    asyncio.run(work(run_dir, dialogs, provider_limits, lease=lease))
+
+
+def run_workers(
+    run_dir: str | Path,
+    processes: int,
+    dialogs: int = BATCH_WORKERS,
+    provider_limits: dict[str, int | None] | None = None,
+    lease: float = QUEUE_LEASE_SECONDS,
+    verbose: bool = False,
+) -> int:
+    """Run *processes* worker processes to completion; returns how many exited with an error."""
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=_process_main, args=(str(run_dir), dialogs, provider_limits, lease, verbose))
+        for _ in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    return sum(process.exitcode != 0 for process in workers)
+
+
+def merge(run_dir: str | Path) -> tuple[int, int]:
+    """Join the workers' shards into RUN_DIR/dialogs.jsonl, one record per dialog.
+
+    Safe to repeat: the existing corpus is read first and the first copy of
+    a dialog is kept. Returns (records, records added by this merge).
+    """
+    out = Path(run_dir)
+    corpus = out / "dialogs.jsonl"
+    sources = ([corpus] if corpus.exists() else []) + sorted(out.glob("dialogs-*.jsonl"))
+    seen: set[str] = set()
+    existing = 0
+    tmp = out / "dialogs.jsonl.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for path in sources:
+            with open(path, encoding="utf-8") as shard:
+                for line in shard:
+                    try:
+                        dialog_id = json.loads(line)["id"]
+                    except (ValueError, KeyError):
+                        continue  # a line cut short by a crash
+                    if dialog_id in seen:
+                        continue
+                    seen.add(dialog_id)
+                    f.write(line if line.endswith("\n") else line + "\n")
+            if path == corpus:
+                existing = len(seen)
+    os.replace(tmp, corpus)
+    return len(seen), len(seen) - existing
+
+
+def _setup_logging(verbose: bool):
+    logging.basicConfig(
+        level=logging.INFO if verbose else logging.WARNING,
+        format=f"%(asctime)s {os.getpid()} %(name)s %(levelname)s: %(message)s",
+    )
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m engine.shard", description="Sharded LearnLM batch runs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("enqueue", help="queue the jobs of a batch matrix")
+    p.add_argument("run_dir")
+    p.add_argument("matrix", help="JSON file with the batch matrix")
+
+    p = commands.add_parser("work", help="consume the queue until it is empty")
+    p.add_argument("run_dir")
+    p.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--dialogs", type=int, default=BATCH_WORKERS, help="dialogs in flight per process")
+    p.add_argument("--limit", action="append", default=[], metavar="PROVIDER=N",
+                   help="concurrent requests per provider and process (0 = no limit)")
+    p.add_argument("--lease", type=float, default=QUEUE_LEASE_SECONDS,
+                   help="seconds without a heartbeat before a job goes to another worker")
+    p.add_argument("-v", "--verbose", action="store_true")
+
+    p = commands.add_parser("status", help="job counts and failures")
+    p.add_argument("run_dir")
+
+    p = commands.add_parser("retry", help="queue failed jobs again")
+    p.add_argument("run_dir")
+
+    p = commands.add_parser("merge", help="join the shards into dialogs.jsonl")
+    p.add_argument("run_dir")
+
+    args = parser.parse_args(argv)
+    _setup_logging(getattr(args, "verbose", False))
+    load_dotenv()
+
+    if args.command == "enqueue":
+        with open(args.matrix, encoding="utf-8") as f:
+            matrix = BatchMatrix.from_dict(json.load(f))
+        added, existing = enqueue(args.run_dir, matrix)
+        print(f"{added} jobs queued, {existing} already in the queue")
+        return 0
+
+    if args.command == "work":
+        if not queue_path(args.run_dir).exists():
+            print(f"No queue in {args.run_dir}; run enqueue first", file=sys.stderr)
+            return 2
+        errors = run_workers(
+            args.run_dir, args.processes, args.dialogs, parse_limits(args.limit), args.lease, args.verbose
+        )
+        return 1 if errors else 0
+
+    if args.command == "merge":
+        records, added = merge(args.run_dir)
+        print(f"{records} dialogs in dialogs.jsonl ({added} new)")
+        return 0
+
+    queue = WorkQueue(queue_path(args.run_dir))
+    try:
+        if args.command == "retry":
+            print(f"{queue.retry_failed()} failed jobs queued again")
+        else:
+            counts = queue.counts()
+            print(", ".join(f"{state}: {count}" for state, count in counts.items()))
+            for job_id, error in queue.failures():
+                print(f"  {job_id}: {error}")
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,193 @@
+"""Durable job queue in SQLite, shared by worker processes.
+
+Workers claim a job with a lease and renew it by heartbeats while the
+dialog runs. A job whose lease has expired (its worker died or hung) is
+delivered again to the next worker that asks; after QUEUE_MAX_ATTEMPTS
+deliveries it is marked failed.
+
+Several machines may share the queue file over a network filesystem, as
+long as it supports POSIX locks: SQLite's rollback journal is used rather
+than WAL, which needs shared memory on one host.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from config.settings import QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending, leased, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until);
+"""
+
+
+class LeaseLost(RuntimeError):
+    """The worker no longer holds the job's lease: another worker took it over."""
+
+
+class WorkQueue:
+    """A queue file; one instance per process, shared by its threads under a lock."""
+
+    def __init__(self, path: str | Path, max_attempts: int = QUEUE_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit; write transactions are opened explicitly with BEGIN IMMEDIATE
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def put(self, jobs: dict[str, dict]) -> int:
+        """Add jobs (id → JSON payload); ids already queued are ignored. Returns the number added."""
+        with self._lock:
+            now = time.time()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._db.total_changes
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO jobs (id, payload, updated) VALUES (?, ?, ?)",
+                    [(job_id, json.dumps(payload, ensure_ascii=False), now) for job_id, payload in jobs.items()],
+                )
+                added = self._db.total_changes - before
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return added
+
+    def claim(self, worker: str, lease: float = QUEUE_LEASE_SECONDS) -> tuple[str, dict] | None:
+        """Lease the next job to *worker*: (id, payload), or None if nothing is available.
+
+        Expired leases count as available; a job out of attempts is failed instead.
+        """
+        with self._lock:
+            now = time.time()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._db.execute(
+                        "SELECT id, payload, attempts FROM jobs"
+                        " WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?)"
+                        " ORDER BY attempts, rowid LIMIT 1",
+                        (now,),
+                    ).fetchone()
+                    if row is None:
+                        self._db.execute("COMMIT")
+                        return None
+                    job_id, payload, attempts = row
+                    if attempts >= self.max_attempts:
+                        self._db.execute(
+                            "UPDATE jobs SET state = 'failed', worker = NULL, updated = ?,"
+                            " error = coalesce(error, 'lease expired') WHERE id = ?",
+                            (now, job_id),
+                        )
+                        continue
+                    self._db.execute(
+                        "UPDATE jobs SET state = 'leased', attempts = attempts + 1, worker = ?,"
+                        " lease_until = ?, updated = ? WHERE id = ?",
+                        (worker, now + lease, now, job_id),
+                    )
+                    self._db.execute("COMMIT")
+                    return job_id, json.loads(payload)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, worker: str, job_ids, lease: float = QUEUE_LEASE_SECONDS) -> set[str]:
+        """Renew *worker*'s leases; returns the ids it still holds (the rest were taken over)."""
+        with self._lock:
+            job_ids = list(job_ids)
+            if not job_ids:
+                return set()
+            now = time.time()
+            marks = ",".join("?" * len(job_ids))
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    f"UPDATE jobs SET lease_until = ?, updated = ?"
+                    f" WHERE worker = ? AND state = 'leased' AND id IN ({marks})",
+                    (now + lease, now, worker, *job_ids),
+                )
+                held = {
+                    row[0] for row in self._db.execute(
+                        f"SELECT id FROM jobs WHERE worker = ? AND state = 'leased' AND id IN ({marks})",
+                        (worker, *job_ids),
+                    )
+                }
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return held
+
+    def holds(self, job_id: str, worker: str, margin: float = 0.0) -> bool:
+        """Whether *worker* holds *job_id* with at least *margin* seconds of lease left.
+
+        A read: no other worker can claim the job before the lease runs out,
+        so work that finishes within *margin* cannot overlap a takeover.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM jobs WHERE id = ? AND worker = ? AND state = 'leased' AND lease_until >= ?",
+                (job_id, worker, time.time() + margin),
+            ).fetchone()
+            return row is not None
+
+    def complete(self, job_id: str, worker: str) -> bool:
+        """Mark a job done; False if *worker* no longer held its lease."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = 'done', lease_until = NULL, error = NULL, updated = ?"
+                " WHERE id = ? AND worker = ? AND state = 'leased'",
+                (time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker: str, error: str):
+        """Give a job back for another attempt, or fail it if it is out of attempts."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " worker = NULL, lease_until = NULL, error = ?, updated = ?"
+                " WHERE id = ? AND worker = ? AND state = 'leased'",
+                (self.max_attempts, error, time.time(), job_id, worker),
+            )
+
+    def retry_failed(self) -> int:
+        """Put failed jobs back with fresh attempts; returns how many."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = 'pending', attempts = 0, updated = ? WHERE state = 'failed'",
+                (time.time(),),
+            )
+            return cursor.rowcount
+
+    def counts(self) -> dict[str, int]:
+        """Number of jobs per state."""
+        with self._lock:
+            counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+            for state, count in self._db.execute("SELECT state, count(*) FROM jobs GROUP BY state"):
+                counts[state] = count
+            return counts
+
+    def failures(self) -> list[tuple[str, str]]:
+        """(id, last error) of failed jobs."""
+        with self._lock:
+            return self._db.execute("SELECT id, error FROM jobs WHERE state = 'failed' ORDER BY id").fetchall()
@@ -1,3 +1,7 @@
 from models.base import BaseProvider
 from models.gemini_provider import GeminiProvider
 from models.openai_compat import OpenAICompatProvider
+from models.mock_provider import MockProvider
+from models.cassette import CassetteProvider, CassetteStore
+from models.pool import ProviderPool, get_classifier_provider, get_provider, get_summary_provider
+from models.transcript import Transcript
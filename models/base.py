@@ -1,10 +1,17 @@
 """Abstract base class for LLM providers."""
 
+import asyncio
+import time
 from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator, Sequence
 from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from models.prompt_cache import PromptCache
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Message:
     role: str  # "user" or "assistant"
     content: str
@@ -14,6 +21,71 @@ class Message:
 class LLMResponse:
     text: str
     reasoning: str | None = None
+    # Usage reported by the provider (0 when unknown)
+    input_tokens: int = 0
+    output_tokens: int = 0  # visible answer only
+    thinking_tokens: int = 0
+    cached_tokens: int = 0  # part of input_tokens served from a provider cache
+    # Wall-clock seconds for the whole call, including retries and queueing
+    latency: float = 0.0
+    ttft: float | None = None  # time to first token, streamed calls only
+    retries: int = 0
+
+    def usage(self) -> dict:
+        """Token counts and timings as a JSON-friendly dict."""
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "thinking_tokens": self.thinking_tokens,
+            "cached_tokens": self.cached_tokens,
+            "latency": round(self.latency, 3),
+            "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+            "retries": self.retries,
+        }
+
+
+@dataclass
+class StreamChunk:
+    """Incremental piece of a streamed response (either field may be empty).
+
+    The last chunk of a stream may carry *usage*: token counts and retries
+    with the same keys as LLMResponse.usage() (timings are measured by the consumer).
+    """
+    text: str = ""
+    reasoning: str = ""
+    usage: dict | None = None
+
+
+def collect_stream(
+    chunks: Iterator[StreamChunk],
+    started: float,
+    on_chunk: Callable[[StreamChunk], None] | None = None,
+) -> LLMResponse:
+    """Drain a stream into an LLMResponse, timed from *started* (time.monotonic()).
+
+    *on_chunk* sees every chunk that carries text or reasoning as it arrives.
+    """
+    text, reasoning, usage, ttft = [], [], {}, None
+    for chunk in chunks:
+        usage = chunk.usage or usage
+        if chunk.text or chunk.reasoning:
+            if ttft is None:
+                ttft = time.monotonic() - started
+            if on_chunk is not None:
+                on_chunk(chunk)
+        text.append(chunk.text)
+        reasoning.append(chunk.reasoning)
+    return LLMResponse(
+        text="".join(text),
+        reasoning="".join(reasoning).strip() or None,
+        input_tokens=usage.get("input_tokens", 0),
+        output_tokens=usage.get("output_tokens", 0),
+        thinking_tokens=usage.get("thinking_tokens", 0),
+        cached_tokens=usage.get("cached_tokens", 0),
+        latency=time.monotonic() - started,
+        ttft=ttft,
+        retries=usage.get("retries", 0),
+    )
 
 
 class BaseProvider(ABC):
@@ -24,6 +96,71 @@ class BaseProvider(ABC):
         history: list[Message],
         temperature: float,
         max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: "PromptCache | None" = None,
     ) -> LLMResponse:
-        """Generate a response given system prompt and conversation history."""
+        """Generate a response given system prompt and conversation history.
+
+        json_schema: if given, the reply is constrained to JSON matching this
+        schema where the API supports it (plain JSON mode otherwise).
+        cache: per-dialog handle for provider-side prompt caching; providers
+        without it send the full request.
+        """
         ...
+
+    async def agenerate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: "PromptCache | None" = None,
+    ) -> LLMResponse:
+        """Async counterpart of generate_response.
+
+        Providers without a native async client run the sync call in a worker thread.
+        """
+        return await asyncio.to_thread(
+            self.generate_response,
+            system_prompt,
+            history,
+            temperature,
+            max_tokens,
+            json_schema=json_schema,
+            cache=cache,
+        )
+
+    def stream_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        cache: "PromptCache | None" = None,
+    ) -> Iterator[StreamChunk]:
+        """Stream text and reasoning deltas as they arrive.
+
+        Providers without native streaming yield the whole response as one chunk.
+        """
+        response = self.generate_response(system_prompt, history, temperature, max_tokens, cache=cache)
+        yield StreamChunk(text=response.text, reasoning=response.reasoning or "", usage=response.usage())
+
+    def close(self):
+        """Release network resources held by the provider (no-op by default)."""
+
+
+def encode_history(history: Sequence[Message], key: str, encode: Callable[[Message], object]) -> list:
+    """Encode *history* into a provider's native message objects.
+
+    Transcript views (models.transcript) cache the encoding under *key* and
+    only encode messages appended since the last call; plain lists are
+    encoded in full.
+    """
+    encoded = getattr(history, "encoded", None)
+    if encoded is not None:
+        return encoded(key, encode)
+    return [encode(msg) for msg in history]
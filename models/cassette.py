@@ -0,0 +1,189 @@
+"""Record/replay cassettes for provider traffic.
+
+CassetteProvider wraps any BaseProvider and stores every request together
+with its LLMResponse in a content-addressed directory (one JSON file per
+request, named by the SHA-256 of the canonical request). In replay mode
+responses are served from disk, which makes full-dialog regression runs
+reproducible and lets the local code path run at full speed for free.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections.abc import Iterator
+from dataclasses import asdict, replace
+from pathlib import Path
+
+from models.base import BaseProvider, LLMResponse, Message, StreamChunk
+from models.prompt_cache import PromptCache
+
+CASSETTE_MODES = ("record", "replay", "auto")
+
+log = logging.getLogger(__name__)
+
+
+class CassetteMissError(LookupError):
+    """Replay mode got a request that was never recorded."""
+
+
+class CassetteStore:
+    """Content-addressed request → response store on disk."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    @staticmethod
+    def key(request: dict) -> str:
+        canonical = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def load(self, key: str) -> LLMResponse | None:
+        path = self._path(key)
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        return LLMResponse(**data["response"])
+
+    def save(self, key: str, request: dict, response: LLMResponse):
+        """Write atomically so concurrent recorders never leave a partial file."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = json.dumps(
+            {"request": request, "response": asdict(response)}, ensure_ascii=False, indent=2
+        )
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+
+class CassetteProvider(BaseProvider):
+    """Wrap *inner* to record its traffic or replay it from *store*.
+
+    mode: "record" — always call the provider and (over)write the cassette;
+          "replay" — only serve from disk, raise CassetteMissError on a miss;
+          "auto"   — serve hits from disk, call and record misses.
+    model: identifies the model and its settings in the request key.
+    """
+
+    def __init__(self, inner: BaseProvider, store: CassetteStore, model: str, mode: str = "auto"):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected one of {CASSETTE_MODES}")
+        self.inner = inner
+        self.store = store
+        self.model = model
+        self.mode = mode
+
+    def close(self):
+        self.inner.close()
+
+    def _request(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        json_schema: dict | None = None,
+    ) -> tuple[str, dict]:
+        request = {
+            "model": self.model,
+            "system_prompt": system_prompt,
+            "history": [[m.role, m.content] for m in history],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if json_schema:
+            # Only when set, so free-text recordings keep their keys
+            request["json_schema"] = json_schema
+        return self.store.key(request), request
+
+    def _lookup(self, key: str) -> LLMResponse | None:
+        if self.mode == "record":
+            return None
+        response = self.store.load(key)
+        if response is None:
+            if self.mode == "replay":
+                raise CassetteMissError(f"No cassette for request {key[:12]} ({self.model})")
+            return None
+        # Token usage is replayed as recorded; timings describe this (local) call
+        return replace(response, latency=0.0, ttft=None, retries=0)
+
+    def generate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: PromptCache | None = None,
+    ) -> LLMResponse:
+        key, request = self._request(system_prompt, history, temperature, max_tokens, json_schema)
+        response = self._lookup(key)
+        if response is None:
+            response = self.inner.generate_response(
+                system_prompt, history, temperature, max_tokens, json_schema=json_schema, cache=cache
+            )
+            self.store.save(key, request, response)
+        return response
+
+    async def agenerate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: PromptCache | None = None,
+    ) -> LLMResponse:
+        key, request = self._request(system_prompt, history, temperature, max_tokens, json_schema)
+        response = await asyncio.to_thread(self._lookup, key)
+        if response is None:
+            response = await self.inner.agenerate_response(
+                system_prompt, history, temperature, max_tokens, json_schema=json_schema, cache=cache
+            )
+            await asyncio.to_thread(self.store.save, key, request, response)
+        return response
+
+    def stream_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        cache: PromptCache | None = None,
+    ) -> Iterator[StreamChunk]:
+        key, request = self._request(system_prompt, history, temperature, max_tokens)
+        response = self._lookup(key)
+        if response is not None:
+            if response.reasoning:
+                yield StreamChunk(reasoning=response.reasoning)
+            yield StreamChunk(text=response.text, usage=response.usage())
+            return
+
+        text, reasoning, usage = [], [], {}
+        for chunk in self.inner.stream_response(
+            system_prompt, history, temperature, max_tokens, cache=cache
+        ):
+            text.append(chunk.text)
+            reasoning.append(chunk.reasoning)
+            usage = chunk.usage or usage
+            yield chunk
+        # Only completed streams are recorded
+        self.store.save(key, request, LLMResponse(
+            text="".join(text),
+            reasoning="".join(reasoning).strip() or None,
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            thinking_tokens=usage.get("thinking_tokens", 0),
+            cached_tokens=usage.get("cached_tokens", 0),
+        ))
@@ -1,37 +1,77 @@
 """Google Gemini provider using google-genai SDK."""
 
+import asyncio
 import logging
 import time
+from collections.abc import Iterator
 
 from google import genai
-from google.genai import types
-from google.genai.errors import ServerError
+from google.genai import errors, types
 
-from models.base import BaseProvider, LLMResponse, Message
-
-MAX_RETRIES = 3
-RETRY_DELAY = 2  # seconds
+from config.settings import (
+    CALL_DEADLINE,
+    PROMPT_CACHE_MIN_TOKENS,
+    PROMPT_CACHE_REFRESH,
+    PROMPT_CACHE_TTL,
+    REQUEST_TIMEOUT,
+)
+from models.base import BaseProvider, LLMResponse, Message, StreamChunk, encode_history
+from models.prompt_cache import PromptCache, history_digest, prompt_owner
+from models.ratelimit import RateLimiter
+from models.resilience import (
+    acall_with_retry,
+    call_with_retry,
+    classify_error,
+    get_breaker,
+    stream_with_retry,
+)
+from models.tokens import estimate_request_tokens
 
 log = logging.getLogger(__name__)
 
 
+def _cache_missing(exc: Exception) -> bool:
+    """Whether *exc* says the cached content expired, was deleted or is not ours."""
+    if not isinstance(exc, errors.ClientError):
+        return False
+    if exc.code in (403, 404):
+        return True
+    message = (exc.message or "").lower()
+    return "cachedcontent" in message.replace(" ", "") and ("not found" in message or "expired" in message)
+
+
 class GeminiProvider(BaseProvider):
-    def __init__(self, api_key: str, model_id: str, thinking_level: str | None = None):
+    def __init__(
+        self,
+        api_key: str,
+        model_id: str,
+        thinking_level: str | None = None,
+        thinking_budget: int | None = None,
+        timeout: float = REQUEST_TIMEOUT,
+        deadline: float = CALL_DEADLINE,
+        rate_limiter: RateLimiter | None = None,
+    ):
         self.client = genai.Client(api_key=api_key)
         self.model_id = model_id
         self.thinking_level = thinking_level
+        self.thinking_budget = thinking_budget  # 0 turns thinking off on 2.5 models
+        self.timeout = timeout
+        self.deadline = deadline
+        self.rate_limiter = rate_limiter
+        self.breaker = get_breaker(f"gemini:{model_id}")
 
-    def generate_response(
+    def close(self):
+        self.client.close()
+
+    def _build_request(
         self,
         system_prompt: str,
         history: list[Message],
         temperature: float,
         max_tokens: int,
-    ) -> LLMResponse:
-        contents = []
-        for msg in history:
-            role = "model" if msg.role == "assistant" else "user"
-            contents.append(types.Content(role=role, parts=[types.Part(text=msg.content)]))
+        json_schema: dict | None = None,
+    ) -> tuple[list[types.Content], types.GenerateContentConfig]:
+        contents = encode_history(history, "gemini", _encode_message)
 
         if not contents:
             contents.append(types.Content(role="user", parts=[types.Part(text="Начни диалог.")]))
@@ -47,22 +87,215 @@ class GeminiProvider(BaseProvider):
                 thinking_level=self.thinking_level,
                 include_thoughts=True,
             )
+        elif self.thinking_budget is not None:
+            config.thinking_config = types.ThinkingConfig(
+                thinking_budget=self.thinking_budget,
+                include_thoughts=self.thinking_budget != 0,
+            )
+
+        if json_schema:
+            config.response_mime_type = "application/json"
+            config.response_schema = json_schema
+        return contents, config
+
+    def _apply_cache(
+        self,
+        cache: PromptCache,
+        system_prompt: str,
+        history: list[Message],
+        contents: list[types.Content],
+        config: types.GenerateContentConfig,
+    ) -> tuple[list[types.Content], types.GenerateContentConfig]:
+        """Serve the system prompt and dialog prefix from a cached content, if possible."""
+        with cache.lock:
+            cache.bind(prompt_owner(f"gemini:{self.model_id}", system_prompt))
+            self._refresh_cache(cache, system_prompt, history, contents)
+            name, length = cache.content_name, cache.content_length
+        if name is None:
+            return contents, config
+        config = config.model_copy(update={"system_instruction": None, "cached_content": name})
+        return contents[length:], config
+
+    def _refresh_cache(
+        self,
+        cache: PromptCache,
+        system_prompt: str,
+        history: list[Message],
+        contents: list[types.Content],
+    ):
+        """Keep the cached content alive, or rebuild it over a longer prefix (lock held)."""
+        now = time.time()
+        if (
+            cache.content_name
+            and cache.content_expires - now > self.timeout
+            and cache.covers(history, cache.content_length, cache.content_digest)
+            and len(history) - cache.content_length <= PROMPT_CACHE_REFRESH
+        ):
+            if cache.content_expires - now < PROMPT_CACHE_TTL / 2:
+                try:
+                    self.client.caches.update(
+                        name=cache.content_name,
+                        config=types.UpdateCachedContentConfig(ttl=f"{PROMPT_CACHE_TTL}s"),
+                    )
+                    cache.content_expires = now + PROMPT_CACHE_TTL
+                except Exception:
+                    log.warning("Failed to extend Gemini cache %s", cache.content_name, exc_info=True)
+            return
+        # Everything but the newest message, which changes every turn
+        length = max(len(history) - 1, 0)
+        if (
+            cache.content_disabled
+            or estimate_request_tokens(system_prompt, history[:length]) < PROMPT_CACHE_MIN_TOKENS
+        ):
+            cache.drop_content()
+            return
+        try:
+            created = self.client.caches.create(
+                model=self.model_id,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_prompt,
+                    contents=contents[:length] or None,
+                    ttl=f"{PROMPT_CACHE_TTL}s",
+                ),
+            )
+        except Exception as e:
+            cache.drop_content()
+            if classify_error(e) == "fatal":
+                # e.g. a model without explicit caching: stop trying for this prompt
+                log.warning("Gemini cache creation failed; sending full requests", exc_info=True)
+                cache.content_disabled = True
+            else:
+                log.warning("Gemini cache creation failed (%s); retrying on a later turn", e)
+            return
+        name = created.name
+        cache.set_content(
+            name, now + PROMPT_CACHE_TTL, length, history_digest(history[:length]),
+            cleanup=lambda: self.client.caches.delete(name=name),
+        )
+        log.info("Created Gemini cache %s over %d messages", name, length)
+
+    @staticmethod
+    def _cache_lost(cache: PromptCache | None, config: types.GenerateContentConfig, exc: Exception) -> bool:
+        """Whether *exc* means the cached content is gone; drops it if so.
+
+        Only "not found" answers count: other client errors (429 above all)
+        go to the retry policy with the cache kept.
+        """
+        if cache is None or config.cached_content is None or not _cache_missing(exc):
+            return False
+        log.warning("Gemini cache %s rejected (%s); resending in full", config.cached_content, exc)
+        with cache.lock:
+            if cache.content_name == config.cached_content:
+                cache.drop_content()
+        return True
 
-        for attempt in range(1, MAX_RETRIES + 1):
+    @staticmethod
+    def _with_timeout(config: types.GenerateContentConfig, timeout: float) -> types.GenerateContentConfig:
+        return config.model_copy(update={"http_options": types.HttpOptions(timeout=int(timeout * 1000))})
+
+    def generate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: PromptCache | None = None,
+    ) -> LLMResponse:
+        full = self._build_request(system_prompt, history, temperature, max_tokens, json_schema)
+        request = self._apply_cache(cache, system_prompt, history, *full) if cache else full
+        tokens = estimate_request_tokens(system_prompt, history)
+
+        def attempt(timeout: float) -> types.GenerateContentResponse:
+            nonlocal request
+            if self.rate_limiter:
+                self.rate_limiter.acquire(tokens)
             try:
-                response = self.client.models.generate_content(
+                return self.client.models.generate_content(
                     model=self.model_id,
-                    contents=contents,
-                    config=config,
+                    contents=request[0],
+                    config=self._with_timeout(request[1], timeout),
                 )
-                break
-            except ServerError as e:
-                if attempt < MAX_RETRIES:
-                    log.warning("Gemini ServerError (attempt %d/%d): %s", attempt, MAX_RETRIES, e)
-                    time.sleep(RETRY_DELAY * attempt)
-                else:
+            except errors.ClientError as e:
+                if not self._cache_lost(cache, request[1], e):
                     raise
+                request = full
+                return self.client.models.generate_content(
+                    model=self.model_id,
+                    contents=request[0],
+                    config=self._with_timeout(request[1], timeout),
+                )
 
+        started = time.monotonic()
+        retries = []
+        response = call_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Gemini {self.model_id}",
+            on_retry=retries.append,
+        )
+        result = self._parse_response(response)
+        result.latency = time.monotonic() - started
+        result.retries = len(retries)
+        return result
+
+    async def agenerate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: PromptCache | None = None,
+    ) -> LLMResponse:
+        full = self._build_request(system_prompt, history, temperature, max_tokens, json_schema)
+        request = full
+        if cache:
+            # Cache management uses the sync client
+            request = await asyncio.to_thread(self._apply_cache, cache, system_prompt, history, *full)
+        tokens = estimate_request_tokens(system_prompt, history)
+
+        async def attempt(timeout: float) -> types.GenerateContentResponse:
+            nonlocal request
+            if self.rate_limiter:
+                await self.rate_limiter.aacquire(tokens)
+            try:
+                return await self.client.aio.models.generate_content(
+                    model=self.model_id,
+                    contents=request[0],
+                    config=self._with_timeout(request[1], timeout),
+                )
+            except errors.ClientError as e:
+                if not await asyncio.to_thread(self._cache_lost, cache, request[1], e):
+                    raise
+                request = full
+                return await self.client.aio.models.generate_content(
+                    model=self.model_id,
+                    contents=request[0],
+                    config=self._with_timeout(request[1], timeout),
+                )
+
+        started = time.monotonic()
+        retries = []
+        response = await acall_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Gemini {self.model_id}",
+            on_retry=retries.append,
+        )
+        result = self._parse_response(response)
+        result.latency = time.monotonic() - started
+        result.retries = len(retries)
+        return result
+
+    @staticmethod
+    def _parse_response(response: types.GenerateContentResponse) -> LLMResponse:
         text = ""
         thinking_text = None
         thinking_parts = []
@@ -74,4 +307,84 @@ class GeminiProvider(BaseProvider):
         if thinking_parts:
             thinking_text = "\n".join(thinking_parts)
 
-        return LLMResponse(text=text, reasoning=thinking_text)
+        return LLMResponse(text=text, reasoning=thinking_text, **_usage(response))
+
+    def stream_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        cache: PromptCache | None = None,
+    ) -> Iterator[StreamChunk]:
+        full = self._build_request(system_prompt, history, temperature, max_tokens)
+        request = self._apply_cache(cache, system_prompt, history, *full) if cache else full
+        tokens = estimate_request_tokens(system_prompt, history)
+
+        def attempt(timeout: float) -> Iterator[StreamChunk]:
+            nonlocal request
+            try:
+                yield from self._iter_stream(request[0], self._with_timeout(request[1], timeout), tokens)
+            except errors.ClientError as e:
+                # Rejected before the first chunk, so nothing has been yielded yet
+                if not self._cache_lost(cache, request[1], e):
+                    raise
+                request = full
+                yield from self._iter_stream(request[0], self._with_timeout(request[1], timeout), tokens)
+
+        retries = []
+        chunks = stream_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Gemini {self.model_id}",
+            on_retry=retries.append,
+        )
+        usage = {}
+        for chunk in chunks:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            else:
+                yield chunk
+        yield StreamChunk(usage={**usage, "retries": len(retries)})
+
+    def _iter_stream(
+        self, contents: list[types.Content], config: types.GenerateContentConfig, tokens: int
+    ) -> Iterator[StreamChunk]:
+        if self.rate_limiter:
+            self.rate_limiter.acquire(tokens)
+        for response in self.client.models.generate_content_stream(
+            model=self.model_id,
+            contents=contents,
+            config=config,
+        ):
+            if response.candidates and response.candidates[0].content:
+                for part in response.candidates[0].content.parts or []:
+                    if not part.text:
+                        continue
+                    if getattr(part, "thought", False):
+                        yield StreamChunk(reasoning=part.text)
+                    else:
+                        yield StreamChunk(text=part.text)
+            if response.usage_metadata:
+                # Usage metadata is cumulative; the last chunk carries the totals
+                yield StreamChunk(usage=_usage(response))
+
+
+def _encode_message(msg: Message) -> types.Content:
+    role = "model" if msg.role == "assistant" else "user"
+    return types.Content(role=role, parts=[types.Part(text=msg.content)])
+
+
+def _usage(response: types.GenerateContentResponse) -> dict:
+    meta = response.usage_metadata
+    if meta is None:
+        return {}
+    return {
+        "input_tokens": meta.prompt_token_count or 0,
+        "output_tokens": meta.candidates_token_count or 0,
+        "thinking_tokens": meta.thoughts_token_count or 0,
+        "cached_tokens": meta.cached_content_token_count or 0,
+    }
@@ -0,0 +1,309 @@
+"""Offline provider with scripted replies and a synthetic latency/error model.
+
+Used to load-test and benchmark the dialog loop, the intent classifier and
+the exports without network access or API keys. Replies are deterministic
+for a given request and seed; failures are injected with HTTP-like status
+codes so they go through the same retry and circuit-breaker path as real
+provider errors.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections.abc import Iterator
+
+from config.defaults import SITUATIONS
+from config.settings import CALL_DEADLINE, REQUEST_TIMEOUT
+from models.base import BaseProvider, LLMResponse, Message, StreamChunk
+from models.prompt_cache import PromptCache
+from models.ratelimit import RateLimiter
+from models.resilience import acall_with_retry, call_with_retry, get_breaker, stream_with_retry
+from models.tokens import estimate_request_tokens
+
+TEACHER_REPLIES = [
+    "Давай разберёмся по шагам. Что нам дано в условии?",
+    "Хорошо. Какое правило здесь можно применить?",
+    "Почти! Проверь знак во втором слагаемом: чему равно $-3 \\cdot (-2)$?",
+    "Верно. Теперь подставь найденное значение: $x = 4$. Что получается?",
+    "Отличный план. Начнём с первого шага — раскроем скобки.",
+    "Смотри: $\\frac{a}{b} + \\frac{c}{d} = \\frac{ad + bc}{bd}$. Попробуешь сам?",
+]
+
+STUDENT_REPLIES = [
+    "не знаю",
+    "наверное 12",
+    "а почему так?",
+    "давай",
+    "x = 4",
+    "я думаю надо раскрыть скобки",
+    "реши сам",
+    "ок понял",
+]
+
+# Share of teacher turns (after the first few) that close the task
+SOLVE_RATE = 0.15
+
+_REASONING_SENTENCES = {
+    "minimal": 1,
+    "low": 2,
+    "medium": 4,
+    "high": 8,
+}
+
+
+class MockProviderError(RuntimeError):
+    """Injected failure; status_code lets the resilience layer classify it."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"{status_code} {message}")
+        self.status_code = status_code
+
+
+class MockProvider(BaseProvider):
+    def __init__(
+        self,
+        model_id: str = "mock",
+        reasoning_effort: str | None = None,
+        replies: list[str] | None = None,
+        ttft: float = 0.4,
+        ttft_jitter: float = 0.15,
+        tokens_per_sec: float = 60.0,
+        failure_rate: float = 0.0,
+        failure_status: int = 503,
+        seed: int = 0,
+        timeout: float = REQUEST_TIMEOUT,
+        deadline: float = CALL_DEADLINE,
+        rate_limiter: RateLimiter | None = None,
+    ):
+        """
+        replies: scripted replies used in order (cycled); when omitted, replies
+                 are picked from built-in teacher/student templates.
+        ttft / ttft_jitter: mean and std-dev of time to first token, seconds.
+        tokens_per_sec: output speed after the first token (0 = instant).
+        failure_rate: probability that an attempt fails with *failure_status*.
+        """
+        self.model_id = model_id
+        self.reasoning_effort = reasoning_effort
+        self.replies = replies
+        self.ttft = ttft
+        self.ttft_jitter = ttft_jitter
+        self.tokens_per_sec = tokens_per_sec
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.seed = seed
+        self.timeout = timeout
+        self.deadline = deadline
+        self.rate_limiter = rate_limiter
+        self.breaker = get_breaker(f"mock:{model_id}")
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._failure_rng = random.Random(seed)
+
+    # ─── Reply model ───────────────────────────────────────────
+
+    def _rng(self, system_prompt: str, history: list[Message]) -> random.Random:
+        """RNG seeded by the request content, so identical requests get identical replies."""
+        digest = hashlib.sha256(str(self.seed).encode())
+        digest.update(system_prompt.encode())
+        for msg in history:
+            digest.update(f"\x00{msg.role}\x00{msg.content}".encode())
+        return random.Random(digest.digest())
+
+    def _compose(
+        self, system_prompt: str, history: list[Message], json_schema: dict | None = None
+    ) -> LLMResponse:
+        rng = self._rng(system_prompt, history)
+
+        if self.replies:
+            with self._lock:
+                text = self.replies[self._calls % len(self.replies)]
+                self._calls += 1
+        elif json_schema and "intent" in json_schema.get("properties", {}):
+            text = _fused_json(system_prompt, json_schema, rng)
+        elif _is_classifier(system_prompt):
+            text = rng.choice(SITUATIONS)["id"]
+            if json_schema:
+                text = _situation_json(text, rng)
+        elif "[SOLVED]" in system_prompt:
+            text = rng.choice(TEACHER_REPLIES)
+            if len(history) > 4 and rng.random() < SOLVE_RATE:
+                text = "Задача решена, молодец! Хочешь ещё одну? [SOLVED]"
+        else:
+            text = rng.choice(STUDENT_REPLIES)
+
+        reasoning = None
+        sentences = _REASONING_SENTENCES.get(self.reasoning_effort or "", 0)
+        if sentences:
+            last = history[-1].content[:60] if history else "начало диалога"
+            reasoning = " ".join(
+                f"Шаг {i + 1}: обдумываю реплику «{last}»." for i in range(sentences)
+            )
+        return LLMResponse(
+            text=text,
+            reasoning=reasoning,
+            input_tokens=estimate_request_tokens(system_prompt, history),
+            output_tokens=len(_split_words(text)),
+            thinking_tokens=len(_split_words(reasoning or "")),
+        )
+
+    # ─── Latency and failure model ─────────────────────────────
+
+    def _plan(self, rng: random.Random) -> tuple[float, float]:
+        """Return (time to first token, per-token delay) in seconds."""
+        ttft = max(0.0, rng.gauss(self.ttft, self.ttft_jitter)) if self.ttft else 0.0
+        per_token = 1 / self.tokens_per_sec if self.tokens_per_sec else 0.0
+        return ttft, per_token
+
+    def _maybe_fail(self):
+        with self._lock:
+            failed = self.failure_rate and self._failure_rng.random() < self.failure_rate
+        if failed:
+            raise MockProviderError(self.failure_status, "Injected mock failure")
+
+    # ─── BaseProvider API ──────────────────────────────────────
+
+    def generate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: PromptCache | None = None,
+    ) -> LLMResponse:
+        def attempt(timeout: float) -> LLMResponse:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(estimate_request_tokens(system_prompt, history))
+            self._maybe_fail()
+            response = self._compose(system_prompt, history, json_schema)
+            ttft, per_token = self._plan(self._rng(system_prompt, history))
+            time.sleep(ttft + per_token * (response.output_tokens + response.thinking_tokens))
+            return response
+
+        started = time.monotonic()
+        retries = []
+        response = call_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Mock {self.model_id}",
+            on_retry=retries.append,
+        )
+        response.latency = time.monotonic() - started
+        response.retries = len(retries)
+        return response
+
+    async def agenerate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: PromptCache | None = None,
+    ) -> LLMResponse:
+        async def attempt(timeout: float) -> LLMResponse:
+            if self.rate_limiter:
+                await self.rate_limiter.aacquire(estimate_request_tokens(system_prompt, history))
+            self._maybe_fail()
+            response = self._compose(system_prompt, history, json_schema)
+            ttft, per_token = self._plan(self._rng(system_prompt, history))
+            await asyncio.sleep(ttft + per_token * (response.output_tokens + response.thinking_tokens))
+            return response
+
+        started = time.monotonic()
+        retries = []
+        response = await acall_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Mock {self.model_id}",
+            on_retry=retries.append,
+        )
+        response.latency = time.monotonic() - started
+        response.retries = len(retries)
+        return response
+
+    def stream_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        cache: PromptCache | None = None,
+    ) -> Iterator[StreamChunk]:
+        def attempt(timeout: float) -> Iterator[StreamChunk]:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(estimate_request_tokens(system_prompt, history))
+            self._maybe_fail()
+            response = self._compose(system_prompt, history)
+            ttft, per_token = self._plan(self._rng(system_prompt, history))
+            time.sleep(ttft)
+            for word in _split_words(response.reasoning or ""):
+                yield StreamChunk(reasoning=word)
+                time.sleep(per_token)
+            for word in _split_words(response.text):
+                yield StreamChunk(text=word)
+                time.sleep(per_token)
+            yield StreamChunk(usage=response.usage())
+
+        retries = []
+        chunks = stream_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Mock {self.model_id}",
+            on_retry=retries.append,
+        )
+        for chunk in chunks:
+            if chunk.usage is not None:
+                yield StreamChunk(usage={**chunk.usage, "retries": len(retries)})
+            else:
+                yield chunk
+
+
+def _is_classifier(system_prompt: str) -> bool:
+    """The situation classifier prompt lists (almost) every situation id."""
+    hits = sum(1 for s in SITUATIONS if s["id"] in system_prompt)
+    return hits >= len(SITUATIONS) // 2
+
+
+def _situation_json(situation_id: str, rng: random.Random) -> str:
+    """Structured classifier reply: most mass on *situation_id*, the rest spread thin."""
+    rest = {s["id"]: rng.random() for s in SITUATIONS if s["id"] != situation_id}
+    top = rng.uniform(0.5, 0.95)
+    scale = (1 - top) / sum(rest.values())
+    probabilities = {situation_id: top} | {sid: w * scale for sid, w in rest.items()}
+    return json.dumps(
+        {
+            "situation": situation_id,
+            "probabilities": {sid: round(p, 3) for sid, p in probabilities.items()},
+        }
+    )
+
+
+def _fused_json(system_prompt: str, json_schema: dict, rng: random.Random) -> str:
+    """Fused student reply: a situation, the intent drawn for it and a reply."""
+    situation_id = rng.choice(json_schema["properties"]["situation"]["enum"])
+    match = re.search(rf"^- {re.escape(situation_id)} → (\S+)$", system_prompt, re.MULTILINE)
+    intent_id = match.group(1) if match else rng.choice(json_schema["properties"]["intent"]["enum"])
+    return json.dumps(
+        {"situation": situation_id, "intent": intent_id, "text": rng.choice(STUDENT_REPLIES)},
+        ensure_ascii=False,
+    )
+
+
+def _split_words(text: str) -> list[str]:
+    """Split text into word-sized stream deltas that concatenate back to *text*."""
+    words = text.split(" ")
+    return [w + " " for w in words[:-1]] + words[-1:] if text else []
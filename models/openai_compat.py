@@ -1,9 +1,19 @@
 """Yandex Cloud provider using OpenAI-compatible Responses API."""
 
+import logging
+import time
+from collections.abc import Iterator
+
 import openai
 
-from config.settings import YANDEX_BASE_URL
-from models.base import BaseProvider, LLMResponse, Message
+from config.settings import CALL_DEADLINE, REQUEST_TIMEOUT, YANDEX_BASE_URL
+from models.base import BaseProvider, LLMResponse, Message, StreamChunk, encode_history
+from models.prompt_cache import PromptCache, prompt_owner
+from models.ratelimit import RateLimiter
+from models.resilience import acall_with_retry, call_with_retry, get_breaker, stream_with_retry
+from models.tokens import estimate_request_tokens
+
+log = logging.getLogger(__name__)
 
 
 class OpenAICompatProvider(BaseProvider):
@@ -13,26 +23,54 @@ class OpenAICompatProvider(BaseProvider):
         folder_id: str,
         model_id: str,
         reasoning_effort: str | None = None,
+        timeout: float = REQUEST_TIMEOUT,
+        deadline: float = CALL_DEADLINE,
+        rate_limiter: RateLimiter | None = None,
     ):
+        # Retries are handled by models.resilience, not by the SDK
         self.client = openai.OpenAI(
             api_key=api_key,
             base_url=YANDEX_BASE_URL,
             project=folder_id,
+            max_retries=0,
         )
         self.model_uri = f"gpt://{folder_id}/{model_id}"
         self.reasoning_effort = reasoning_effort
+        self.timeout = timeout
+        self.deadline = deadline
+        self.rate_limiter = rate_limiter
+        self.breaker = get_breaker(f"yandex:{model_id}")
+        self._api_key = api_key
+        self._folder_id = folder_id
+        self._async_client: openai.AsyncOpenAI | None = None
 
-    def generate_response(
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        """AsyncOpenAI client, created on first async call."""
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(
+                api_key=self._api_key,
+                base_url=YANDEX_BASE_URL,
+                project=self._folder_id,
+                max_retries=0,
+            )
+        return self._async_client
+
+    def close(self):
+        self.client.close()
+        # The async client's pool is bound to the loop that used it; just drop it
+        self._async_client = None
+
+    def _build_request(
         self,
         system_prompt: str,
         history: list[Message],
         temperature: float,
         max_tokens: int,
-    ) -> LLMResponse:
-        input_messages = []
-        for msg in history:
-            if msg.content.strip():
-                input_messages.append({"role": msg.role, "content": msg.content})
+        json_schema: dict | None = None,
+    ) -> dict:
+        # Empty messages are encoded as None and skipped
+        input_messages = [m for m in encode_history(history, "responses", _encode_message) if m]
 
         if not input_messages:
             input_messages.append({"role": "user", "content": "Начни диалог."})
@@ -47,9 +85,134 @@ class OpenAICompatProvider(BaseProvider):
 
         if self.reasoning_effort:
             kwargs["reasoning"] = {"effort": self.reasoning_effort}
+        if json_schema:
+            # JSON mode: the schema itself is spelled out in the prompt
+            kwargs["text"] = {"format": {"type": "json_object"}}
+        return kwargs
+
+    def _chain(self, cache: PromptCache, system_prompt: str, history: list[Message], kwargs: dict) -> dict:
+        """Chain the request to the dialog's last response and send only newer messages.
+
+        Instructions are not inherited through previous_response_id, so the
+        system prompt is still sent; the saving is the dialog history.
+        """
+        kwargs = {**kwargs, "store": True}  # later turns chain to this response
+        with cache.lock:
+            cache.bind(prompt_owner(f"yandex:{self.model_uri}", system_prompt))
+            if not cache.response_id or not cache.covers(history, cache.response_length, cache.response_digest):
+                return kwargs
+            response_id, start = cache.response_id, cache.response_length
+        new_messages = [m for m in encode_history(history, "responses", _encode_message)[start:] if m]
+        if not new_messages:
+            return kwargs
+        return {**kwargs, "input": new_messages, "previous_response_id": response_id}
+
+    @staticmethod
+    def _remember(cache: PromptCache | None, history: list[Message], response):
+        """Let the next request chain to *response*."""
+        if cache is not None and response.id:
+            with cache.lock:
+                cache.set_response(response.id, history, response.output_text)
+
+    @staticmethod
+    def _chain_lost(cache: PromptCache | None, kwargs: dict, exc: Exception) -> bool:
+        """Whether *exc* means the chained response is gone; unchains if so."""
+        if cache is None or "previous_response_id" not in kwargs:
+            return False
+        if not isinstance(exc, (openai.NotFoundError, openai.BadRequestError)):
+            return False
+        log.warning("Chained request to %s rejected (%s); resending in full", kwargs["previous_response_id"], exc)
+        with cache.lock:
+            if cache.response_id == kwargs["previous_response_id"]:
+                cache.clear_response()
+        return True
+
+    def generate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: PromptCache | None = None,
+    ) -> LLMResponse:
+        full = self._build_request(system_prompt, history, temperature, max_tokens, json_schema)
+        kwargs = self._chain(cache, system_prompt, history, full) if cache else full
+        tokens = estimate_request_tokens(system_prompt, history)
+
+        def attempt(timeout: float):
+            nonlocal kwargs
+            if self.rate_limiter:
+                self.rate_limiter.acquire(tokens)
+            try:
+                return self.client.responses.create(**kwargs, timeout=timeout)
+            except openai.APIStatusError as e:
+                if not self._chain_lost(cache, kwargs, e):
+                    raise
+                kwargs = {**full, "store": True}
+                return self.client.responses.create(**kwargs, timeout=timeout)
+
+        started = time.monotonic()
+        retries = []
+        response = call_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Yandex {self.model_uri}",
+            on_retry=retries.append,
+        )
+        self._remember(cache, history, response)
+        result = self._parse_response(response)
+        result.latency = time.monotonic() - started
+        result.retries = len(retries)
+        return result
+
+    async def agenerate_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        json_schema: dict | None = None,
+        cache: PromptCache | None = None,
+    ) -> LLMResponse:
+        full = self._build_request(system_prompt, history, temperature, max_tokens, json_schema)
+        kwargs = self._chain(cache, system_prompt, history, full) if cache else full
+        tokens = estimate_request_tokens(system_prompt, history)
 
-        response = self.client.responses.create(**kwargs)
+        async def attempt(timeout: float):
+            nonlocal kwargs
+            if self.rate_limiter:
+                await self.rate_limiter.aacquire(tokens)
+            try:
+                return await self.async_client.responses.create(**kwargs, timeout=timeout)
+            except openai.APIStatusError as e:
+                if not self._chain_lost(cache, kwargs, e):
+                    raise
+                kwargs = {**full, "store": True}
+                return await self.async_client.responses.create(**kwargs, timeout=timeout)
 
+        started = time.monotonic()
+        retries = []
+        response = await acall_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Yandex {self.model_uri}",
+            on_retry=retries.append,
+        )
+        self._remember(cache, history, response)
+        result = self._parse_response(response)
+        result.latency = time.monotonic() - started
+        result.retries = len(retries)
+        return result
+
+    @staticmethod
+    def _parse_response(response) -> LLMResponse:
         reasoning_text = None
         for item in response.output:
             if item.type == "reasoning":
@@ -60,4 +223,87 @@ class OpenAICompatProvider(BaseProvider):
                 if parts:
                     reasoning_text = "\n".join(parts)
 
-        return LLMResponse(text=response.output_text, reasoning=reasoning_text)
+        return LLMResponse(text=response.output_text, reasoning=reasoning_text, **_usage(response))
+
+    def stream_response(
+        self,
+        system_prompt: str,
+        history: list[Message],
+        temperature: float,
+        max_tokens: int,
+        *,
+        cache: PromptCache | None = None,
+    ) -> Iterator[StreamChunk]:
+        full = self._build_request(system_prompt, history, temperature, max_tokens)
+        kwargs = self._chain(cache, system_prompt, history, full) if cache else full
+        tokens = estimate_request_tokens(system_prompt, history)
+
+        def attempt(timeout: float) -> Iterator[StreamChunk]:
+            nonlocal kwargs
+            on_complete = lambda response: self._remember(cache, history, response)
+            try:
+                yield from self._iter_stream(kwargs, timeout, tokens, on_complete)
+            except openai.APIStatusError as e:
+                # Rejected when the stream is opened, before any chunk
+                if not self._chain_lost(cache, kwargs, e):
+                    raise
+                kwargs = {**full, "store": True}
+                yield from self._iter_stream(kwargs, timeout, tokens, on_complete)
+
+        retries = []
+        chunks = stream_with_retry(
+            attempt,
+            breaker=self.breaker,
+            timeout=self.timeout,
+            deadline=self.deadline,
+            label=f"Yandex {self.model_uri}",
+            on_retry=retries.append,
+        )
+        usage = {}
+        for chunk in chunks:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            else:
+                yield chunk
+        yield StreamChunk(usage={**usage, "retries": len(retries)})
+
+    def _iter_stream(
+        self, kwargs: dict, timeout: float, tokens: int, on_complete=None
+    ) -> Iterator[StreamChunk]:
+        if self.rate_limiter:
+            self.rate_limiter.acquire(tokens)
+        with self.client.responses.create(**kwargs, stream=True, timeout=timeout) as stream:
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield StreamChunk(text=event.delta)
+                elif event.type == "response.reasoning_summary_text.delta":
+                    yield StreamChunk(reasoning=event.delta)
+                elif event.type == "response.reasoning_summary_part.done":
+                    # Separate summary parts the same way generate_response joins them
+                    yield StreamChunk(reasoning="\n")
+                elif event.type == "response.completed":
+                    if on_complete is not None:
+                        on_complete(event.response)
+                    yield StreamChunk(usage=_usage(event.response))
+                elif event.type == "response.failed":
+                    raise RuntimeError(f"Yandex streaming error: {event.response.error}")
+
+
+def _encode_message(msg: Message) -> dict | None:
+    return {"role": msg.role, "content": msg.content} if msg.content.strip() else None
+
+
+def _usage(response) -> dict:
+    usage = response.usage
+    if usage is None:
+        return {}
+    details = getattr(usage, "output_tokens_details", None)
+    thinking = (getattr(details, "reasoning_tokens", 0) or 0) if details else 0
+    input_details = getattr(usage, "input_tokens_details", None)
+    return {
+        "input_tokens": usage.input_tokens or 0,
+        # Responses API counts reasoning inside output tokens
+        "output_tokens": max(0, (usage.output_tokens or 0) - thinking),
+        "thinking_tokens": thinking,
+        "cached_tokens": (getattr(input_details, "cached_tokens", 0) or 0) if input_details else 0,
+    }
@@ -0,0 +1,232 @@
+"""Process-wide pool of provider instances, reused across turns and sessions.
+
+Building a provider creates a new SDK client (and HTTP connection pool), so
+providers are cached by everything that affects their behaviour and shared
+by all Streamlit sessions in the process.
+"""
+
+import logging
+import threading
+import time
+
+from config.defaults import AVAILABLE_MODELS
+from config.settings import (
+    CALL_DEADLINE,
+    CASSETTE_DIR,
+    CASSETTE_MODE,
+    CLASSIFIER_DEADLINE,
+    CLASSIFIER_TIMEOUT,
+    REQUEST_TIMEOUT,
+)
+from models.base import BaseProvider
+from models.ratelimit import get_rate_limiter
+
+IDLE_TTL = 15 * 60  # seconds without use before a provider is closed
+SWEEP_INTERVAL = 60  # seconds between idle sweeps
+
+log = logging.getLogger(__name__)
+
+
+class ProviderPool:
+    """Thread-safe registry of providers keyed by their construction settings."""
+
+    def __init__(self, idle_ttl: float = IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._entries: dict[tuple, tuple[BaseProvider, float]] = {}
+        self._last_sweep = time.monotonic()
+
+    def get(self, key: tuple, factory) -> BaseProvider:
+        """Return the pooled provider for *key*, creating it with *factory()* if absent."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep >= SWEEP_INTERVAL:
+                self._evict_idle_locked(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                provider = factory()
+                log.info("Created pooled provider %s", key[:2])
+            else:
+                provider = entry[0]
+            self._entries[key] = (provider, now)
+            return provider
+
+    def evict_idle(self) -> int:
+        """Close providers unused for longer than idle_ttl. Returns how many were closed."""
+        with self._lock:
+            return self._evict_idle_locked(time.monotonic())
+
+    def close(self):
+        """Close and forget all pooled providers."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for provider, _ in entries:
+            _close_quietly(provider)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict_idle_locked(self, now: float) -> int:
+        self._last_sweep = now
+        stale = [k for k, (_, used) in self._entries.items() if now - used > self.idle_ttl]
+        for key in stale:
+            provider, _ = self._entries.pop(key)
+            _close_quietly(provider)
+        if stale:
+            log.info("Evicted %d idle provider(s)", len(stale))
+        return len(stale)
+
+
+def _close_quietly(provider: BaseProvider):
+    try:
+        provider.close()
+    except Exception:
+        log.exception("Failed to close provider %r", provider)
+
+
+_pool = ProviderPool()
+
+
+def get_provider(
+    model_name: str,
+    gemini_api_key: str = "",
+    yandex_api_key: str = "",
+    yandex_folder_id: str = "",
+    thinking_level: str | None = None,
+    reasoning_effort: str | None = None,
+    thinking_budget: int | None = None,
+    timeout: float = REQUEST_TIMEOUT,
+    deadline: float = CALL_DEADLINE,
+) -> BaseProvider:
+    """Return a shared provider for a model from AVAILABLE_MODELS.
+
+    Only the settings relevant to the model's provider are part of the key,
+    so e.g. a Gemini provider is not rebuilt when the Yandex key changes.
+    With CASSETTE_DIR set, the provider is wrapped for record/replay.
+    """
+    model_cfg = AVAILABLE_MODELS[model_name]
+
+    if model_cfg["provider"] == "gemini":
+        from models.gemini_provider import GeminiProvider
+
+        key = ("gemini", model_cfg["model_id"], gemini_api_key, thinking_level, thinking_budget)
+        factory = lambda: GeminiProvider(
+            api_key=gemini_api_key,
+            model_id=model_cfg["model_id"],
+            thinking_level=thinking_level,
+            thinking_budget=thinking_budget,
+            timeout=timeout,
+            deadline=deadline,
+            rate_limiter=_rate_limiter(model_cfg, gemini_api_key),
+        )
+    elif model_cfg["provider"] == "mock":
+        from models.mock_provider import MockProvider
+
+        key = ("mock", model_cfg["model_id"], reasoning_effort)
+        factory = lambda: MockProvider(
+            model_id=model_cfg["model_id"],
+            reasoning_effort=reasoning_effort,
+            timeout=timeout,
+            deadline=deadline,
+            rate_limiter=_rate_limiter(model_cfg, ""),
+            **model_cfg.get("mock", {}),
+        )
+    else:
+        from models.openai_compat import OpenAICompatProvider
+
+        key = ("yandex", model_cfg["model_id"], yandex_api_key, yandex_folder_id, reasoning_effort)
+        factory = lambda: OpenAICompatProvider(
+            api_key=yandex_api_key,
+            folder_id=yandex_folder_id,
+            model_id=model_cfg["model_id"],
+            reasoning_effort=reasoning_effort,
+            timeout=timeout,
+            deadline=deadline,
+            rate_limiter=_rate_limiter(model_cfg, f"{yandex_folder_id}:{yandex_api_key}"),
+        )
+
+    if CASSETTE_DIR:
+        from models.cassette import CassetteProvider, CassetteStore
+
+        # Credentials are not part of the cassette key: recordings are shareable
+        descriptor = f"{model_cfg['provider']}:{model_cfg['model_id']}|{thinking_level}|{reasoning_effort}"
+        if thinking_budget is not None:
+            descriptor += f"|budget={thinking_budget}"
+        build = factory
+        factory = lambda: CassetteProvider(
+            build(), CassetteStore(CASSETTE_DIR), model=descriptor, mode=CASSETTE_MODE
+        )
+        key = ("cassette", CASSETTE_DIR, CASSETTE_MODE) + key
+
+    return _pool.get(key + (timeout, deadline), factory)
+
+
+def get_classifier_provider(
+    model_name: str,
+    gemini_api_key: str = "",
+    yandex_api_key: str = "",
+    yandex_folder_id: str = "",
+) -> BaseProvider:
+    """Return a shared provider tuned for the one-word situation classifier.
+
+    Reasoning is turned down as far as the model allows and timeouts are
+    short, since a slow classifier call blocks the whole student turn.
+    """
+    return get_provider(
+        model_name,
+        gemini_api_key=gemini_api_key,
+        yandex_api_key=yandex_api_key,
+        yandex_folder_id=yandex_folder_id,
+        timeout=CLASSIFIER_TIMEOUT,
+        deadline=CLASSIFIER_DEADLINE,
+        **_low_reasoning(AVAILABLE_MODELS[model_name]),
+    )
+
+
+def get_summary_provider(
+    model_name: str,
+    gemini_api_key: str = "",
+    yandex_api_key: str = "",
+    yandex_folder_id: str = "",
+) -> BaseProvider:
+    """Return a shared provider for context summaries (see agents/context.py).
+
+    Reasoning is turned down as for the classifier: both APIs count
+    thinking tokens against the output cap, so a reasoning summarizer
+    often spends the cap before it writes the summary.
+    """
+    return get_provider(
+        model_name,
+        gemini_api_key=gemini_api_key,
+        yandex_api_key=yandex_api_key,
+        yandex_folder_id=yandex_folder_id,
+        **_low_reasoning(AVAILABLE_MODELS[model_name]),
+    )
+
+
+def _low_reasoning(model_cfg: dict) -> dict:
+    """get_provider settings with the least reasoning the model allows."""
+    if model_cfg["provider"] == "gemini":
+        if model_cfg.get("supports_thinking"):
+            return {"thinking_level": "minimal"}
+        return {"thinking_budget": 0}
+    if model_cfg["provider"] == "yandex":
+        return {"reasoning_effort": "low"}
+    return {}
+
+
+def _rate_limiter(model_cfg: dict, api_key: str):
+    """Shared limiter for the model's quota; all thinking/reasoning variants share it."""
+    return get_rate_limiter(
+        model_cfg["provider"],
+        model_cfg["model_id"],
+        api_key,
+        rpm=model_cfg.get("rpm"),
+        tpm=model_cfg.get("tpm"),
+    )
+
+
+def close_all():
+    """Close every pooled provider (e.g. on shutdown or after changing keys)."""
+    _pool.close()
@@ -0,0 +1,114 @@
+"""Per-dialog handles for provider-side prompt caching.
+
+The teacher's system prompt and the dialog so far are the same on every
+turn. Providers that can reuse them server-side send only what is new:
+
+- Gemini: an explicit cached content holds the system instruction and a
+  stable dialog prefix; requests reference it and send the messages after it.
+- Yandex (Responses API): each request is chained to the previous response
+  with previous_response_id and sends only the messages after it.
+
+A PromptCache belongs to one dialog and agent. It is bound to the provider
+and system prompt it was built for and resets itself when either changes
+(e.g. the prompt is edited) or when the history no longer extends what is
+cached. Providers without caching ignore it.
+"""
+
+import hashlib
+import logging
+import threading
+from collections.abc import Callable, Sequence
+
+from models.base import Message
+
+log = logging.getLogger(__name__)
+
+
+def history_digest(history: Sequence[Message]) -> str:
+    """Stable hash of a message sequence."""
+    h = hashlib.sha256()
+    for msg in history:
+        h.update(msg.role.encode("utf-8"))
+        h.update(b"\0")
+        h.update(msg.content.encode("utf-8"))
+        h.update(b"\1")
+    return h.hexdigest()
+
+
+def prompt_owner(provider_key: str, system_prompt: str) -> str:
+    """Identity a cache is bound to: provider/model and system prompt."""
+    return f"{provider_key}:{hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()[:16]}"
+
+
+class PromptCache:
+    """Server-side cache state for one dialog and agent.
+
+    Providers hold *lock* while reading or updating the fields.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.owner: str | None = None
+        # Gemini cached content: name, expiry (time.time()) and covered prefix
+        self.content_name: str | None = None
+        self.content_expires = 0.0
+        self.content_length = 0
+        self.content_digest = ""
+        self.content_disabled = False  # creation failed for this owner
+        # Responses API chain: last response id and the history it ends
+        self.response_id: str | None = None
+        self.response_length = 0
+        self.response_digest = ""
+        self._cleanup: Callable[[], None] | None = None
+
+    def bind(self, owner: str):
+        """Reset unless the cache was built for *owner* (call with lock held)."""
+        if owner != self.owner:
+            if self.owner is not None:
+                log.info("Prompt cache invalidated (%s → %s)", self.owner, owner)
+            self._reset()
+            self.owner = owner
+
+    def covers(self, history: Sequence[Message], length: int, digest: str) -> bool:
+        """Whether *history* starts with the cached prefix of *length* messages."""
+        return length <= len(history) and history_digest(history[:length]) == digest
+
+    def set_content(self, name: str, expires: float, length: int, digest: str, cleanup: Callable[[], None]):
+        """Replace the cached content, deleting the previous one."""
+        self.drop_content()
+        self.content_name, self.content_expires = name, expires
+        self.content_length, self.content_digest = length, digest
+        self._cleanup = cleanup
+
+    def set_response(self, response_id: str, history: Sequence[Message], reply: str):
+        """Chain the next request to *response_id*, which answered *history* with *reply*."""
+        covered = list(history) + [Message("assistant", reply)]
+        self.response_id = response_id
+        self.response_length = len(covered)
+        self.response_digest = history_digest(covered)
+
+    def clear_response(self):
+        self.response_id, self.response_length, self.response_digest = None, 0, ""
+
+    def release(self):
+        """Drop all state and delete server-side resources (e.g. a new dialog)."""
+        with self.lock:
+            self._reset()
+            self.owner = None
+
+    def _reset(self):
+        self.drop_content()
+        self.content_disabled = False
+        self.clear_response()
+
+    def drop_content(self):
+        """Forget the cached content and delete it server-side."""
+        cleanup, self._cleanup = self._cleanup, None
+        self.content_name, self.content_expires = None, 0.0
+        self.content_length, self.content_digest = 0, ""
+        if cleanup is not None:
+            try:
+                cleanup()
+            except Exception:
+                # It expires on its own; nothing else refers to it
+                log.warning("Failed to delete cached content", exc_info=True)
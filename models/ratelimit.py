@@ -0,0 +1,127 @@
+"""Process-wide token-bucket rate limiting per (provider, model, API key).
+
+Each limiter has two buckets — requests per minute and estimated input
+tokens per minute — and admits callers strictly in arrival order, so
+threads and coroutines sharing a quota get steady throughput at the
+ceiling instead of a burst of 429 errors.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import threading
+import time
+from collections import deque
+
+# Longest single wait between re-checks; keeps waiters responsive to refills
+_POLL_INTERVAL = 0.05
+
+
+class _Bucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0  # units per second
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until *amount* is available (0 if it already is)."""
+        amount = min(amount, self.capacity)  # oversize requests wait for a full bucket
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """FIFO admission under RPM and TPM limits (either may be None = unlimited)."""
+
+    def __init__(self, rpm: int | None = None, tpm: int | None = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = _Bucket(rpm) if rpm else None
+        self._tokens = _Bucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queue: deque[int] = deque()
+        self._tickets = itertools.count()
+
+    def _try_admit(self, ticket: int, tokens: int) -> float:
+        """Admit *ticket* if it is first in line and budget allows; else return the wait."""
+        if self._queue[0] != ticket:
+            return _POLL_INTERVAL
+        now = time.monotonic()
+        wait = 0.0
+        for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_for(amount))
+        if wait > 0:
+            return wait
+        for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+            if bucket is not None:
+                bucket.take(amount)
+        self._queue.popleft()
+        self._changed.notify_all()
+        return 0.0
+
+    def acquire(self, tokens: int = 0):
+        """Block until one request with *tokens* estimated tokens may be sent."""
+        if self._requests is None and self._tokens is None:
+            return
+        with self._lock:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+            try:
+                while (wait := self._try_admit(ticket, tokens)) > 0:
+                    self._changed.wait(min(wait, 1.0))
+            except BaseException:
+                self._abandon(ticket)
+                raise
+
+    async def aacquire(self, tokens: int = 0):
+        """Async counterpart of acquire; waits without blocking the event loop."""
+        if self._requests is None and self._tokens is None:
+            return
+        with self._lock:
+            ticket = next(self._tickets)
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_admit(ticket, tokens)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(min(wait, _POLL_INTERVAL))
+        except BaseException:
+            with self._lock:
+                self._abandon(ticket)
+            raise
+
+    def _abandon(self, ticket: int):
+        """Drop a cancelled waiter so it does not block the line (lock held)."""
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            self._changed.notify_all()
+
+
+_limiters: dict[tuple, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    provider: str, model_id: str, api_key: str, rpm: int | None, tpm: int | None
+) -> RateLimiter | None:
+    """Return the shared limiter for a quota, or None when the model has no limits."""
+    if not rpm and not tpm:
+        return None
+    key = (provider, model_id, hashlib.sha256(api_key.encode()).hexdigest()[:16])
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(rpm=rpm, tpm=tpm)
+        return limiter
@@ -0,0 +1,339 @@
+"""Shared retry, backoff and circuit-breaker layer for all providers.
+
+Errors are classified into a few classes (rate limit, server, timeout,
+connection, fatal) by HTTP status or exception type, so the same policies
+work for google-genai and openai exceptions. Each class has its own
+exponential backoff with jitter; ``Retry-After`` headers take precedence.
+A per-model circuit breaker fails fast while an endpoint is down.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+from config.settings import (
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_TIMEOUT,
+    CALL_DEADLINE,
+    REQUEST_TIMEOUT,
+)
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 1.0  # seconds
+    max_delay: float = 30.0  # seconds
+    multiplier: float = 2.0
+    jitter: float = 0.5  # share of the delay that is randomized
+
+    def delay(self, attempt: int) -> float:
+        """Backoff before attempt number *attempt* + 1 (attempt starts at 1)."""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+
+# Error classes not listed here (i.e. "fatal": bad request, auth, ...) are never retried.
+RETRY_POLICIES: dict[str, RetryPolicy] = {
+    "rate_limit": RetryPolicy(max_attempts=6, base_delay=2.0, max_delay=60.0),
+    "server": RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=20.0),
+    "timeout": RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=5.0),
+    "connection": RetryPolicy(max_attempts=4, base_delay=0.5, max_delay=10.0),
+}
+
+# Error classes that mean "the endpoint is unhealthy" and count towards the breaker
+_BREAKER_ERRORS = {"server", "timeout", "connection"}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the endpoint while its circuit breaker is open."""
+
+
+def _status_code(exc: BaseException) -> int | None:
+    # openai: APIStatusError.status_code; google-genai: APIError.code
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def classify_error(exc: BaseException) -> str:
+    """Map an SDK exception to an error class used to pick a retry policy."""
+    if isinstance(exc, CircuitOpenError):
+        return "fatal"
+    status = _status_code(exc)
+    if status is not None:
+        if status == 429:
+            return "rate_limit"
+        if status == 408:
+            return "timeout"
+        if status >= 500:
+            return "server"
+        return "fatal"
+    names = [cls.__name__ for cls in type(exc).__mro__]
+    if any("Timeout" in name for name in names):
+        return "timeout"
+    if any(name in ("APIConnectionError", "TransportError", "ConnectionError") for name in names):
+        return "connection"
+    return "fatal"
+
+
+def retry_after(exc: BaseException) -> float | None:
+    """Seconds to wait as requested by the server, if the error carries Retry-After."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Classic closed → open → half-open breaker.
+
+    After *failure_threshold* consecutive endpoint failures the circuit opens
+    and calls fail immediately with CircuitOpenError. After *reset_timeout*
+    seconds one probe call is let through; its outcome closes or re-opens it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call is currently allowed."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            waited = time.monotonic() - self._opened_at
+            if waited < self.reset_timeout or self._probing:
+                raise CircuitOpenError(
+                    f"{self.name}: endpoint unavailable, circuit open "
+                    f"(retry in {max(0.0, self.reset_timeout - waited):.0f}s)"
+                )
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    log.warning("Circuit for %s opened after %d failures", self.name, self._failures)
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """End a probe whose outcome says nothing about endpoint health."""
+        with self._lock:
+            self._probing = False
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Return the process-wide breaker for an endpoint (e.g. "gemini:gemini-2.5-flash")."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def _record(breaker: CircuitBreaker | None, error_class: str | None):
+    if breaker is None:
+        return
+    if error_class is None:
+        breaker.record_success()
+    elif error_class in _BREAKER_ERRORS:
+        breaker.record_failure()
+    else:
+        breaker.release_probe()
+
+
+def _next_delay(
+    exc: BaseException,
+    attempt: int,
+    started: float,
+    deadline: float,
+    policies: dict[str, RetryPolicy],
+    label: str,
+) -> float | None:
+    """Delay before the next attempt, or None if the error should be raised."""
+    error_class = classify_error(exc)
+    policy = policies.get(error_class)
+    if policy is None or attempt >= policy.max_attempts:
+        return None
+    delay = retry_after(exc)
+    if delay is None:
+        delay = policy.delay(attempt)
+    remaining = deadline - (time.monotonic() - started)
+    if delay >= remaining:
+        log.warning("%s: giving up on %s, next retry would pass the deadline", label, error_class)
+        return None
+    log.warning(
+        "%s: %s error (attempt %d/%d), retrying in %.1fs: %s",
+        label, error_class, attempt, policy.max_attempts, delay, exc,
+    )
+    return delay
+
+
+def call_with_retry(
+    fn: Callable[[float], object],
+    breaker: CircuitBreaker | None = None,
+    deadline: float = CALL_DEADLINE,
+    timeout: float = REQUEST_TIMEOUT,
+    policies: dict[str, RetryPolicy] = RETRY_POLICIES,
+    label: str = "LLM call",
+    on_retry: Callable[[BaseException], None] | None = None,
+):
+    """Call ``fn(timeout)`` with retries until it succeeds or the deadline is spent.
+
+    *timeout* is the per-attempt request timeout; it is shortened so the last
+    attempt never outlives *deadline* (seconds for the whole call).
+    """
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            breaker.before_call()
+        remaining = deadline - (time.monotonic() - started)
+        try:
+            result = fn(max(1.0, min(timeout, remaining)))
+        except Exception as e:
+            _record(breaker, classify_error(e))
+            delay = _next_delay(e, attempt, started, deadline, policies, label)
+            if delay is None:
+                raise
+            if on_retry:
+                on_retry(e)
+            time.sleep(delay)
+            continue
+        _record(breaker, None)
+        return result
+
+
+async def acall_with_retry(
+    fn,
+    breaker: CircuitBreaker | None = None,
+    deadline: float = CALL_DEADLINE,
+    timeout: float = REQUEST_TIMEOUT,
+    policies: dict[str, RetryPolicy] = RETRY_POLICIES,
+    label: str = "LLM call",
+    on_retry: Callable[[BaseException], None] | None = None,
+):
+    """Async counterpart of call_with_retry: *fn(timeout)* returns an awaitable."""
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            breaker.before_call()
+        remaining = deadline - (time.monotonic() - started)
+        try:
+            result = await fn(max(1.0, min(timeout, remaining)))
+        except Exception as e:
+            _record(breaker, classify_error(e))
+            delay = _next_delay(e, attempt, started, deadline, policies, label)
+            if delay is None:
+                raise
+            if on_retry:
+                on_retry(e)
+            await asyncio.sleep(delay)
+            continue
+        _record(breaker, None)
+        return result
+
+
+def stream_with_retry(
+    fn: Callable[[float], Iterator],
+    breaker: CircuitBreaker | None = None,
+    deadline: float = CALL_DEADLINE,
+    timeout: float = REQUEST_TIMEOUT,
+    policies: dict[str, RetryPolicy] = RETRY_POLICIES,
+    label: str = "LLM stream",
+    on_retry: Callable[[BaseException], None] | None = None,
+) -> Iterator:
+    """Iterate ``fn(timeout)``, retrying only until the first item is produced.
+
+    Once output has been yielded a retry would duplicate it downstream, so
+    later errors are raised as is.
+    """
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            breaker.before_call()
+        remaining = deadline - (time.monotonic() - started)
+        produced = False
+        try:
+            for item in fn(max(1.0, min(timeout, remaining))):
+                if not produced:
+                    produced = True
+                    _record(breaker, None)
+                yield item
+        except Exception as e:
+            if produced:
+                raise
+            _record(breaker, classify_error(e))
+            delay = _next_delay(e, attempt, started, deadline, policies, label)
+            if delay is None:
+                raise
+            if on_retry:
+                on_retry(e)
+            time.sleep(delay)
+            continue
+        if not produced:
+            _record(breaker, None)
+        return
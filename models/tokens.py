@@ -0,0 +1,19 @@
+"""Local token estimation for preflight checks (no tokenizer download)."""
+
+from models.base import Message
+
+# Average characters per token; dialogs are mostly Russian text with LaTeX,
+# which tokenizes denser than English (~4 chars per token).
+CHARS_PER_TOKEN = 3.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for *text* (errs slightly on the high side)."""
+    if not text:
+        return 0
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def estimate_request_tokens(system_prompt: str, history: list[Message]) -> int:
+    """Rough input token count of a request, including per-message overhead."""
+    return estimate_tokens(system_prompt) + sum(estimate_tokens(m.content) + 4 for m in history)
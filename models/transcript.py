@@ -0,0 +1,115 @@
+"""Incremental dialog transcript with both agents' perspectives.
+
+The teacher sees itself as "assistant" and the student as "user"; the
+student sees the same dialog role-flipped. Both views, and each provider's
+native encoding of them, are extended on append instead of being rebuilt
+from the whole dialog every turn.
+"""
+
+import threading
+from collections.abc import Callable, Iterable, Sequence
+from typing import Any
+
+from models.base import Message
+
+PERSPECTIVES = ("teacher", "student")
+
+
+class _Entry:
+    """One dialog message, as each agent sees it."""
+
+    __slots__ = ("agent", "teacher", "student")
+
+    def __init__(self, agent: str, content: str):
+        self.agent = agent
+        own, other = Message("assistant", content), Message("user", content)
+        self.teacher = own if agent == "teacher" else other
+        self.student = other if agent == "teacher" else own
+
+
+class HistoryView(Sequence):
+    """Read-only history of one agent, fixed at the length it had when taken.
+
+    Later appends to the transcript are not visible, so a view can be handed
+    to a background request safely. Slicing returns a plain list.
+    """
+
+    __slots__ = ("_transcript", "_perspective", "_len")
+
+    def __init__(self, transcript: "Transcript", perspective: str, length: int):
+        self._transcript = transcript
+        self._perspective = perspective
+        self._len = length
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, index):
+        entries = self._transcript._entries
+        if isinstance(index, slice):
+            return [getattr(entries[i], self._perspective) for i in range(*index.indices(self._len))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("history index out of range")
+        return getattr(entries[index], self._perspective)
+
+    def encoded(self, key: str, encode: Callable[[Message], Any]) -> list:
+        """Provider-native form of this view, encoding only messages not seen before.
+
+        *key* names the encoding (e.g. the provider); *encode* maps one Message.
+        """
+        return self._transcript._encoded(self._perspective, key, encode, self._len)
+
+
+class Transcript:
+    """Append-only dialog transcript shared by both agents."""
+
+    __slots__ = ("_entries", "_cache", "_lock", "_source")
+
+    def __init__(self, messages: Iterable[dict] = ()):
+        """messages: dialog messages as stored in the session ({"agent", "content", ...})."""
+        self._entries: list[_Entry] = []
+        self._cache: dict[tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+        self._source = None
+        for msg in messages:
+            self.append(msg["agent"], msg["content"])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, agent: str, content: str):
+        self._entries.append(_Entry(agent, content))
+
+    def view(self, perspective: str) -> HistoryView:
+        """History as *perspective* ("teacher" or "student") sees it right now."""
+        if perspective not in PERSPECTIVES:
+            raise ValueError(f"Unknown perspective: {perspective}")
+        return HistoryView(self, perspective, len(self._entries))
+
+    def sync(self, messages: list[dict]) -> bool:
+        """Append messages added to *messages* since the last sync.
+
+        Returns False if *messages* is not the list this transcript follows
+        or was shortened (e.g. a new dialog); the caller should rebuild.
+        """
+        if messages is not self._source or len(messages) < len(self._entries):
+            return False
+        for msg in messages[len(self._entries):]:
+            self.append(msg["agent"], msg["content"])
+        return True
+
+    @classmethod
+    def following(cls, messages: list[dict]) -> "Transcript":
+        """Transcript of *messages* that sync() keeps up to date."""
+        transcript = cls(messages)
+        transcript._source = messages
+        return transcript
+
+    def _encoded(self, perspective: str, key: str, encode, length: int) -> list:
+        with self._lock:
+            cache = self._cache.setdefault((perspective, key), [])
+            for entry in self._entries[len(cache):length]:
+                cache.append(encode(getattr(entry, perspective)))
+            return cache[:length]
@@ -0,0 +1,12 @@
+"""LearnLM — поиск по сохранённым диалогам."""
+
+import streamlit as st
+
+from config.settings import APP_TITLE
+from ui.search import render_search_page
+from utils.session import init_session_state
+
+st.set_page_config(page_title=f"Поиск — {APP_TITLE}", layout="wide")
+
+init_session_state()
+render_search_page()
@@ -0,0 +1,64 @@
+"""Rebuilding dialogs from the append-only journal."""
+
+import json
+import random
+
+from engine.journal import Journal, restore_rng_state
+
+
+def message(i: int) -> dict:
+    return {"agent": "teacher" if i % 2 else "student", "content": f"m{i}"}
+
+
+def test_load_continues_from_the_last_turn(tmp_path):
+    journal = Journal(tmp_path / "j.jsonl", fsync=False)
+    rng = random.Random(7)
+    journal.start("d1", {"max_steps": 4}, [message(0)])
+    journal.turn("d1", 1, message(1), rng)
+    rng.random()
+    journal.turn("d1", 2, message(2), rng)
+    journal.config("d1", {"max_steps": 8})
+
+    dialog = journal.get("d1")
+    assert [m["content"] for m in dialog.messages] == ["m0", "m1", "m2"]
+    assert dialog.config == {"max_steps": 8}
+    assert dialog.finished is None
+    restored = random.Random()
+    restore_rng_state(restored, dialog.rng_state)
+    assert restored.random() == rng.random()
+
+
+def test_load_skips_a_truncated_line(tmp_path):
+    path = tmp_path / "j.jsonl"
+    journal = Journal(path, fsync=False)
+    journal.start("d1", {}, [message(0)])
+    journal.turn("d1", 1, message(1), None)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"dialog": "d1", "event": "turn", "index": 2, "message": message(2)})[:25])
+    # A restarted process appends after the cut-off line
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n")
+    journal.turn("d1", 2, message(2), None)
+    journal.finish("d1", "solved")
+
+    dialog = journal.get("d1")
+    assert [m["content"] for m in dialog.messages] == ["m0", "m1", "m2"]
+    assert dialog.solved
+
+
+def test_load_ignores_out_of_order_turns_and_restarts(tmp_path):
+    journal = Journal(tmp_path / "j.jsonl", fsync=False)
+    journal.start("d1", {}, [message(0)])
+    journal.turn("d1", 1, message(1), None)
+    journal.turn("d1", 1, {"agent": "teacher", "content": "duplicate"}, None)
+    journal.turn("d1", 3, message(3), None)  # a gap: not applied
+    journal.start("d2", {}, [])
+    journal.turn("orphan", 0, message(0), None)
+
+    dialogs = journal.load()
+    assert [m["content"] for m in dialogs["d1"].messages] == ["m0", "m1"]
+    assert dialogs["d2"].messages == []
+    assert "orphan" not in dialogs
+
+    journal.start("d1", {}, [])
+    assert journal.get("d1").messages == []
@@ -0,0 +1,65 @@
+"""FIFO admission of the provider rate limiter."""
+
+import asyncio
+import threading
+import time
+
+from models.ratelimit import RateLimiter
+
+
+def drained(**limits) -> RateLimiter:
+    limiter = RateLimiter(**limits)
+    for bucket in (limiter._requests, limiter._tokens):
+        if bucket is not None:
+            bucket.level = 0.0
+    return limiter
+
+
+def test_unlimited_admits_at_once():
+    RateLimiter().acquire(10**9)
+    asyncio.run(RateLimiter().aacquire(10**9))
+
+
+def test_small_request_does_not_overtake_a_waiting_large_one():
+    limiter = drained(tpm=6000)  # 100 tokens per second
+    admitted = []
+
+    async def caller(name: str, tokens: int, delay: float):
+        await asyncio.sleep(delay)
+        await limiter.aacquire(tokens)
+        admitted.append(name)
+
+    async def main():
+        await asyncio.gather(caller("large", 30, 0), caller("small", 1, 0.01))
+
+    asyncio.run(main())
+    assert admitted == ["large", "small"]
+
+
+def test_threads_are_admitted_in_arrival_order():
+    limiter = drained(rpm=1200)  # one request per 50 ms
+    admitted = []
+    threads = []
+    for i in range(4):
+        thread = threading.Thread(target=lambda i=i: (limiter.acquire(), admitted.append(i)))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)  # all four are in line before the first is admitted
+    for thread in threads:
+        thread.join(5)
+    assert admitted == [0, 1, 2, 3]
+
+
+def test_cancelled_waiter_leaves_the_line():
+    limiter = drained(tpm=6000)
+
+    async def main():
+        blocked = asyncio.create_task(limiter.aacquire(6000))  # a minute's worth
+        await asyncio.sleep(0.05)
+        behind = asyncio.create_task(limiter.aacquire(5))
+        await asyncio.sleep(0.05)
+        blocked.cancel()
+        await asyncio.wait_for(behind, 1)
+        assert not limiter._queue
+
+    asyncio.run(main())
@@ -0,0 +1,27 @@
+"""Hiding the [SOLVED] marker from streamed text."""
+
+import pytest
+
+from engine.dialog import SOLVED_MARKER, streamed_text
+
+
+@pytest.mark.parametrize("text, shown", [
+    ("Верно!", "Верно!"),
+    (f"Верно! {SOLVED_MARKER}", "Верно! "),
+    ("Верно! [SOL", "Верно! "),  # may still become the marker
+    ("Ответ [12", "Ответ [12"),
+    ("Ответ [", "Ответ "),
+    (f"{SOLVED_MARKER} и ещё", " и ещё"),
+])
+def test_streamed_text(text, shown):
+    assert streamed_text(text) == shown
+
+
+def test_shown_text_only_grows_chunk_by_chunk():
+    text, previous = "", ""
+    for chunk in ["Задача решена. ", "[", "SOL", "VED", "]", " Ещё [1", "2]?"]:
+        text += chunk
+        shown = streamed_text(text)
+        assert shown.startswith(previous)
+        previous = shown
+    assert previous == "Задача решена.  Ещё [12]?"
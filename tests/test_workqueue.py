@@ -0,0 +1,104 @@
+"""Leases of the shard job queue: claim, heartbeat, expiry and attempts."""
+
+import json
+
+import pytest
+
+from engine.shard import _LeasedJournal
+from engine.workqueue import LeaseLost, WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db", max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def expire(queue: WorkQueue, job_id: str):
+    queue._db.execute("UPDATE jobs SET lease_until = 0 WHERE id = ?", (job_id,))
+
+
+def test_put_ignores_queued_ids(queue):
+    assert queue.put({"a": {"n": 1}, "b": {"n": 2}}) == 2
+    assert queue.put({"a": {"n": 3}, "c": {"n": 4}}) == 1
+    assert queue.counts() == {"pending": 3, "leased": 0, "done": 0, "failed": 0}
+
+
+def test_claim_in_order_until_empty(queue):
+    queue.put({"a": {"n": 1}, "b": {"n": 2}})
+    assert queue.claim("w1") == ("a", {"n": 1})
+    assert queue.claim("w2") == ("b", {"n": 2})
+    assert queue.claim("w3") is None
+    assert queue.counts()["leased"] == 2
+
+
+def test_heartbeat_keeps_a_lease_from_expiring(queue):
+    queue.put({"a": {}})
+    queue.claim("w1", lease=60)
+    assert queue.heartbeat("w1", ["a"], lease=60) == {"a"}
+    assert queue.claim("w2") is None
+    assert queue.holds("a", "w1", margin=30)
+    assert not queue.holds("a", "w2")
+
+
+def test_expired_lease_goes_to_another_worker(queue):
+    queue.put({"a": {}})
+    queue.claim("w1")
+    expire(queue, "a")
+    assert queue.claim("w2")[0] == "a"
+    # The first worker learns about it from its heartbeat and cannot complete
+    assert queue.heartbeat("w1", ["a"]) == set()
+    assert not queue.holds("a", "w1")
+    assert not queue.complete("a", "w1")
+    assert queue.complete("a", "w2")
+    assert queue.counts()["done"] == 1
+
+
+def test_expired_lease_out_of_attempts_fails(queue):
+    queue.put({"a": {}})
+    for worker in ("w1", "w2"):
+        assert queue.claim(worker)[0] == "a"
+        expire(queue, "a")
+    assert queue.claim("w3") is None
+    assert queue.failures() == [("a", "lease expired")]
+
+
+def test_fail_gives_the_job_back_until_out_of_attempts(queue):
+    queue.put({"a": {}})
+    queue.claim("w1")
+    queue.fail("a", "w1", "boom")
+    assert queue.counts()["pending"] == 1
+    queue.claim("w1")
+    queue.fail("a", "w1", "boom again")
+    assert queue.failures() == [("a", "boom again")]
+    assert queue.retry_failed() == 1
+    assert queue.claim("w1")[0] == "a"
+
+
+def test_holds_needs_the_margin(queue):
+    queue.put({"a": {}})
+    queue.claim("w1", lease=10)
+    assert queue.holds("a", "w1", margin=5)
+    assert not queue.holds("a", "w1", margin=20)
+
+
+def test_leased_journal_stops_after_takeover(queue, tmp_path):
+    queue.put({"a": {}})
+    queue.claim("w1", lease=60)
+    journal = _LeasedJournal(tmp_path / "a.jsonl", queue, "a", "w1", lease=60)
+    journal.start("a", {}, [])
+    expire(queue, "a")
+    queue.claim("w2")
+    with pytest.raises(LeaseLost):
+        journal.turn("a", 0, {"agent": "student", "content": "x"}, None)
+    lines = (tmp_path / "a.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["event"] for line in lines] == ["start"]
+
+
+def test_leased_journal_renews_a_short_lease(queue, tmp_path):
+    queue.put({"a": {}})
+    queue.claim("w1", lease=1)
+    journal = _LeasedJournal(tmp_path / "a.jsonl", queue, "a", "w1", lease=60)
+    journal.start("a", {}, [])
+    assert queue.holds("a", "w1", margin=30)
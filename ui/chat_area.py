@@ -63,18 +63,18 @@ CHAT_CSS = """
 """
 
 
-def render_chat():
-    """Render the conversation messages with Telegram-style bubbles."""
+def render_messages(messages: list[dict], highlight: int | None = None):
+    """Render dialog messages as chat bubbles; *highlight* marks one message by index."""
     st.markdown(CHAT_CSS, unsafe_allow_html=True)
 
-    for msg in st.session_state.messages:
+    for i, msg in enumerate(messages):
         if msg["agent"] == "teacher":
             with st.chat_message("assistant", avatar=TEACHER_AVATAR):
                 st.markdown('<div class="chat-teacher"></div>', unsafe_allow_html=True)
                 if msg.get("reasoning") and st.session_state.get("teacher_show_reasoning", True):
                     with st.expander("💭 Рассуждения модели"):
                         st.markdown(msg["reasoning"])
-                st.markdown(msg["content"])
+                st.markdown(f"🔎 {msg['content']}" if i == highlight else msg["content"])
         else:
             with st.chat_message("user", avatar=STUDENT_AVATAR):
                 st.markdown('<div class="chat-student"></div>', unsafe_allow_html=True)
@@ -83,7 +83,12 @@ def render_chat():
                 if msg.get("reasoning") and st.session_state.get("student_show_reasoning", True):
                     with st.expander("💭 Рассуждения модели"):
                         st.markdown(msg["reasoning"])
-                st.markdown(msg["content"])
+                st.markdown(f"🔎 {msg['content']}" if i == highlight else msg["content"])
+
+
+def render_chat():
+    """Render the conversation messages with Telegram-style bubbles."""
+    render_messages(st.session_state.messages)
 
     if st.session_state.messages:
         st.caption(f"Шагов: {st.session_state.step_count}")
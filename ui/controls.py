@@ -1,18 +1,25 @@
 """Control buttons and dialog loop logic."""
 
 import json
+import logging
+import sqlite3
 import time
+import uuid
+from collections.abc import Iterator
 
 import streamlit as st
 
-from agents.student import StudentAgent
-from agents.teacher import TeacherAgent
-from config.defaults import AVAILABLE_MODELS, TEACHER_GREETING
 from config.scenarios import TASK_SCENARIOS, TOPIC_SCENARIOS
-from config.settings import MAX_DIALOG_STEPS, STUDENT_AVATAR, TEACHER_AVATAR
-from models.base import Message
-from models.gemini_provider import GeminiProvider
-from models.openai_compat import OpenAICompatProvider
+from config.settings import STORE_AUTOSAVE, STUDENT_AVATAR, TEACHER_AVATAR
+from engine import ConfigError, DialogEngine, EngineConfig
+from engine.dialog import SOLVED_MARKER, streamed_text
+from engine.journal import dialog_journal
+from models.base import LLMResponse, StreamChunk, collect_stream
+from ui import prefetch
+from utils.export import dialog_record
+from utils.store import get_store
+
+log = logging.getLogger(__name__)
 
 
 def _stream_text(text, chunk_size=3, delay=0.015):
@@ -22,87 +29,113 @@ def _stream_text(text, chunk_size=3, delay=0.015):
         time.sleep(delay)
 
 
-def _create_provider(prefix: str):
-    """Create LLM provider based on current session settings."""
-    model_name = st.session_state[f"{prefix}_model"]
-    model_cfg = AVAILABLE_MODELS[model_name]
-
-    if model_cfg["provider"] == "gemini":
-        api_key = st.session_state.gemini_api_key
-        if not api_key:
-            st.error("Gemini API Key не задан!")
-            return None
-        return GeminiProvider(
-            api_key=api_key,
-            model_id=model_cfg["model_id"],
-            thinking_level=st.session_state.get(f"{prefix}_thinking_level"),
-        )
+def _render_stream(
+    chunks: Iterator[StreamChunk],
+    show_reasoning: bool,
+    spinner_text: str,
+    hide_marker: str | None = None,
+) -> LLMResponse:
+    """Render streamed chunks live inside the current chat bubble.
+
+    Reasoning fills an expander above the text as thoughts arrive; the spinner
+    is shown only until the first chunk. *hide_marker* is stripped from the
+    displayed text, also while only its start has arrived (the returned
+    text keeps it).
+    """
+    reasoning_slot = st.empty()
+    text_slot = st.empty()
+    reasoning_box = None
+    text, reasoning = "", ""
+    started = time.monotonic()
+
+    def render(chunk: StreamChunk):
+        nonlocal text, reasoning, reasoning_box
+        if chunk.reasoning:
+            reasoning += chunk.reasoning
+            if show_reasoning:
+                if reasoning_box is None:
+                    expander = reasoning_slot.container().expander("💭 Рассуждения модели")
+                    reasoning_box = expander.empty()
+                reasoning_box.markdown(reasoning)
+        if chunk.text:
+            text += chunk.text
+            shown = streamed_text(text, hide_marker) if hide_marker else text
+            text_slot.markdown(shown + "▌")
+
+    with st.spinner(spinner_text):
+        first = next(chunks, None)
+    if first is None:
+        return LLMResponse(text="", latency=time.monotonic() - started)
+    response = collect_stream(_prepend(first, chunks), started, render)
+    text_slot.markdown(response.text.replace(hide_marker, "").strip() if hide_marker else response.text)
+    return response
+
+
+def _prepend(first, rest: Iterator):
+    """Yield *first* and then everything from *rest*."""
+    yield first
+    yield from rest
+
+
+def _engine() -> DialogEngine:
+    """The session's dialog engine, following st.session_state.messages.
+
+    The config is refreshed from the sidebar on every rerun; a new message
+    list (cleared or loaded dialog) gets a new engine.
+    """
+    config = EngineConfig.from_mapping(st.session_state)
+    config.first_input = _get_first_student_input()
+    engine = st.session_state.get("engine")
+    if engine is None or engine.messages is not st.session_state.messages:
+        dialog_id = uuid.uuid4().hex
+        journal = dialog_journal(dialog_id)
+        engine = DialogEngine(config, st.session_state.messages, journal=journal, dialog_id=dialog_id)
+        st.session_state.engine = engine
+        if journal is not None:
+            st.query_params["dialog"] = dialog_id  # survives a browser reload
     else:
-        api_key = st.session_state.yandex_api_key
-        folder_id = st.session_state.yandex_folder_id
-        if not api_key or not folder_id:
-            st.error("Yandex API Key и Folder ID должны быть заданы!")
-            return None
-        return OpenAICompatProvider(
-            api_key=api_key,
-            folder_id=folder_id,
-            model_id=model_cfg["model_id"],
-            reasoning_effort=st.session_state.get(f"{prefix}_reasoning_effort"),
-        )
-
-
-def _get_teacher_history() -> list[Message]:
-    """Build history from teacher's perspective: teacher=assistant, student=user."""
-    history = []
-    for msg in st.session_state.messages:
-        if msg["agent"] == "teacher":
-            history.append(Message(role="assistant", content=msg["content"]))
-        else:
-            history.append(Message(role="user", content=msg["content"]))
-    return history
+        engine.config = config
+    return engine
 
 
-def _get_student_history() -> list[Message]:
-    """Build history from student's perspective: student=assistant, teacher=user (flipped)."""
-    history = []
-    for msg in st.session_state.messages:
-        if msg["agent"] == "teacher":
-            history.append(Message(role="user", content=msg["content"]))
-        else:
-            history.append(Message(role="assistant", content=msg["content"]))
-    return history
+def restore_dialog():
+    """Bring back the dialog named in the URL (?dialog=…) after a browser reload.
 
+    Settings and messages come from the dialog's journal; the dialog
+    continues from its last completed turn.
+    """
+    dialog_id = st.query_params.get("dialog")
+    if not dialog_id or st.session_state.get("engine") is not None:
+        return
+    journal = dialog_journal(dialog_id)
+    dialog = journal.get(dialog_id) if journal else None
+    if dialog is None:
+        del st.query_params["dialog"]
+        return
+    for key, value in dialog.config.items():
+        st.session_state[key] = value
+    st.session_state.messages = dialog.messages
+    engine = DialogEngine.resume(dialog, EngineConfig.from_mapping(st.session_state), journal=journal)
+    st.session_state.engine = engine
+    st.session_state.step_count = engine.step_count
+    st.toast("Диалог восстановлен", icon="↩️")
 
-def validate_config() -> bool:
-    """Validate intent weights and API keys."""
-    if st.session_state.get("intent_mode") == "llm":
-        bad = [
-            sid for sid, w in st.session_state.situation_weights.items()
-            if sum(w.values()) != 100
-        ]
-        if bad:
-            st.error(f"Сумма весов ≠ 100 для ситуаций: {', '.join(bad)}")
-            return False
-    else:
-        total = sum(st.session_state.intent_weights.values())
-        if total != 100:
-            st.error(f"Сумма вероятностей интентов = {total}% (должна быть 100%)")
-            return False
 
-    teacher_model = AVAILABLE_MODELS[st.session_state.teacher_model]
-    student_model = AVAILABLE_MODELS[st.session_state.student_model]
+def _prepare(engine: DialogEngine, agent: str):
+    """engine.prepare() with config errors shown in the UI (None on error)."""
+    try:
+        return engine.prepare(agent)
+    except ConfigError as e:
+        st.error(str(e))
+        return None
 
-    if teacher_model["provider"] == "gemini" or student_model["provider"] == "gemini":
-        if not st.session_state.gemini_api_key:
-            st.error("Gemini API Key не задан!")
-            return False
 
-    if teacher_model["provider"] == "yandex" or student_model["provider"] == "yandex":
-        if not st.session_state.yandex_api_key or not st.session_state.yandex_folder_id:
-            st.error("Yandex API Key и Folder ID должны быть заданы!")
-            return False
-
-    return True
+def validate_config() -> bool:
+    """Validate intent weights and API keys."""
+    errors = EngineConfig.from_mapping(st.session_state).validate()
+    for error in errors:
+        st.error(error)
+    return not errors
 
 
 def _show_api_error(agent_name: str, error: Exception):
@@ -116,109 +149,83 @@ def _show_api_error(agent_name: str, error: Exception):
     )
 
 
-def _stream_teacher_turn() -> bool:
-    """Generate and stream one teacher message."""
-    provider = _create_provider("teacher")
-    if not provider:
-        return False
-
-    teacher = TeacherAgent(provider, st.session_state.teacher_prompt)
+def _stream_teacher_turn(
+    engine: DialogEngine, prepared: prefetch.PreparedTurn | None = None
+) -> bool:
+    """Generate and stream one teacher message (or show a prefetched one)."""
+    if prepared is None:
+        call = _prepare(engine, "teacher")
+        if call is None:
+            return False
+        teacher, open_turn = call
+    else:
+        teacher = prepared.agent_obj
 
     try:
-        with st.spinner("\U0001f468\u200d\U0001f3eb Репетитор думает..."):
-            llm_response = teacher.generate(
-                history=_get_teacher_history(),
-                temperature=st.session_state.temperature,
-                max_tokens=st.session_state.max_tokens,
+        with st.chat_message("assistant", avatar=TEACHER_AVATAR):
+            chunks, _ = prepared.result() if prepared else open_turn()
+            llm_response = _render_stream(
+                chunks,
+                show_reasoning=st.session_state.get("teacher_show_reasoning", True),
+                spinner_text="\U0001f468\u200d\U0001f3eb Репетитор думает...",
+                hide_marker=SOLVED_MARKER,
             )
     except Exception as e:
         _show_api_error("Репетитор", e)
         return False
 
-    response = llm_response.text
-    reasoning = llm_response.reasoning
-
-    # Detect [SOLVED] marker and strip it before display
-    solved = "[SOLVED]" in response
-    if solved:
-        response = response.replace("[SOLVED]", "").strip()
-
-    with st.chat_message("assistant", avatar=TEACHER_AVATAR):
-        if reasoning and st.session_state.get("teacher_show_reasoning", True):
-            with st.expander("💭 Рассуждения модели"):
-                st.markdown(reasoning)
-        st.write_stream(_stream_text(response))
-
-    st.session_state.messages.append({
-        "agent": "teacher",
-        "content": response,
-        "reasoning": reasoning,
-        "intent_id": None,
-    })
-
-    # Increment step count after teacher responds to student (not initial greeting)
-    if len(st.session_state.messages) > 1:
-        st.session_state.step_count += 1
+    engine.complete("teacher", teacher, llm_response, prefetched=prepared is not None)
+    st.session_state.step_count = engine.step_count
 
-    if solved:
+    if engine.solved:
         st.session_state.running = False
         st.success("Задача решена! Сессия завершена.")
 
     return True
 
 
-def _stream_student_turn() -> bool:
-    """Generate and stream one student message with intent."""
-    provider = _create_provider("student")
-    if not provider:
-        return False
-
-    student = StudentAgent(provider, st.session_state.student_prompt)
-
-    intent_mode = st.session_state.get("intent_mode", "random")
-    llm_kwargs = {}
-    if intent_mode == "llm":
-        llm_kwargs = {
-            "intent_mode": "llm",
-            "situation_weights": st.session_state.situation_weights,
-            "classifier_template": st.session_state.get("classifier_prompt", ""),
-        }
+def _stream_student_turn(
+    engine: DialogEngine, prepared: prefetch.PreparedTurn | None = None
+) -> bool:
+    """Generate and stream one student message with intent (or show a prefetched one)."""
+    if prepared is None:
+        call = _prepare(engine, "student")
+        if call is None:
+            return False
+        student, open_turn = call
+    else:
+        student = prepared.agent_obj
 
     try:
-        with st.spinner("\U0001f392 Ученик думает..."):
-            llm_response, intent_id = student.generate(
-                history=_get_student_history(),
-                intent_weights=st.session_state.intent_weights,
-                intent_prompts=st.session_state.intent_prompts,
-                temperature=st.session_state.temperature,
-                max_tokens=st.session_state.max_tokens,
-                correct_answer_prob=st.session_state.get("correct_answer_prob", 50),
-                mistake_weights=st.session_state.get("mistake_weights"),
-                **llm_kwargs,
+        with st.chat_message("user", avatar=STUDENT_AVATAR):
+            with st.spinner("\U0001f392 Ученик думает..."):
+                chunks, intent_id = prepared.result() if prepared else open_turn()
+            st.caption(f"Намерение: **{intent_id}**")
+            llm_response = _render_stream(
+                chunks,
+                show_reasoning=st.session_state.get("student_show_reasoning", True),
+                spinner_text="\U0001f392 Ученик печатает...",
             )
     except Exception as e:
         _show_api_error("Ученик", e)
         return False
 
-    response = llm_response.text
-    reasoning = llm_response.reasoning
-
-    with st.chat_message("user", avatar=STUDENT_AVATAR):
-        st.caption(f"Намерение: **{intent_id}**")
-        if reasoning and st.session_state.get("student_show_reasoning", True):
-            with st.expander("💭 Рассуждения модели"):
-                st.markdown(reasoning)
-        st.write_stream(_stream_text(response))
-
-    st.session_state.messages.append({
-        "agent": "student",
-        "content": response,
-        "reasoning": reasoning,
-        "intent_id": intent_id,
-    })
+    engine.complete("student", student, llm_response, intent_id, prefetched=prepared is not None)
     return True
 
 
+def _prefetch_next_turn(engine: DialogEngine):
+    """Start the opposing agent's request while this message is being shown."""
+    if engine.finished:
+        return
+    agent = engine.next_agent()
+    try:
+        call = engine.prepare(agent)
+    except ConfigError:
+        return  # reported when the turn runs
+    prefetch.start(agent, *call)
+
+
 def _get_first_student_input() -> str | None:
     """Resolve the first student input from scenario selector or custom text."""
     cat = st.session_state.get("scenario_cat", "Свой ввод")
@@ -233,34 +240,46 @@ def _get_first_student_input() -> str | None:
         return custom if custom else None
 
 
-def _inject_student_input(text: str):
+def _inject_student_input(engine: DialogEngine, text: str):
     """Display and record a pre-made / custom student message."""
     with st.chat_message("user", avatar=STUDENT_AVATAR):
         st.write_stream(_stream_text(text))
-
-    st.session_state.messages.append({
-        "agent": "student",
-        "content": text,
-        "intent_id": None,
-    })
+    engine.inject(text)
 
 
-def export_dialog() -> str:
-    """Export dialog as JSON string."""
-    data = {
-        "config": {
+def current_record() -> dict:
+    """The current dialog as a corpus record (see utils.export)."""
+    engine = st.session_state.get("engine")
+    return dialog_record(
+        st.session_state.messages,
+        {
             "teacher_model": st.session_state.teacher_model,
             "student_type": st.session_state.student_type,
             "student_model": st.session_state.student_model,
             "temperature": st.session_state.temperature,
             "max_tokens": st.session_state.max_tokens,
+            "intent_mode": st.session_state.intent_mode,
             "intent_probabilities": st.session_state.intent_weights,
+            "classifier_model": st.session_state.get("classifier_model"),
         },
-        "messages": st.session_state.messages,
-    }
-    return json.dumps(data, ensure_ascii=False, indent=2)
+        engine.id if engine is not None and engine.messages is st.session_state.messages else None,
+        solved=engine.solved if engine is not None else None,
+    )
+
+
+def export_dialog() -> str:
+    """Export dialog as JSON string."""
+    return json.dumps(current_record(), ensure_ascii=False, indent=2)
 
 
+def save_to_store() -> bool:
+    """Save the current dialog to the local store. Returns True on success."""
+    try:
+        get_store().save(current_record(), source="ui")
+        return True
+    except sqlite3.Error as e:
+        log.error("Failed to save the dialog to the store: %s", e)
+        return False
 
 
 def execute_turn():
@@ -270,31 +289,35 @@ def execute_turn():
         return
 
     st.session_state.one_step_pending = False
+    engine = _engine()
 
-    if st.session_state.step_count >= MAX_DIALOG_STEPS:
+    if engine.step_count >= engine.config.max_steps:
         st.session_state.running = False
-        st.warning(f"Достигнут лимит в {MAX_DIALOG_STEPS} шагов.")
+        st.warning(f"Достигнут лимит в {engine.config.max_steps} шагов.")
         return
 
-    messages = st.session_state.messages
-
-    if messages[-1]["agent"] == "teacher":
+    if engine.next_agent() == "student":
         # After teacher's greeting, inject pre-selected input instead of AI student
-        if len(messages) == 1:
-            first_input = _get_first_student_input()
-            if first_input:
-                _inject_student_input(first_input)
-                ok = True
-            else:
-                ok = _stream_student_turn()
+        first_input = engine.pending_input()
+        if first_input:
+            _inject_student_input(engine, first_input)
+            ok = True
+        elif len(engine.messages) == 1:
+            ok = _stream_student_turn(engine)
         else:
-            ok = _stream_student_turn()
+            ok = _stream_student_turn(engine, prefetch.take("student"))
     else:
-        ok = _stream_teacher_turn()
+        ok = _stream_teacher_turn(engine, prefetch.take("teacher"))
 
     if not ok:
         st.session_state.running = False
         return
 
+    if engine.finished and STORE_AUTOSAVE:
+        save_to_store()
+
+    if st.session_state.running:
+        _prefetch_next_turn(engine)
+
     time.sleep(0.3)
     st.rerun()
@@ -0,0 +1,114 @@
+"""Background prefetch of the next agent's turn.
+
+In autorun, as soon as a message is final the opposing agent's request
+(including intent selection for the student) is started on a worker
+thread; the next rerun picks the buffered stream up instead of starting
+the call from scratch, so display time overlaps network time.
+
+A prefetched turn is used only if nothing it depends on has changed since
+it was started (dialog and the agent's settings, see turn_signature).
+"""
+
+import hashlib
+import json
+import logging
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import streamlit as st
+
+from agents.speculative import BufferedStream
+from models.base import StreamChunk
+
+log = logging.getLogger(__name__)
+
+# Session settings each agent's request depends on
+_SETTINGS = {
+    "teacher": [
+        "teacher_model", "teacher_thinking_level", "teacher_reasoning_effort",
+        "teacher_prompt", "temperature", "max_tokens", "teacher_context_tokens",
+        "gemini_api_key", "yandex_api_key", "yandex_folder_id",
+    ],
+    "student": [
+        "student_model", "student_thinking_level", "student_reasoning_effort",
+        "student_prompt", "temperature", "max_tokens", "student_context_tokens",
+        "gemini_api_key", "yandex_api_key", "yandex_folder_id",
+        "intent_mode", "intent_weights", "intent_prompts", "situation_weights",
+        "classifier_prompt", "classifier_model", "local_classifier", "speculative_k",
+        "correct_answer_prob", "mistake_weights",
+    ],
+}
+
+# Shared by all sessions; each session has at most one prefetch in flight
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="prefetch")
+
+
+@dataclass
+class PreparedTurn:
+    agent: str  # "teacher" or "student"
+    signature: str
+    agent_obj: object  # the agent instance; fills its attributes while running
+    future: Future  # -> (BufferedStream, intent_id or None)
+
+    def result(self) -> tuple[Iterator[StreamChunk], str | None]:
+        """Block until the turn has started; returns (chunks, intent_id)."""
+        stream, intent_id = self.future.result()
+        return stream.chunks(), intent_id
+
+    def cancel(self):
+        if not self.future.cancel():
+            self.future.add_done_callback(_cancel_stream)
+
+
+def _cancel_stream(future: Future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[0].cancel()
+
+
+def turn_signature(agent: str) -> str:
+    """Hash of everything the agent's next request depends on."""
+    state = {key: st.session_state.get(key) for key in _SETTINGS[agent]}
+    state["messages"] = [(m["agent"], m["content"]) for m in st.session_state.messages]
+    payload = json.dumps(state, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def start(
+    agent: str,
+    agent_obj: object,
+    open_turn: Callable[[], tuple[Iterator[StreamChunk], str | None]],
+):
+    """Start the next turn in the background (replaces any pending prefetch).
+
+    *open_turn* runs on a worker thread and must not touch st.session_state.
+    """
+    cancel()
+
+    def run():
+        chunks, intent_id = open_turn()
+        return BufferedStream(lambda: chunks), intent_id
+
+    st.session_state.prefetch = PreparedTurn(
+        agent, turn_signature(agent), agent_obj, _executor.submit(run)
+    )
+    log.info("Prefetching %s turn", agent)
+
+
+def take(agent: str) -> PreparedTurn | None:
+    """Pop the pending prefetch if it is for *agent* and still valid."""
+    prepared = st.session_state.pop("prefetch", None)
+    if prepared is None:
+        return None
+    if prepared.agent == agent and prepared.signature == turn_signature(agent):
+        return prepared
+    log.info("Discarding stale %s prefetch", prepared.agent)
+    prepared.cancel()
+    return None
+
+
+def cancel():
+    """Cancel the pending prefetch, if any."""
+    prepared = st.session_state.pop("prefetch", None)
+    if prepared is not None:
+        prepared.cancel()
@@ -0,0 +1,162 @@
+"""Search page: browse and search dialogs in the local store."""
+
+import json
+import sqlite3
+from datetime import datetime, time as dtime, timedelta
+
+import streamlit as st
+
+from config.defaults import INTENTS, MISTAKE_TYPES, SITUATIONS, STUDENT_TYPES
+from ui import prefetch
+from ui.chat_area import render_messages
+from utils.store import DialogQuery, get_store
+
+_ANY = "—"
+_AGENTS = {"Все": None, "Репетитор": "teacher", "Ученик": "student"}
+_SOLVED = {"Все": None, "Решена": True, "Не решена": False}
+
+
+def _select(label: str, options: dict[str, str], key: str) -> str | None:
+    """Selectbox over {id: name}; returns the id or None for "any"."""
+    choice = st.selectbox(
+        label,
+        [_ANY, *options],
+        format_func=lambda v: options.get(v, v),
+        key=key,
+    )
+    return None if choice == _ANY else choice
+
+
+def _query() -> DialogQuery:
+    store = get_store()
+    text = st.text_input(
+        "Текст реплики",
+        placeholder='дроб*   "общий знаменатель"   ошибк* NOT верно',
+        help="Полнотекстовый поиск FTS5: `слово*` — по началу слова, кавычки — точная фраза, AND / OR / NOT.",
+        key="search_text",
+    )
+    c1, c2, c3, c4 = st.columns(4)
+    with c1:
+        agent = _AGENTS[st.radio("Чья реплика", list(_AGENTS), horizontal=True, key="search_agent")]
+        intent = _select("Намерение ученика", {i["id"]: i["name"] for i in INTENTS}, "search_intent")
+    with c2:
+        situation = _select("Ситуация (ход репетитора)", {s["id"]: s["name"] for s in SITUATIONS}, "search_situation")
+        mistake = _select("Тип ошибки", {m["id"]: m["name"] for m in MISTAKE_TYPES}, "search_mistake")
+    with c3:
+        teacher_model = _select("Модель репетитора", {m: m for m in store.values("teacher_model")}, "search_teacher")
+        student_model = _select("Модель ученика", {m: m for m in store.values("student_model")}, "search_student")
+    with c4:
+        student_type = _select("Тип ученика", {t: t for t in STUDENT_TYPES}, "search_type")
+        solved = _SOLVED[st.radio("Задача", list(_SOLVED), horizontal=True, key="search_solved")]
+
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        dates = st.date_input("Период", value=(), key="search_dates")
+    with c2:
+        limit = st.number_input("Не больше", min_value=10, max_value=1000, value=100, step=50, key="search_limit")
+
+    since = until = None
+    if len(dates) >= 1:
+        since = datetime.combine(dates[0], dtime()).timestamp()
+    if len(dates) == 2:
+        until = datetime.combine(dates[1] + timedelta(days=1), dtime()).timestamp()
+
+    return DialogQuery(
+        text=text.strip() or None,
+        agent=agent,
+        intent=intent,
+        situation=situation,
+        mistake=mistake,
+        teacher_model=teacher_model,
+        student_model=student_model,
+        student_type=student_type,
+        solved=solved,
+        since=since,
+        until=until,
+        limit=int(limit),
+    )
+
+
+def _open_in_simulator(record: dict):
+    prefetch.cancel()
+    st.session_state.messages = [
+        {k: v for k, v in msg.items() if v is not None} for msg in record["messages"]
+    ]
+    st.session_state.step_count = record["steps"]
+    st.session_state.running = False
+    st.session_state.one_step_pending = False
+    st.switch_page("app.py")
+
+
+def _render_dialog(row: dict):
+    dialog_id = row["id"]
+    record = get_store().get(dialog_id)
+    if record is None:
+        st.warning("Диалог не найден.")
+        return
+    st.subheader(f"Диалог {dialog_id}")
+    st.caption(
+        f"{row['student_type'] or '?'} ученик · {row['teacher_model'] or '?'} / "
+        f"{row['student_model'] or '?'} · шагов: {row['steps']}"
+        + (" · задача решена" if row["solved"] else "")
+    )
+    c1, c2 = st.columns(2)
+    with c1:
+        if st.button("▶️ Открыть в симуляторе", key="search_open", use_container_width=True):
+            _open_in_simulator(record)
+    with c2:
+        st.download_button(
+            "\U0001f4e5 JSON",
+            data=json.dumps(record, ensure_ascii=False, indent=2),
+            file_name=f"dialog-{dialog_id}.json",
+            mime="application/json",
+            key="search_export",
+            use_container_width=True,
+        )
+    render_messages(record["messages"], highlight=row.get("match_idx"))
+
+
+def render_search_page():
+    st.title("Поиск диалогов")
+    store = get_store()
+    dialogs, turns = store.count()
+    st.caption(
+        f"В базе {dialogs} диалогов, {turns} реплик. Пополнить: кнопка «🗄 В базу» в симуляторе "
+        "или `python -m utils.store import runs/…/dialogs.jsonl`."
+    )
+
+    query = _query()
+    try:
+        rows = store.search(query)
+    except sqlite3.OperationalError as e:
+        st.error(f"Ошибка в запросе: {e}")
+        return
+    if not rows:
+        st.info("Ничего не найдено.")
+        return
+
+    table = [
+        {
+            "Дата": datetime.fromtimestamp(row["created"]).strftime("%Y-%m-%d %H:%M"),
+            "Тип": row["student_type"],
+            "Репетитор": row["teacher_model"],
+            "Ученик": row["student_model"],
+            "Шагов": row["steps"],
+            "Решена": bool(row["solved"]),
+            "Реплика": row.get("match_idx"),
+            "Фрагмент": row.get("snippet") or "",
+        }
+        for row in rows
+    ]
+    st.caption(f"Найдено: {len(rows)}" + (" (показаны первые)" if len(rows) == query.limit else ""))
+    event = st.dataframe(
+        table,
+        use_container_width=True,
+        hide_index=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        key="search_results",
+    )
+    selected = event.selection.rows
+    if selected:
+        _render_dialog(rows[selected[0]])
@@ -25,11 +25,15 @@ from config.scenarios import TASK_SCENARIOS, TOPIC_SCENARIOS
 from config.settings import (
     DEFAULT_MAX_TOKENS,
     DEFAULT_TEMPERATURE,
+    MAX_CONTEXT_TOKENS,
     MAX_MAX_TOKENS,
     MAX_TEMPERATURE,
     MIN_MAX_TOKENS,
     MIN_TEMPERATURE,
 )
+from engine.config import EngineConfig
+from ui import prefetch
+from utils.usage import dialog_usage
 
 MODEL_NAMES = list(AVAILABLE_MODELS.keys())
 
@@ -47,6 +51,13 @@ INTENT_HELP = {
 }
 
 
+def _release_prompt_cache():
+    """Drop the teacher's provider-side prompt cache (new dialog or edited prompt)."""
+    engine = st.session_state.get("engine")
+    if engine is not None:
+        engine.prompt_cache.release()
+
+
 @st.dialog("Редактирование промпта", width="large")
 def _edit_prompt(state_key, sub_key, default_value, label):
     """Full-screen modal editor for any prompt."""
@@ -64,6 +75,8 @@ def _edit_prompt(state_key, sub_key, default_value, label):
                 st.session_state[state_key][sub_key] = new_val
             else:
                 st.session_state[state_key] = new_val
+            if state_key == "teacher_prompt":
+                _release_prompt_cache()
             st.rerun()
     with col2:
         if st.button("Сбросить к дефолтам", use_container_width=True):
@@ -71,6 +84,8 @@ def _edit_prompt(state_key, sub_key, default_value, label):
                 st.session_state[state_key][sub_key] = default_value
             else:
                 st.session_state[state_key] = default_value
+            if state_key == "teacher_prompt":
+                _release_prompt_cache()
             st.rerun()
 
 
@@ -178,6 +193,40 @@ def _model_options(prefix: str, default_model_key: str = "teacher_model"):
         st.session_state[f"{prefix}_reasoning_effort"] = None
 
 
+USAGE_LABELS = {
+    "teacher": "Репетитор",
+    "student": "Ученик",
+    "classifier": "Классификатор",
+    "summary": "Сжатие контекста",
+}
+
+
+def _render_usage():
+    """Per-dialog token and latency totals (from message usage)."""
+    usage = dialog_usage(st.session_state.messages)
+    total = usage["total"]
+    if not total["calls"]:
+        return
+    cached = f" (из кэша {total['cached_tokens']})" if total["cached_tokens"] else ""
+    caption = (
+        f"Токены: {total['input_tokens']} вход{cached} · {total['output_tokens']} выход · "
+        f"{total['thinking_tokens']} рассуждения | {total['calls']} вызовов, {total['latency']:.1f} с"
+    )
+    if total["retries"]:
+        caption += f", повторов: {total['retries']}"
+    st.caption(caption)
+    with st.expander("Расход по агентам", expanded=False):
+        rows = ["| | Вызовы | Вход | Выход | Рассуждения | Время, с |", "|---|---:|---:|---:|---:|---:|"]
+        for name, label in USAGE_LABELS.items():
+            u = usage[name]
+            if u["calls"]:
+                rows.append(
+                    f"| {label} | {u['calls']} | {u['input_tokens']} | {u['output_tokens']} "
+                    f"| {u['thinking_tokens']} | {u['latency']:.1f} |"
+                )
+        st.markdown("\n".join(rows))
+
+
 SCENARIO_CATEGORIES = ["Свой ввод", "Задача", "Тема"]
 
 
@@ -207,7 +256,7 @@ def render_sidebar():
         # ── Export ──────────────────────────────────────────
         if len(st.session_state.messages) > 1:
             from ui.controls import export_dialog
-            ec1, ec2 = st.columns(2)
+            ec1, ec2, ec3 = st.columns(3)
             with ec1:
                 st.download_button(
                     "\U0001f4e5 JSON",
@@ -222,6 +271,15 @@ def render_sidebar():
                     from utils.gsheets import export_to_sheets
                     if export_to_sheets():
                         st.toast("Диалог сохранён в Google Sheets!", icon="✅")
+            with ec3:
+                if st.button("🗄 В базу", key="btn_store", use_container_width=True):
+                    from ui.controls import save_to_store
+                    if save_to_store():
+                        st.toast("Диалог сохранён в базу", icon="✅")
+                    else:
+                        st.error("Не удалось сохранить диалог в базу")
+
+            _render_usage()
 
         # ── Scenario selector ──────────────────────────────
         if len(st.session_state.messages) <= 1:
@@ -343,10 +401,11 @@ def render_sidebar():
         # ── Intents ─────────────────────────────────────────
         with st.expander("Интенты", expanded=False):
             # Intent selection mode
-            INTENT_MODES = ["random", "llm"]
+            INTENT_MODES = ["random", "llm", "fused"]
             INTENT_MODE_LABELS = {
                 "random": "Случайный (по весам)",
                 "llm": "LLM-классификатор",
+                "fused": "Один вызов",
             }
             mode_idx = INTENT_MODES.index(st.session_state.intent_mode)
             chosen_mode = st.radio(
@@ -416,11 +475,48 @@ def render_sidebar():
                     )
 
             else:
-                # LLM mode — situation-based weights editor
-                st.caption(
-                    "LLM определяет тип реплики тьютора (ситуацию) и выбирает "
-                    "интент по весам для этой ситуации."
+                # LLM / fused mode — situation-based weights editor
+                if chosen_mode == "llm":
+                    st.caption(
+                        "LLM определяет тип реплики тьютора (ситуацию) и выбирает "
+                        "интент по весам для этой ситуации."
+                    )
+                else:
+                    st.caption(
+                        "Интент для каждой ситуации разыгрывается по весам заранее; "
+                        "модель ученика за один вызов определяет ситуацию и отвечает."
+                    )
+                st.session_state.local_classifier = st.toggle(
+                    "Локальный классификатор",
+                    value=st.session_state.local_classifier,
+                    key="toggle_local_classifier",
+                    help="Правила и локальная модель определяют ситуацию за миллисекунды; "
+                    "LLM вызывается только при низкой уверенности.",
                 )
+                if chosen_mode == "llm":
+                    classifier_labels = ["Как у ученика"] + MODEL_NAMES
+                    current = st.session_state.classifier_model
+                    chosen = st.selectbox(
+                        "Модель классификатора",
+                        classifier_labels,
+                        index=classifier_labels.index(current) if current in MODEL_NAMES else 0,
+                        key="classifier_model_select",
+                        help="Классификатор отвечает одним словом: быстрая модель без "
+                        "рассуждений и с коротким таймаутом заметно ускоряет ход ученика.",
+                    )
+                    st.session_state.classifier_model = None if chosen == "Как у ученика" else chosen
+                    if chosen != "Как у ученика" and EngineConfig.from_mapping(st.session_state).missing_keys(chosen):
+                        st.caption("Нет ключа API для этой модели — классификатор работает на модели ученика.")
+                    st.session_state.speculative_k = st.slider(
+                        "Спекулятивная генерация",
+                        min_value=0,
+                        max_value=4,
+                        value=st.session_state.speculative_k,
+                        key="slider_speculative_k",
+                        help="Пока работает классификатор, ответы ученика генерируются "
+                        "для k самых вероятных интентов; лишние отменяются. "
+                        "Быстрее, но дороже по токенам. 0 — выключено.",
+                    )
                 if st.button("✏️ Промпт классификатора", key="btn_edit_classifier"):
                     _edit_prompt(
                         "classifier_prompt",
@@ -496,9 +592,32 @@ def render_sidebar():
                 step=64,
                 key="slider_tokens",
             )
+            st.caption("Окно контекста, токенов (0 — весь диалог). Старые реплики сжимаются в конспект.")
+            col_t, col_s = st.columns(2)
+            with col_t:
+                st.session_state.teacher_context_tokens = st.number_input(
+                    "Репетитор",
+                    min_value=0,
+                    max_value=MAX_CONTEXT_TOKENS,
+                    value=st.session_state.teacher_context_tokens,
+                    step=512,
+                    key="input_teacher_context",
+                )
+            with col_s:
+                st.session_state.student_context_tokens = st.number_input(
+                    "Ученик",
+                    min_value=0,
+                    max_value=MAX_CONTEXT_TOKENS,
+                    value=st.session_state.student_context_tokens,
+                    step=512,
+                    key="input_student_context",
+                )
 
         # ── Handle button clicks (AFTER all widgets rendered) ──
         if clear:
+            prefetch.cancel()
+            _release_prompt_cache()
+            st.query_params.pop("dialog", None)
             st.session_state.messages = [
                 {"agent": "teacher", "content": TEACHER_GREETING, "intent_id": None}
             ]
@@ -508,6 +627,9 @@ def render_sidebar():
             st.rerun()
 
         if reset:
+            prefetch.cancel()
+            _release_prompt_cache()
+            st.query_params.pop("dialog", None)
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             st.rerun()
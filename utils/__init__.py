@@ -1 +1,2 @@
 from utils.session import init_session_state
+from utils.usage import dialog_usage
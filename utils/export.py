@@ -0,0 +1,377 @@
+"""Streaming export of dialog corpora: JSONL shards and a Parquet turn table.
+
+    python -m utils.export runs/big/dialogs.jsonl --out export/ --compression zstd --parquet
+
+A dialog record is one JSON object per dialog ({"id", "config", "usage",
+"messages", batch runs also "job", ...}: what the batch runner, the shard merge and the
+UI's JSON export write). JsonlShards writes records one per line into
+size-rotated shards, optionally gzip- or zstd-compressed; ParquetShards
+writes one row per turn for columnar analytics. Both only ever add new
+files, so a corpus can be extended by later runs.
+
+Parquet needs pyarrow; zstd needs Python 3.14+ or the zstandard package.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import sys
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from config.settings import EXPORT_PARQUET_ROWS, EXPORT_ROW_GROUP, EXPORT_SHARD_MB
+from utils.usage import dialog_usage
+
+log = logging.getLogger(__name__)
+
+_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def dialog_record(messages: list[dict], config: dict, dialog_id: str | None = None, **extra) -> dict:
+    """A dialog as one corpus record."""
+    return {
+        "id": dialog_id or dialog_digest(messages),
+        "config": config,
+        **extra,
+        "usage": dialog_usage(messages),
+        "messages": messages,
+    }
+
+
+def dialog_digest(messages: list[dict]) -> str:
+    """Content-derived id for records that were saved without one."""
+    payload = json.dumps([(m["agent"], m["content"]) for m in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+# ─── JSONL ─────────────────────────────────────────────────────
+
+def _zstd_writer():
+    """Factory wrapping a binary file in a zstd compressor."""
+    try:
+        from compression import zstd  # Python 3.14+
+        return lambda raw: zstd.ZstdFile(raw, "wb")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd export needs Python 3.14+ or: pip install zstandard") from None
+    return lambda raw: zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+
+
+def _next_shard(out_dir: Path, prefix: str) -> int:
+    numbers = [
+        int(path.name[len(prefix) + 1:].split(".")[0])
+        for path in out_dir.glob(f"{prefix}-*")
+        if path.name[len(prefix) + 1:].split(".")[0].isdigit()
+    ]
+    return max(numbers, default=-1) + 1
+
+
+class JsonlShards:
+    """Writes records as JSON lines into PREFIX-00000.jsonl[.gz|.zst], PREFIX-00001…
+
+    A new shard starts once the current one reaches *max_bytes* on disk
+    (after compression). Existing shards are never reopened.
+    """
+
+    def __init__(
+        self,
+        out_dir: str | Path,
+        prefix: str = "dialogs",
+        compression: str | None = None,
+        max_bytes: int = EXPORT_SHARD_MB * 1024 * 1024,
+    ):
+        if compression not in _SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.out_dir = Path(out_dir)
+        self.prefix = prefix
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self._zstd = _zstd_writer() if compression == "zstd" else None
+        self.records = 0
+        self.paths: list[Path] = []
+        self._raw = self._stream = None
+        self._shard_records = 0
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+    def _open(self):
+        number = _next_shard(self.out_dir, self.prefix)
+        path = self.out_dir / f"{self.prefix}-{number:05d}.jsonl{_SUFFIXES[self.compression]}"
+        self._raw = open(path, "xb")
+        if self.compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        elif self.compression == "zstd":
+            self._stream = self._zstd(self._raw)
+        else:
+            self._stream = self._raw
+        self._shard_records = 0
+        self.paths.append(path)
+
+    def _close_shard(self):
+        if self._stream is not None and self._stream is not self._raw:
+            self._stream.close()
+        if self._raw is not None and not self._raw.closed:
+            self._raw.close()
+        self._raw = self._stream = None
+
+    def write(self, record: dict):
+        if self._raw is not None and self._shard_records and self._raw.tell() >= self.max_bytes:
+            self._close_shard()
+        if self._raw is None:
+            self._open()
+        self._stream.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._shard_records += 1
+        self.records += 1
+
+    def close(self):
+        self._close_shard()
+
+    def __enter__(self) -> "JsonlShards":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ─── Parquet ───────────────────────────────────────────────────
+
+# Turn table columns: (name, pyarrow type name)
+TURN_COLUMNS = [
+    ("dialog_id", "string"),
+    ("index", "int32"),
+    ("step", "int32"),
+    ("agent", "string"),
+    ("content", "string"),
+    ("intent_id", "string"),
+    ("situation", "string"),
+    ("situation_source", "string"),
+    ("mistake", "string"),
+    ("input_tokens", "int64"),
+    ("output_tokens", "int64"),
+    ("thinking_tokens", "int64"),
+    ("cached_tokens", "int64"),
+    ("latency", "float64"),
+    ("ttft", "float64"),
+    ("retries", "int32"),
+    ("classifier_input_tokens", "int64"),
+    ("classifier_output_tokens", "int64"),
+    ("summary_input_tokens", "int64"),
+    ("summary_output_tokens", "int64"),
+    ("prefetched", "bool"),
+    # Dialog settings, repeated per turn (dictionary-encoded in the file)
+    ("teacher_model", "string"),
+    ("student_model", "string"),
+    ("student_type", "string"),
+    ("intent_mode", "string"),
+    ("solved", "bool"),
+]
+
+
+def turn_rows(record: dict) -> Iterator[dict]:
+    """One row per message of a dialog record (TURN_COLUMNS)."""
+    settings = {**record.get("config", {}), **record.get("job", {})}
+    dialog = {
+        "dialog_id": record.get("id") or dialog_digest(record["messages"]),
+        "teacher_model": settings.get("teacher_model"),
+        "student_model": settings.get("student_model"),
+        "student_type": settings.get("student_type"),
+        "intent_mode": settings.get("intent_mode"),
+        "solved": record.get("solved"),
+    }
+    step = 0
+    for index, msg in enumerate(record["messages"]):
+        if msg["agent"] == "teacher" and index > 0:
+            step += 1
+        usage = msg.get("usage") or {}
+        classifier = msg.get("classifier_usage") or {}
+        summary = msg.get("summary_usage") or {}
+        yield {
+            **dialog,
+            "index": index,
+            "step": step,
+            "agent": msg["agent"],
+            "content": msg["content"],
+            "intent_id": msg.get("intent_id"),
+            "situation": msg.get("situation"),
+            "situation_source": msg.get("situation_source"),
+            "mistake": msg.get("mistake"),
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+            "thinking_tokens": usage.get("thinking_tokens"),
+            "cached_tokens": usage.get("cached_tokens"),
+            "latency": usage.get("latency"),
+            "ttft": usage.get("ttft"),
+            "retries": usage.get("retries"),
+            "classifier_input_tokens": classifier.get("input_tokens"),
+            "classifier_output_tokens": classifier.get("output_tokens"),
+            "summary_input_tokens": summary.get("input_tokens"),
+            "summary_output_tokens": summary.get("output_tokens"),
+            "prefetched": msg.get("prefetched"),
+        }
+
+
+class ParquetShards:
+    """Writes the turn table into PREFIX-00000.parquet, PREFIX-00001…
+
+    Rows are buffered into row groups of *row_group* turns; a new file
+    starts after *max_rows* turns. Existing files are never reopened.
+    """
+
+    def __init__(
+        self,
+        out_dir: str | Path,
+        prefix: str = "turns",
+        compression: str = "zstd",
+        max_rows: int = EXPORT_PARQUET_ROWS,
+        row_group: int = EXPORT_ROW_GROUP,
+    ):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow") from None
+        self._pa, self._pq = pa, pq
+        self.schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in TURN_COLUMNS])
+        self.out_dir = Path(out_dir)
+        self.prefix = prefix
+        self.compression = compression
+        self.max_rows = max_rows
+        self.row_group = row_group
+        self.rows = 0
+        self.paths: list[Path] = []
+        self._writer = None
+        self._file_rows = 0
+        self._buffer: list[dict] = []
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+    def write(self, record: dict):
+        """Add the turns of one dialog record."""
+        self._buffer.extend(turn_rows(record))
+        if len(self._buffer) >= self.row_group:
+            self._flush()
+
+    def _flush(self):
+        while self._buffer:
+            if self._writer is not None and self._file_rows >= self.max_rows:
+                self._writer.close()
+                self._writer = None
+            if self._writer is None:
+                number = _next_shard(self.out_dir, self.prefix)
+                path = self.out_dir / f"{self.prefix}-{number:05d}.parquet"
+                self._writer = self._pq.ParquetWriter(path, self.schema, compression=self.compression)
+                self._file_rows = 0
+                self.paths.append(path)
+            take = min(len(self._buffer), self.max_rows - self._file_rows, self.row_group)
+            batch, self._buffer = self._buffer[:take], self._buffer[take:]
+            self._writer.write_table(self._pa.Table.from_pylist(batch, schema=self.schema))
+            self._file_rows += take
+            self.rows += take
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self) -> "ParquetShards":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ─── Reading and CLI ───────────────────────────────────────────
+
+def _open_text(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.suffix == ".zst":
+        try:
+            from compression import zstd
+            return zstd.open(path, "rt", encoding="utf-8")
+        except ImportError:
+            import io
+
+            import zstandard
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")), encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def read_records(paths: Iterable[str | Path]) -> Iterator[dict]:
+    """Dialog records from JSONL corpora (plain, .gz, .zst) and single-dialog JSON exports."""
+    for path in map(Path, paths):
+        if path.suffix == ".json":
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            data.setdefault("id", dialog_digest(data["messages"]))
+            yield data
+            continue
+        with _open_text(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    log.warning("Skipping a damaged line in %s", path)
+
+
+def export_records(
+    records: Iterable[dict],
+    out_dir: str | Path,
+    jsonl: bool = True,
+    parquet: bool = False,
+    compression: str | None = None,
+    max_bytes: int = EXPORT_SHARD_MB * 1024 * 1024,
+) -> tuple[int, int]:
+    """Stream records into the chosen formats; returns (dialogs, turns)."""
+    dialogs = turns = 0
+    shards = JsonlShards(out_dir, compression=compression, max_bytes=max_bytes) if jsonl else None
+    table = ParquetShards(out_dir) if parquet else None
+    try:
+        for record in records:
+            if shards is not None:
+                shards.write(record)
+            if table is not None:
+                table.write(record)
+            dialogs += 1
+            turns += len(record["messages"])
+    finally:
+        if shards is not None:
+            shards.close()
+        if table is not None:
+            table.close()
+    return dialogs, turns
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m utils.export", description="Export dialog corpora.")
+    parser.add_argument("sources", nargs="+", help="dialogs.jsonl[.gz|.zst] corpora or dialog .json exports")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], help="JSONL shard compression")
+    parser.add_argument("--max-mb", type=int, default=EXPORT_SHARD_MB, help="JSONL shard size")
+    parser.add_argument("--parquet", action="store_true", help="also write the Parquet turn table")
+    parser.add_argument("--no-jsonl", action="store_true", help="only write Parquet")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(name)s %(levelname)s: %(message)s")
+
+    try:
+        dialogs, turns = export_records(
+            read_records(args.sources),
+            args.out,
+            jsonl=not args.no_jsonl,
+            parquet=args.parquet,
+            compression=args.compression,
+            max_bytes=args.max_mb * 1024 * 1024,
+        )
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 2
+    print(f"{dialogs} dialogs, {turns} turns exported to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
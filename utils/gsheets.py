@@ -2,11 +2,19 @@
 
 import json
 import logging
+import threading
+import time
 import uuid
+from dataclasses import dataclass, field
 from datetime import datetime
 
 import streamlit as st
 
+from utils.usage import dialog_usage
+
+HANDLE_TTL = 30 * 60  # seconds before the spreadsheet is re-opened
+_STALE_CODES = {400, 401, 403, 404}  # API errors worth a retry with fresh handles
+
 log = logging.getLogger(__name__)
 
 # Column headers for the sheet
@@ -28,46 +36,117 @@ HEADERS = [
     "num_messages",
     "dialog",
     "reasoning",
+    "input_tokens",
+    "output_tokens",
+    "thinking_tokens",
+    "latency_sec",
+    "retries",
+    "usage",
 ]
 
 
-def _get_client():
-    """Create gspread client from Streamlit secrets."""
+@dataclass
+class _Handles:
+    """Authorized spreadsheet and the worksheets already looked up in it."""
+
+    key: tuple  # (service account, spreadsheet id)
+    spreadsheet: object
+    opened: float
+    worksheets: dict = field(default_factory=dict)  # sheet name -> Worksheet
+
+
+# Shared by all sessions: opening the spreadsheet costs an auth round trip
+# and a metadata fetch, so handles are reused until HANDLE_TTL runs out or
+# a write fails with an error that points at them (see _STALE_CODES).
+_handles: _Handles | None = None
+_lock = threading.Lock()
+
+
+def _open_spreadsheet() -> _Handles | None:
+    """Cached handles for the configured spreadsheet (None if not configured)."""
+    global _handles
     try:
         creds = dict(st.secrets["gsheets"]["credentials"])
         spreadsheet_id = st.secrets["gsheets"]["spreadsheet_id"]
     except (KeyError, FileNotFoundError):
-        return None, None
+        return None
 
-    import gspread
+    key = (creds.get("client_email"), spreadsheet_id)
+    now = time.monotonic()
+    with _lock:
+        if _handles is None or _handles.key != key or now - _handles.opened > HANDLE_TTL:
+            import gspread
 
-    client = gspread.service_account_from_dict(creds)
-    spreadsheet = client.open_by_key(spreadsheet_id)
-    return client, spreadsheet
+            client = gspread.service_account_from_dict(creds)
+            _handles = _Handles(key, client.open_by_key(spreadsheet_id), now)
+            log.info("Opened spreadsheet %s", spreadsheet_id)
+        return _handles
 
 
-def _get_or_create_sheet(spreadsheet, sheet_name: str):
+def _invalidate(handles: _Handles):
+    """Forget *handles* so the next export re-authorizes and re-opens."""
+    global _handles
+    with _lock:
+        if _handles is handles:
+            _handles = None
+
+
+def _get_or_create_sheet(handles: _Handles, sheet_name: str):
     """Get existing sheet by name or create a new one with headers."""
-    try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-    except Exception:
-        worksheet = spreadsheet.add_worksheet(
-            title=sheet_name, rows=1000, cols=len(HEADERS)
-        )
-        worksheet.append_row(HEADERS)
-    return worksheet
+    from gspread.exceptions import APIError, WorksheetNotFound
+
+    with _lock:
+        worksheet = handles.worksheets.get(sheet_name)
+        if worksheet is not None:
+            return worksheet
+        spreadsheet = handles.spreadsheet
+        try:
+            worksheet = spreadsheet.worksheet(sheet_name)
+        except WorksheetNotFound:
+            try:
+                worksheet = spreadsheet.add_worksheet(
+                    title=sheet_name, rows=1000, cols=len(HEADERS)
+                )
+            except APIError:
+                # Another process created it first
+                worksheet = spreadsheet.worksheet(sheet_name)
+            else:
+                worksheet.append_row(HEADERS)
+        handles.worksheets[sheet_name] = worksheet
+        return worksheet
+
+
+def _append(sheet_name: str, row: list) -> bool:
+    """Append *row* to the day's sheet; False if Sheets is not configured.
+
+    A write rejected with an error that may come from stale handles (expired
+    credentials, sheet deleted or access revoked) is retried once with
+    freshly opened ones.
+    """
+    from google.auth.exceptions import GoogleAuthError
+    from gspread.exceptions import APIError
+
+    for attempt in range(2):
+        handles = _open_spreadsheet()
+        if handles is None:
+            return False
+        try:
+            worksheet = _get_or_create_sheet(handles, sheet_name)
+            worksheet.append_row(row, value_input_option="RAW")
+            return True
+        except (APIError, GoogleAuthError) as e:
+            if isinstance(e, APIError) and e.code not in _STALE_CODES:
+                raise
+            _invalidate(handles)
+            if attempt:
+                raise
+            log.warning("Google Sheets write failed (%s), reopening the spreadsheet", e)
 
 
 def export_to_sheets() -> bool:
     """Export current dialog as one row to Google Sheets. Returns True on success."""
-    _, spreadsheet = _get_client()
-    if spreadsheet is None:
-        st.error("Google Sheets не настроен. Проверьте секреты.")
-        return False
-
     now = datetime.now()
     sheet_name = now.strftime("%Y-%m-%d")
-    worksheet = _get_or_create_sheet(spreadsheet, sheet_name)
 
     # Collect reasoning from all messages into a separate JSON
     messages = st.session_state.get("messages", [])
@@ -87,8 +166,13 @@ def export_to_sheets() -> bool:
             "agent": msg.get("agent"),
             "content": msg.get("content", ""),
             "intent_id": msg.get("intent_id"),
+            "usage": msg.get("usage"),
+            "classifier_usage": msg.get("classifier_usage"),
         })
 
+    usage = dialog_usage(messages)
+    total = usage["total"]
+
     row = [
         str(uuid.uuid4())[:8],
         now.strftime("%Y-%m-%d %H:%M:%S"),
@@ -109,10 +193,18 @@ def export_to_sheets() -> bool:
         len(messages),
         json.dumps(dialog_clean, ensure_ascii=False),
         json.dumps(reasoning_list, ensure_ascii=False) if reasoning_list else "",
+        total["input_tokens"],
+        total["output_tokens"],
+        total["thinking_tokens"],
+        total["latency"],
+        total["retries"],
+        json.dumps(usage, ensure_ascii=False),
     ]
 
     try:
-        worksheet.append_row(row, value_input_option="RAW")
+        if not _append(sheet_name, row):
+            st.error("Google Sheets не настроен. Проверьте секреты.")
+            return False
         log.info("Dialog exported to sheet %s", sheet_name)
         return True
     except Exception as e:
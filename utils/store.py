@@ -0,0 +1,427 @@
+"""Local dialog store: SQLite with indexed turns and full-text search.
+
+    python -m utils.store import runs/big/dialogs.jsonl export/dialogs-*.jsonl.gz
+    python -m utils.store search --intent find-mistake --situation correction --text "дроб*"
+
+Dialogs and their turns are normalized into two tables; filters on the
+models, student type, date, intent and situation use indexes, and
+message text is searched through an FTS5 index. The database runs in WAL
+mode and reads go through their own connection, so the UI can search
+while an import is writing.
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+from config.settings import STORE_PATH
+from utils.export import dialog_digest, read_records, turn_rows
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialogs (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    source TEXT,
+    teacher_model TEXT,
+    student_model TEXT,
+    student_type TEXT,
+    intent_mode TEXT,
+    steps INTEGER NOT NULL,
+    solved INTEGER,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    config TEXT,  -- JSON
+    extra TEXT    -- JSON: other record fields (e.g. the batch job)
+);
+CREATE INDEX IF NOT EXISTS dialogs_teacher ON dialogs (teacher_model, created);
+CREATE INDEX IF NOT EXISTS dialogs_student ON dialogs (student_model, created);
+CREATE INDEX IF NOT EXISTS dialogs_type ON dialogs (student_type, created);
+CREATE INDEX IF NOT EXISTS dialogs_created ON dialogs (created);
+
+CREATE TABLE IF NOT EXISTS turns (
+    dialog_id TEXT NOT NULL REFERENCES dialogs (id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    agent TEXT NOT NULL,
+    content TEXT NOT NULL,
+    reasoning TEXT,
+    intent_id TEXT,
+    situation TEXT,
+    situation_source TEXT,
+    mistake TEXT,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    latency REAL,
+    UNIQUE (dialog_id, idx)
+);
+CREATE INDEX IF NOT EXISTS turns_intent ON turns (intent_id, situation);
+CREATE INDEX IF NOT EXISTS turns_situation ON turns (situation);
+CREATE INDEX IF NOT EXISTS turns_mistake ON turns (mistake);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5 (
+    content, content = 'turns', content_rowid = 'rowid', tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts (turns_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+END;
+"""
+
+# Record fields kept in their own columns; the rest go to dialogs.extra
+_COLUMN_FIELDS = ("id", "created", "config", "usage", "messages", "solved", "steps")
+
+# Matching turns up to which search groups them all instead of walking dialogs
+_RARE_TURNS = 5000
+
+
+@dataclass
+class DialogQuery:
+    """Search filters; None means "any"."""
+
+    text: str | None = None  # FTS5 query over message text
+    agent: str | None = None  # whose messages the text/turn filters apply to
+    intent: str | None = None
+    situation: str | None = None  # the teacher's move the student turn answered
+    mistake: str | None = None
+    teacher_model: str | None = None
+    student_model: str | None = None
+    student_type: str | None = None
+    solved: bool | None = None
+    since: float | None = None  # created, unix time
+    until: float | None = None
+    limit: int = 100
+
+    def turn_filters(self) -> bool:
+        return any(v is not None for v in (self.text, self.agent, self.intent, self.situation, self.mistake))
+
+
+class DialogStore:
+    """The store file, shared by threads.
+
+    Writes go through one connection and reads through another, each
+    behind its own lock: in WAL mode a search never waits for an import,
+    though concurrent searches still take turns.
+    """
+
+    def __init__(self, path: str | Path = STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.execute("PRAGMA foreign_keys = ON")
+            self._db.executescript(_SCHEMA)
+        self._read = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._read.row_factory = sqlite3.Row
+        self._read.execute("PRAGMA query_only = ON")
+        self._read_lock = threading.Lock()
+
+    def close(self):
+        self._read.close()
+        self._db.close()
+
+    # ─── Writing ───────────────────────────────────────────────
+
+    def save(self, record: dict, source: str | None = None):
+        """Insert or replace one dialog record (see utils.export.dialog_record)."""
+        self.save_many([record], source)
+
+    def save_many(self, records: Iterable[dict], source: str | None = None, batch: int = 500) -> int:
+        """Insert or replace dialog records, *batch* per transaction. Returns how many."""
+        count = 0
+        pending = []
+        for record in records:
+            pending.append(record)
+            if len(pending) >= batch:
+                count += self._write(pending, source)
+                pending = []
+        if pending:
+            count += self._write(pending, source)
+        return count
+
+    def _write(self, records: list[dict], source: str | None) -> int:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for record in records:
+                    self._insert(record, source)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return len(records)
+
+    def _insert(self, record: dict, source: str | None):
+        dialog_id = record.get("id") or dialog_digest(record["messages"])
+        settings = {**(record.get("config") or {}), **(record.get("job") or {})}
+        total = (record.get("usage") or {}).get("total", {})
+        rows = list(turn_rows({**record, "id": dialog_id}))
+        # Turns go first on re-import (ON DELETE CASCADE would skip the FTS trigger)
+        self._db.execute("DELETE FROM turns WHERE dialog_id = ?", (dialog_id,))
+        self._db.execute(
+            "INSERT OR REPLACE INTO dialogs (id, created, source, teacher_model, student_model, student_type,"
+            " intent_mode, steps, solved, input_tokens, output_tokens, config, extra)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                dialog_id,
+                record.get("created") or time.time(),
+                source,
+                settings.get("teacher_model"),
+                settings.get("student_model"),
+                settings.get("student_type"),
+                settings.get("intent_mode"),
+                rows[-1]["step"] if rows else 0,
+                None if record.get("solved") is None else int(record["solved"]),
+                total.get("input_tokens"),
+                total.get("output_tokens"),
+                json.dumps(record.get("config"), ensure_ascii=False),
+                json.dumps({k: v for k, v in record.items() if k not in _COLUMN_FIELDS}, ensure_ascii=False),
+            ),
+        )
+        self._db.executemany(
+            "INSERT INTO turns (dialog_id, idx, step, agent, content, reasoning, intent_id, situation,"
+            " situation_source, mistake, input_tokens, output_tokens, latency)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    dialog_id, row["index"], row["step"], row["agent"], row["content"],
+                    msg.get("reasoning"), row["intent_id"], row["situation"], row["situation_source"],
+                    row["mistake"], row["input_tokens"], row["output_tokens"], row["latency"],
+                )
+                for row, msg in zip(rows, record["messages"])
+            ],
+        )
+
+    def delete(self, dialog_id: str):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM turns WHERE dialog_id = ?", (dialog_id,))
+                self._db.execute("DELETE FROM dialogs WHERE id = ?", (dialog_id,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    # ─── Reading ───────────────────────────────────────────────
+
+    def search(self, query: DialogQuery) -> list[dict]:
+        """Dialogs matching *query*, newest first.
+
+        Turn filters (text, agent, intent, situation, mistake) must all hold
+        for the same message; each result carries the index of the first
+        matching message ("match_idx") and, for text queries, a snippet.
+        """
+        where, params = [], []
+        for column in ("teacher_model", "student_model", "student_type"):
+            value = getattr(query, column)
+            if value is not None:
+                where.append(f"d.{column} = ?")
+                params.append(value)
+        if query.solved is not None:
+            where.append("d.solved = ?")
+            params.append(int(query.solved))
+        if query.since is not None:
+            where.append("d.created >= ?")
+            params.append(query.since)
+        if query.until is not None:
+            where.append("d.created < ?")
+            params.append(query.until)
+
+        matched = ""
+        if query.turn_filters():
+            turn_where, probe, turn_params = [], [], []
+            for column, value in (
+                ("agent", query.agent), ("intent_id", query.intent),
+                ("situation", query.situation), ("mistake", query.mistake),
+            ):
+                if value is not None:
+                    turn_where.append(f"t.{column} = ?")
+                    probe.append(f"+t.{column} = ?")  # "+": look turns up by dialog_id, not this index
+                    turn_params.append(value)
+            if query.text:
+                turn_where.append("t.rowid IN (SELECT rowid FROM turns_fts WHERE turns_fts MATCH ?)")
+                probe.append(turn_where[-1])  # the IN set is built once per statement
+                turn_params.append(query.text)
+            # First matching turn of each dialog
+            matched = f"(SELECT min(t.rowid) FROM turns t WHERE t.dialog_id = d.id AND {' AND '.join(probe)})"
+
+        filters = " WHERE " + " AND ".join(where) if where else ""
+        with self._read_lock:
+            if not matched:
+                sql = f"SELECT d.*, NULL AS match_rowid FROM dialogs d{filters}"
+            elif self._rare(turn_where, turn_params):
+                # Few matching turns: group them rather than walk every dialog
+                sql = (
+                    "SELECT d.*, m.match_rowid FROM dialogs d JOIN (SELECT t.dialog_id, min(t.rowid) AS match_rowid"
+                    f" FROM turns t WHERE {' AND '.join(turn_where)} GROUP BY t.dialog_id) m"
+                    f" ON m.dialog_id = d.id{filters}"
+                )
+                params = turn_params + params
+            else:
+                # Walk dialogs newest-first and stop once the page is full
+                sql = (
+                    f"SELECT * FROM (SELECT d.*, {matched} AS match_rowid FROM dialogs d{filters})"
+                    " d WHERE match_rowid IS NOT NULL"
+                )
+                params = turn_params + params
+            sql += " ORDER BY d.created DESC LIMIT ?"
+            params.append(query.limit)
+            rows = self._read.execute(sql, params).fetchall()
+            results = [{k: row[k] for k in row.keys() if k not in ("config", "extra")} for row in rows]
+            # Match index and snippet only for the page of results
+            for result in results:
+                rowid = result.pop("match_rowid")
+                if rowid is None:
+                    continue
+                result["match_idx"] = self._read.execute(
+                    "SELECT idx FROM turns WHERE rowid = ?", (rowid,)
+                ).fetchone()[0]
+                if query.text:
+                    result["snippet"] = self._read.execute(
+                        "SELECT snippet(turns_fts, 0, '**', '**', '…', 12) FROM turns_fts"
+                        " WHERE turns_fts MATCH ? AND rowid = ?",
+                        (query.text, rowid),
+                    ).fetchone()[0]
+        return results
+
+    def _rare(self, turn_where: list[str], turn_params: list) -> bool:
+        """Whether the turn filters match few enough turns to group them all.
+
+        Walking dialogs newest-first stops at the first page when matches
+        are common but scans the whole table when they are rare, so the
+        count is capped at _RARE_TURNS and never runs to the end.
+        """
+        sql = f"SELECT count(*) FROM (SELECT 1 FROM turns t WHERE {' AND '.join(turn_where)} LIMIT ?)"
+        return self._read.execute(sql, [*turn_params, _RARE_TURNS + 1]).fetchone()[0] <= _RARE_TURNS
+
+    def get(self, dialog_id: str) -> dict | None:
+        """The stored dialog as a record (config, messages), or None."""
+        with self._read_lock:
+            dialog = self._read.execute("SELECT * FROM dialogs WHERE id = ?", (dialog_id,)).fetchone()
+            if dialog is None:
+                return None
+            turns = self._read.execute(
+                "SELECT * FROM turns WHERE dialog_id = ? ORDER BY idx", (dialog_id,)
+            ).fetchall()
+        messages = [
+            {
+                "agent": t["agent"],
+                "content": t["content"],
+                "reasoning": t["reasoning"],
+                "intent_id": t["intent_id"],
+                "situation": t["situation"],
+                "situation_source": t["situation_source"],
+                "mistake": t["mistake"],
+            }
+            for t in turns
+        ]
+        return {
+            "id": dialog["id"],
+            "created": dialog["created"],
+            "source": dialog["source"],
+            "solved": None if dialog["solved"] is None else bool(dialog["solved"]),
+            "steps": dialog["steps"],
+            "config": json.loads(dialog["config"] or "null"),
+            **json.loads(dialog["extra"] or "{}"),
+            "messages": messages,
+        }
+
+    def values(self, column: str) -> list[str]:
+        """Distinct values of a dialogs or turns column (for filter choices)."""
+        table = "turns" if column in ("intent_id", "situation", "mistake") else "dialogs"
+        if column not in ("teacher_model", "student_model", "student_type", "intent_id", "situation", "mistake"):
+            raise ValueError(f"Not a filter column: {column}")
+        with self._read_lock:
+            rows = self._read.execute(
+                f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL ORDER BY {column}"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> tuple[int, int]:
+        """(dialogs, turns) in the store."""
+        with self._read_lock:
+            dialogs = self._read.execute("SELECT count(*) FROM dialogs").fetchone()[0]
+            turns = self._read.execute("SELECT count(*) FROM turns").fetchone()[0]
+        return dialogs, turns
+
+
+_store: DialogStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> DialogStore:
+    """The process-wide store at STORE_PATH."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DialogStore()
+        return _store
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m utils.store", description="Local dialog store.")
+    parser.add_argument("--db", default=STORE_PATH, help="store file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("import", help="add dialog corpora (JSONL, .gz, .zst) or JSON exports")
+    p.add_argument("sources", nargs="+")
+
+    p = commands.add_parser("search", help="find dialogs")
+    p.add_argument("--text", help="FTS5 query over message text, e.g. 'дроб*'")
+    p.add_argument("--agent", choices=["teacher", "student"])
+    p.add_argument("--intent")
+    p.add_argument("--situation")
+    p.add_argument("--mistake")
+    p.add_argument("--teacher-model")
+    p.add_argument("--student-model")
+    p.add_argument("--student-type")
+    p.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args(argv)
+    store = DialogStore(args.db)
+    try:
+        if args.command == "import":
+            started = time.monotonic()
+            for source in args.sources:
+                count = store.save_many(read_records([source]), source=Path(source).name)
+                print(f"{source}: {count} dialogs")
+            dialogs, turns = store.count()
+            print(f"{dialogs} dialogs, {turns} turns in {args.db} ({time.monotonic() - started:.1f} s)")
+            return 0
+
+        query = DialogQuery(
+            text=args.text, agent=args.agent, intent=args.intent, situation=args.situation,
+            mistake=args.mistake, teacher_model=args.teacher_model, student_model=args.student_model,
+            student_type=args.student_type, limit=args.limit,
+        )
+        started = time.monotonic()
+        rows = store.search(query)
+        for row in rows:
+            match = f" #{row['match_idx']}" if row.get("match_idx") is not None else ""
+            print(f"{row['id']}{match}  {row['student_type']} / {row['teacher_model']} / {row['student_model']}"
+                  f"  {row['steps']} steps{' solved' if row['solved'] else ''}")
+            if row.get("snippet"):
+                print(f"    {row['snippet']}")
+        print(f"{len(rows)} dialogs ({(time.monotonic() - started) * 1000:.0f} ms)", file=sys.stderr)
+        return 0
+    except sqlite3.OperationalError as e:
+        print(e, file=sys.stderr)
+        return 2
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
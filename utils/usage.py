@@ -0,0 +1,35 @@
+"""Token usage and latency totals over a dialog's messages."""
+
+_COUNTERS = ("input_tokens", "output_tokens", "thinking_tokens", "cached_tokens", "retries")
+
+
+def _empty() -> dict:
+    return {"calls": 0, **{k: 0 for k in _COUNTERS}, "latency": 0.0}
+
+
+def _add(total: dict, usage: dict):
+    total["calls"] += 1
+    for key in _COUNTERS:
+        total[key] += usage.get(key) or 0
+    total["latency"] = round(total["latency"] + (usage.get("latency") or 0.0), 3)
+
+
+def dialog_usage(messages: list[dict]) -> dict:
+    """Sum the "usage" / "classifier_usage" / "summary_usage" of messages.
+
+    Returns {"teacher": ..., "student": ..., "classifier": ..., "summary": ...,
+    "total": ...},
+    each with calls, input/output/thinking/cached tokens, retries and latency (s).
+    """
+    totals = {name: _empty() for name in ("teacher", "student", "classifier", "summary", "total")}
+    for msg in messages:
+        usage = msg.get("usage")
+        if usage:
+            _add(totals[msg["agent"]], usage)
+            _add(totals["total"], usage)
+        for key, bucket in (("classifier_usage", "classifier"), ("summary_usage", "summary")):
+            usage = msg.get(key)
+            if usage:
+                _add(totals[bucket], usage)
+                _add(totals["total"], usage)
+    return totals